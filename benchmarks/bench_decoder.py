@@ -0,0 +1,76 @@
+"""Microbenchmark of decoding SPARQL bindings into WikiDataAnswer data
+
+Decodes a fixture of 100k bindings (labels, timestamps and quantities)
+with the previous per-binding decoder, using dget and dateutil, and with
+WikiDataAnswer.get_data. Run from the repository root:
+    python benchmarks/bench_decoder.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dateutil import parser
+from nlquery.utils import dget
+from nlquery.wikidata import WikiDataAnswer
+
+TIME_VALUE = WikiDataAnswer.TIME_VALUE
+QUANTITY_VALUE = WikiDataAnswer.QUANTITY_VALUE
+
+
+def make_bindings(n=100000):
+    """Makes bindings like those of a SPARQL result, a third of each kind"""
+    bindings = []
+    for i in xrange(n):
+        if i % 3 == 0:
+            bindings.append({'valLabel': {'type': 'literal', 'value': 'Entity %d' % i}})
+        elif i % 3 == 1:
+            bindings.append({
+                'valLabel': {'type': 'literal',
+                             'value': '%04d-%02d-%02dT00:00:00Z' % (1900 + i % 100,
+                                                                    1 + i % 12, 1 + i % 28)},
+                'type': {'type': 'uri', 'value': TIME_VALUE},
+            })
+        else:
+            bindings.append({
+                'valLabel': {'type': 'literal', 'value': str(i)},
+                'type': {'type': 'uri', 'value': QUANTITY_VALUE},
+            })
+    return bindings
+
+
+def get_value(data):
+    """Previous decoder of a binding"""
+    data_type = dget(data, 'type.value')
+    value = dget(data, 'valLabel.value')
+
+    if data_type == TIME_VALUE:
+        dt = parser.parse(value)
+        dt = dt.replace(tzinfo=None)
+        return dt
+    elif data_type == QUANTITY_VALUE:
+        if value.isdigit():
+            return float(value)
+        return value
+    else:
+        return value
+
+
+def main(number=1):
+    bindings = make_bindings()
+    assert [get_value(b) for b in bindings] == WikiDataAnswer.get_data(bindings)
+
+    old_time = min(timeit.repeat(lambda: [get_value(b) for b in bindings],
+                                 number=number, repeat=3))
+    new_time = min(timeit.repeat(lambda: WikiDataAnswer.get_data(bindings),
+                                 number=number, repeat=3))
+
+    print 'Decoded {0} bindings'.format(len(bindings))
+    print 'Previous decoder: {0:8.3f} s'.format(old_time / number)
+    print 'get_data:         {0:8.3f} s'.format(new_time / number)
+    print 'Speedup:          {0:8.1f}x'.format(old_time / new_time)
+
+
+if __name__ == '__main__':
+    main()
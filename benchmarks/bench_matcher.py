@@ -0,0 +1,52 @@
+"""Microbenchmark of the compiled rule matcher against lango's string rules
+
+Run from the repository root:
+    python benchmarks/bench_matcher.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lango.matcher import match_rules_context
+from nlquery.matcher import compile_rules
+from nlquery.rules import SUBJECT_PROP_RULES, FIND_ENTITY_RULES
+from nltk.tree import Tree
+
+TREES_PATH = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', 'trees.tsv')
+
+
+def load_trees():
+    with open(TREES_PATH) as f:
+        return [Tree.fromstring(line.split('\t')[1]) for line in f if line.strip()]
+
+
+def main(number=200):
+    trees = load_trees()
+    tables = [FIND_ENTITY_RULES, SUBJECT_PROP_RULES]
+    compiled_tables = [compile_rules(rules) for rules in tables]
+
+    def string_rules():
+        for tree in trees:
+            for rules in tables:
+                match_rules_context(tree, rules)
+
+    def compiled_rules():
+        for tree in trees:
+            for rules in compiled_tables:
+                rules.match_context(tree)
+
+    matches = len(trees) * len(tables) * number
+    string_time = min(timeit.repeat(string_rules, number=number, repeat=3))
+    compiled_time = min(timeit.repeat(compiled_rules, number=number, repeat=3))
+
+    print 'Matched {0} trees against {1} rule tables {2} times'.format(
+        len(trees), len(tables), number)
+    print 'String rules:   {0:8.1f} us/match'.format(string_time / matches * 1e6)
+    print 'Compiled rules: {0:8.1f} us/match'.format(compiled_time / matches * 1e6)
+    print 'Speedup:        {0:8.1f}x'.format(string_time / compiled_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Replay benchmark of the query engine, reproducible without a network
+
+The committed recordings/corpus.json is generated from the fixture trees
+and sample Wikidata data by generate_recording.py. To record the parse
+trees and Wikidata responses of the live services instead, with the
+CoreNLP server running on localhost:9000 and network access:
+    python benchmarks/bench_replay.py record
+
+Then replay them through local stand-ins of CoreNLP and Wikidata, with
+injected latency in milliseconds:
+    python benchmarks/bench_replay.py replay --parse-latency 20 \\
+        --search-latency 50 --sparql-latency 200
+
+Reports throughput, p50/p95/p99 latency and per stage latency of
+NLQueryEngine.query, answering the corpus one query at a time, and of
+NLQueryEngine.query_many. Caches are cleared before each pass unless
+--warm. Run from the repository root.
+"""
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from nlquery.nlquery import NLQueryEngine
+from corpus import CORPUS, summary
+from standins import Recording, CoreNLPStandIn, WikidataStandIn, serve, point_engine, \
+    RECORDING_PATH
+
+STAGES = ['parse', 'match', 'resolve', 'search', 'sparql', 'decode']
+
+
+def report(name, elapsed, latencies, answers):
+    """Prints throughput, latency and stage breakdown of a run"""
+    print '{0}: {1} queries in {2:.2f} s, {3:.1f} queries/s'.format(
+        name, len(answers), elapsed, len(answers) / elapsed)
+    print '  {0:8} {1}'.format('query', summary(latencies))
+    stages = dict((stage, []) for stage in STAGES)
+    for ans in answers:
+        trace = ans.get('trace') or {}
+        for stage in STAGES:
+            stages[stage].append(trace.get('stages', {}).get(stage, 0.0))
+    for stage in STAGES:
+        print '  {0:8} {1}'.format(stage, summary(stages[stage]))
+
+
+def clear_caches(engine):
+    engine.parser.cache.clear()
+    engine.wd.id_cache.clear()
+    engine.wd.sparql_cache.cache.clear()
+    engine.wd.answer_cache.clear()
+
+
+def record(args):
+    engine = NLQueryEngine()
+    recording = Recording()
+    recording.record(engine)
+    for sent in CORPUS:
+        print sent, engine.query(sent)
+    directory = os.path.dirname(args.recording)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    recording.save(args.recording)
+    print 'Recorded {0} trees and {1} responses to {2}'.format(
+        len(recording.trees), len(recording.responses), args.recording)
+
+
+def replay(args):
+    recording = Recording.load(args.recording)
+    corenlp = CoreNLPStandIn(recording, latency=args.parse_latency / 1000.0)
+    wikidata = WikidataStandIn(recording, latency=args.search_latency / 1000.0,
+                               sparql_latency=args.sparql_latency / 1000.0,
+                               max_in_flight=args.max_in_flight)
+    corenlp_server = serve(corenlp)
+    wikidata_server = serve(wikidata)
+    engine = NLQueryEngine('127.0.0.1', corenlp_server.server_port, trace=True)
+    point_engine(engine, wikidata_server)
+    # Logging every tree and request would dominate timings
+    for logger in [engine.logger, engine.wd.logger]:
+        logger.setLevel(logging.WARNING)
+    corpus = [sent for _ in range(args.repeat) for sent in CORPUS]
+
+    try:
+        for run in range(args.passes):
+            if not args.warm:
+                clear_caches(engine)
+            latencies = []
+            answers = []
+            start = timeit.default_timer()
+            for sent in corpus:
+                query_start = timeit.default_timer()
+                answers.append(engine.query(sent, format_='raw'))
+                latencies.append((timeit.default_timer() - query_start) * 1000)
+            report('query, pass {0}'.format(run + 1),
+                   timeit.default_timer() - start, latencies, answers)
+
+            if not args.warm:
+                clear_caches(engine)
+            start = timeit.default_timer()
+            answers = engine.query_many(corpus, format_='raw',
+                                        concurrency=args.concurrency)
+            elapsed = timeit.default_timer() - start
+            # Queries of a batch overlap, their latency is their trace total
+            latencies = [(ans.get('trace') or {}).get('total', 0.0) for ans in answers]
+            report('query_many, pass {0}'.format(run + 1), elapsed, latencies, answers)
+    finally:
+        corenlp_server.stop()
+        wikidata_server.stop()
+
+    print 'Stand-in requests: corenlp {0}, wikidata {1}, not recorded {2}, ' \
+        'throttled {3}'.format(corenlp.requests, wikidata.requests,
+                               corenlp.misses + wikidata.misses, wikidata.throttled)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('--recording', default=RECORDING_PATH,
+                        help='Path of the recording')
+    parser.add_argument('--passes', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Times to repeat the corpus in a pass')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='Queries in flight of query_many')
+    parser.add_argument('--parse-latency', type=float, default=0,
+                        help='Milliseconds of latency of CoreNLP')
+    parser.add_argument('--search-latency', type=float, default=0,
+                        help='Milliseconds of latency of wbsearchentities')
+    parser.add_argument('--sparql-latency', type=float, default=0,
+                        help='Milliseconds of latency of SPARQL queries')
+    parser.add_argument('--max-in-flight', type=int,
+                        help='Wikidata requests answered at once, more get a 429')
+    parser.add_argument('--warm', action='store_true',
+                        help='Keep caches between passes')
+    args = parser.parse_args(argv)
+    if args.mode == 'record':
+        record(args)
+    else:
+        replay(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
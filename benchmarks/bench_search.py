@@ -0,0 +1,53 @@
+"""Microbenchmark of entity search in the local store
+
+Builds a store from the test fixture dump, or uses the store given as
+argument. Run from the repository root:
+    python benchmarks/bench_search.py [STORE_DIR]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from nlquery.local_store import build_store, TripleStore
+
+DUMP_PATH = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures',
+                         'wikidata_dump.json')
+LOOKUPS = [
+    ('obama', 'item'), ('barack obama', 'item'), ('china', 'item'),
+    ('yao ming', 'item'), ('president of united states', 'item'),
+    ('nobody', 'item'), ('wife', 'property'), ('population', 'property'),
+    ('pe', 'item'), ('a', 'item'),
+]
+
+
+def main(argv, number=2000):
+    tmp_dir = None
+    if argv:
+        store_dir = argv[0]
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        store_dir = tmp_dir
+        build_store(DUMP_PATH, store_dir)
+
+    try:
+        store = TripleStore(store_dir)
+
+        def search():
+            for name, _type in LOOKUPS:
+                store.search(name, _type)
+
+        searches = len(LOOKUPS) * number
+        search_time = min(timeit.repeat(search, number=number, repeat=3))
+        print 'Searched {0} names {1} times'.format(len(LOOKUPS), number)
+        print 'Search: {0:8.1f} us/lookup'.format(search_time / searches * 1e6)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
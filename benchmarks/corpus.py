@@ -0,0 +1,39 @@
+"""Questions and statistics shared by the benchmarks
+
+CORPUS holds the readme examples and the questions of tests/test_full.py.
+"""
+
+CORPUS = [
+    'Who is Obama?',
+    'How tall is Yao Ming?',
+    'Where was Obama born?',
+    'When was Obama born?',
+    'Who did Obama marry?',
+    'Who is Obama\'s wife?',
+    'Who is Barack Obama\'s wife?',
+    'Who was Malcolm Little known as?',
+    'What is the birthday of Obama?',
+    'What religion is Obama?',
+    'Who married Obama?',
+    'How many countries are there?',
+    'Which countries have a population over 1000000000?',
+    'Which books are written by Douglas Adams?',
+    'Who was POTUS in 1945?',
+    'Who was Prime Minister of Canada in 1945?',
+    'Who was CEO of Apple Inc in 1980?',
+]
+
+
+def percentile(values, p):
+    """Gets the nearest rank percentile p of values"""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = int(round(p / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def summary(latencies):
+    """Formats p50/p95/p99 of latencies in milliseconds"""
+    return 'p50 {0:8.1f}  p95 {1:8.1f}  p99 {2:8.1f}'.format(
+        *[percentile(latencies, p) for p in [50, 95, 99]])
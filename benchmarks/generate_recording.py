@@ -0,0 +1,153 @@
+"""Generates a recording of the corpus without CoreNLP or network access
+
+Parse trees are those of tests/fixtures/trees.tsv, and Wikidata searches
+and SPARQL queries are answered from the small tables below, so that a
+replay goes through every stage of the engine like a recording of the live
+services would. Regenerate it when the engine changes the requests it
+sends:
+    python benchmarks/generate_recording.py
+
+Use bench_replay.py record instead to record the live services.
+"""
+import logging
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from nltk.tree import Tree
+from nlquery.nlquery import NLQueryEngine
+from corpus import CORPUS
+from standins import Recording, RECORDING_PATH
+
+TREES_PATH = os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', 'trees.tsv')
+
+TIME_VALUE = 'http://wikiba.se/ontology#TimeValue'
+QUANTITY_VALUE = 'http://wikiba.se/ontology#QuantityValue'
+
+# Searched name of an item to (ID, label, description)
+ITEMS = {
+    'obama': ('Q76', 'Barack Obama', '44th President of the United States'),
+    'barack obama': ('Q76', 'Barack Obama', '44th President of the United States'),
+    'yao ming': ('Q41421', 'Yao Ming', 'Chinese basketball player'),
+    'malcolm little': ('Q43303', 'Malcolm X', 'American Muslim minister and human rights activist'),
+    'country': ('Q6256', 'country', 'distinct region in geography'),
+    'book': ('Q571', 'book', 'medium for recording information'),
+    'douglas adams': ('Q42', 'Douglas Adams', 'English writer and humorist'),
+    'potus': ('Q11696', 'President of the United States', 'head of state and government of the United States'),
+    'prime minister of canada': ('Q839078', 'Prime Minister of Canada', 'head of government of Canada'),
+    'ceo': ('Q484876', 'chief executive officer', 'highest-ranking corporate officer'),
+    'apple inc': ('Q312', 'Apple Inc.', 'American technology company'),
+}
+# Searched name of a property missing from the lexicon to (ID, label, description)
+PROPERTIES = {
+    'written': ('P50', 'author', 'main creator of a written work'),
+}
+
+# (subject ID, property ID) to (value, type) of statements
+STATEMENTS = {
+    ('Q76', 'P19'): [('Kapiolani Medical Center for Women and Children', None)],
+    ('Q76', 'P569'): [('1961-08-04T00:00:00Z', TIME_VALUE)],
+    ('Q76', 'P26'): [('Michelle Obama', None)],
+    ('Q76', 'P140'): [('Christianity', None)],
+    ('Q41421', 'P2048'): [('2.286', QUANTITY_VALUE)],
+}
+
+# Subject ID to aliases
+ALIASES = {
+    'Q43303': ['Malcolm Little', 'El-Hajj Malik El-Shabazz', 'Malcolm X'],
+}
+
+# Instance ID to entities found, all entities of a count
+ENTITY_LABELS = {
+    'Q6256': ['People\'s Republic of China', 'India'],
+    'Q571': ['The Hitchhiker\'s Guide to the Galaxy', 'The Restaurant at the End of the Universe',
+             'Life, the Universe and Everything', 'So Long, and Thanks for All the Fish'],
+    'Q11696': ['Franklin D. Roosevelt', 'Harry S. Truman'],
+    'Q839078': ['William Lyon Mackenzie King'],
+    'Q484876': ['Steve Jobs', 'Mike Markkula'],
+}
+COUNTS = {
+    'Q6256': '195',
+}
+
+
+def bindings(values):
+    """Builds SPARQL bindings of (value, type) tuples"""
+    result = []
+    for value, value_type in values:
+        binding = {'valLabel': {'type': 'literal', 'value': value}}
+        if value_type:
+            binding['type'] = {'type': 'uri', 'value': value_type}
+        result.append(binding)
+    return {'results': {'bindings': result}}
+
+
+def search(params):
+    """Answers a wbsearchentities request"""
+    entities = ITEMS if params['type'] == 'item' else PROPERTIES
+    entity = entities.get(params['search'].lower())
+    if entity is None:
+        return {'search': [], 'success': 1}
+    entity_id, label, description = entity
+    return {'search': [{'id': entity_id, 'label': label, 'description': description}],
+            'success': 1}
+
+
+def sparql(query):
+    """Answers a SPARQL query of the shapes the engine sends"""
+    instance = re.search(r'ps:P39 wd:(Q\d+)', query)
+    if 'count(*)' in query:
+        return {'results': {'bindings': [
+            {'count': {'type': 'literal', 'value': COUNTS.get(instance.group(1), '0')}}]}}
+    if instance:
+        return bindings((label, None) for label in ENTITY_LABELS.get(instance.group(1), []))
+    if 'skos:altLabel' in query:
+        subject_id = re.search(r'wd:(Q\d+)', query).group(1)
+        return bindings((alias, None) for alias in ALIASES.get(subject_id, []))
+    return bindings(value for pair in re.findall(r'wd:(Q\d+) p:(P\d+)', query)
+                    for value in STATEMENTS.get(pair, []))
+
+
+class FixtureParser(object):
+    """Parser answering with the trees of tests/fixtures/trees.tsv"""
+
+    def __init__(self):
+        with open(TREES_PATH) as f:
+            self.trees = dict(line.rstrip('\n').split('\t') for line in f if line.strip())
+
+    def parse(self, sent):
+        return Tree.fromstring(self.trees[sent])
+
+
+def main(argv):
+    path = argv[0] if argv else RECORDING_PATH
+    engine = NLQueryEngine()
+    engine.parser.parser = FixtureParser()
+    for logger in [engine.logger, engine.wd.logger]:
+        logger.setLevel(logging.WARNING)
+
+    def get(url, params={}, **kwargs):
+        if url == engine.wd.WDSPARQL_URL:
+            return sparql(params['query'])
+        return search(params)
+
+    def get_many(calls, **kwargs):
+        return [get(url, params) for url, params in calls]
+    engine.wd.get, engine.wd.get_many = get, get_many
+
+    recording = Recording()
+    recording.record(engine)
+    for sent in CORPUS:
+        print sent, engine.query(sent)
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    recording.save(path)
+    print 'Generated {0} trees and {1} responses to {2}'.format(
+        len(recording.trees), len(recording.responses), path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
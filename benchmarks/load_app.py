@@ -0,0 +1,260 @@
+"""HTTP load test of nlquery-app with stand-ins of CoreNLP and Wikidata
+
+Starts nlquery-app in a subprocess, pointed at local stand-ins replaying
+a recording of bench_replay.py, and drives /query with a mix of
+questions at each level of load. Closed loop, with a number of clients
+sending their next question when answered:
+    python benchmarks/load_app.py --concurrency 1,4,16,64 --duration 10
+
+Open loop, with questions arriving at a rate per second whether or not
+earlier ones were answered:
+    python benchmarks/load_app.py --rate 10,50,100 --duration 10
+
+Reports throughput, p50/p95/p99 latency and error rate of each level.
+Latency and error rate of the stand-ins are set with --parse-latency,
+--search-latency, --sparql-latency and --error-rate. Run from the
+repository root.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import bisect
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import gevent
+import requests
+from requests.adapters import HTTPAdapter
+
+from corpus import CORPUS, summary
+from standins import Recording, CoreNLPStandIn, WikidataStandIn, serve, RECORDING_PATH
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+APP_DIR = os.path.join(ROOT_DIR, 'nlquery-app')
+
+
+class QuestionMix(object):
+    """Questions picked at random by weight
+
+    Args:
+        questions (list): (weight, question) tuples
+        seed (int, optional): Seed of the picks
+    """
+
+    def __init__(self, questions, seed=None):
+        self.questions = [question for _, question in questions]
+        self.cumulative = []
+        total = 0
+        for weight, _ in questions:
+            total += weight
+            self.cumulative.append(total)
+        self.random = random.Random(seed)
+
+    @classmethod
+    def load(cls, path, seed=None):
+        """Loads a mix of lines of a question, or a weight, a tab and a question"""
+        questions = []
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                weight, _, question = line.rpartition('\t')
+                questions.append((float(weight) if weight else 1.0, question))
+        return cls(questions, seed)
+
+    def pick(self):
+        point = self.random.uniform(0, self.cumulative[-1])
+        return self.questions[bisect.bisect_left(self.cumulative, point)]
+
+
+class Results(object):
+    """Latencies in milliseconds and errors of the requests of a level"""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.statuses = {}
+        self.elapsed = None
+
+    def add(self, latency, status):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status != 200:
+            self.errors += 1
+
+    def __len__(self):
+        return len(self.latencies)
+
+
+def send(session, url, question, timeout, results):
+    start = time.time()
+    try:
+        status = session.post(url, data=json.dumps({'q': question}),
+                              timeout=timeout).status_code
+    except requests.exceptions.Timeout:
+        status = 'timeout'
+    except requests.exceptions.RequestException:
+        status = 'error'
+    results.add((time.time() - start) * 1000, status)
+
+
+def make_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    return session
+
+
+def closed_loop(url, mix, concurrency, duration, timeout):
+    """Runs clients sending their next question when answered"""
+    results = Results()
+    session = make_session(concurrency)
+    deadline = time.time() + duration
+
+    def client():
+        while time.time() < deadline:
+            send(session, url, mix.pick(), timeout, results)
+
+    start = time.time()
+    gevent.joinall([gevent.spawn(client) for _ in range(concurrency)])
+    results.elapsed = time.time() - start
+    return results
+
+
+def open_loop(url, mix, rate, duration, timeout):
+    """Sends questions arriving at random at rate per second"""
+    results = Results()
+    session = make_session(max(10, int(rate * timeout)))
+    start = time.time()
+    deadline = start + duration
+    requests_ = []
+    while time.time() < deadline:
+        requests_.append(gevent.spawn(send, session, url, mix.pick(), timeout, results))
+        gevent.sleep(mix.random.expovariate(rate))
+    gevent.joinall(requests_)
+    results.elapsed = time.time() - start
+    return results
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('nlquery-app exited with {0}'.format(process.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            gevent.sleep(0.1)
+    raise RuntimeError('nlquery-app did not start on port {0}'.format(port))
+
+
+def start_app(port, corenlp_server, wikidata_server, log, app_args=()):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT_DIR, env.get('PYTHONPATH')]))
+    process = subprocess.Popen([
+        sys.executable, 'main.py',
+        '--port={0}'.format(port),
+        '--corenlp_host=127.0.0.1',
+        '--corenlp_port={0}'.format(corenlp_server.server_port),
+        '--wikidata_url=http://127.0.0.1:{0}'.format(wikidata_server.server_port),
+    ] + list(app_args), cwd=APP_DIR, env=env, stdout=log, stderr=log)
+    wait_for_port(port, process)
+    return process
+
+
+def parse_levels(levels):
+    return [float(level) for level in levels.split(',')]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--recording', default=RECORDING_PATH,
+                        help='Path of the recording, see bench_replay.py')
+    parser.add_argument('--questions',
+                        help='File of the question mix, a question or a weight, '
+                        'a tab and a question per line. Default to the corpus')
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help='Comma separated numbers of clients of a closed loop')
+    parser.add_argument('--rate', help='Comma separated questions per second of an '
+                        'open loop, instead of a closed loop')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds of each level')
+    parser.add_argument('--warmup', type=float, default=2,
+                        help='Seconds of load before the first level')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='Seconds to wait for an answer')
+    parser.add_argument('--parse-latency', type=float, default=0,
+                        help='Milliseconds of latency of CoreNLP')
+    parser.add_argument('--search-latency', type=float, default=0,
+                        help='Milliseconds of latency of wbsearchentities')
+    parser.add_argument('--sparql-latency', type=float, default=0,
+                        help='Milliseconds of latency of SPARQL queries')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Fraction of stand-in requests failing with a 500')
+    parser.add_argument('--port', type=int, default=8889, help='Port of the app')
+    parser.add_argument('--app-arg', action='append', default=[],
+                        help='Option of the app, e.g. --app-arg=--mode=async')
+    parser.add_argument('--app-log', default=os.devnull,
+                        help='File to write the output of the app to')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.questions:
+        mix = QuestionMix.load(args.questions, args.seed)
+    else:
+        mix = QuestionMix([(1, question) for question in CORPUS], args.seed)
+
+    recording = Recording.load(args.recording)
+    corenlp = CoreNLPStandIn(recording, latency=args.parse_latency / 1000.0,
+                             error_rate=args.error_rate, seed=args.seed)
+    wikidata = WikidataStandIn(recording, latency=args.search_latency / 1000.0,
+                               sparql_latency=args.sparql_latency / 1000.0,
+                               error_rate=args.error_rate, seed=args.seed)
+    corenlp_server = serve(corenlp)
+    wikidata_server = serve(wikidata)
+
+    if args.rate:
+        levels, run, name = parse_levels(args.rate), open_loop, 'rate'
+    else:
+        levels, run, name = [int(level) for level in parse_levels(args.concurrency)], \
+            closed_loop, 'clients'
+
+    url = 'http://127.0.0.1:{0}/query'.format(args.port)
+    with open(args.app_log, 'a') as log:
+        app = start_app(args.port, corenlp_server, wikidata_server, log, args.app_arg)
+        try:
+            if args.warmup:
+                run(url, mix, levels[0], args.warmup, args.timeout)
+            print '{0:>8} {1:>9} {2:>40} {3:>7}'.format(
+                name, 'answers/s', 'latency (ms)', 'errors')
+            for level in levels:
+                results = run(url, mix, level, args.duration, args.timeout)
+                print '{0:>8} {1:9.1f} {2:>40} {3:7.2%}'.format(
+                    level, len(results) / results.elapsed, summary(results.latencies),
+                    float(results.errors) / len(results) if len(results) else 0)
+                failed = dict((status, count) for status, count in results.statuses.items()
+                              if status != 200)
+                if failed:
+                    print '{0:>8} failed: {1}'.format('', failed)
+        finally:
+            app.terminate()
+            app.wait()
+            corenlp_server.stop()
+            wikidata_server.stop()
+
+    print 'Stand-in requests: corenlp {0}, wikidata {1}, not recorded {2}, ' \
+        'injected errors {3}'.format(corenlp.requests, wikidata.requests,
+                                     corenlp.misses + wikidata.misses,
+                                     corenlp.errors + wikidata.errors)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,215 @@
+"""Local stand-ins of CoreNLP and Wikidata replaying recorded responses
+
+A Recording holds the parse trees of sentences and the responses of
+Wikidata API and SPARQL requests, recorded once from the live services.
+CoreNLPStandIn and WikidataStandIn are WSGI apps serving a recording with
+injected latency and errors, see serve.
+"""
+import json
+import os
+import random
+import sys
+import urllib
+import urlparse
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+RECORDING_PATH = os.path.join(os.path.dirname(__file__), 'recordings', 'corpus.json')
+
+WIKIDATA_PATH = '/w/api.php'
+SPARQL_PATH = '/sparql'
+
+
+def request_key(path, params):
+    """Gets the key of a request, its path and sorted query string"""
+    params = sorted((k, v.encode('utf-8') if isinstance(v, unicode) else v)
+                    for k, v in params.iteritems())
+    return path + '?' + urllib.urlencode(params)
+
+
+class Recording(object):
+    """Parse trees and HTTP responses recorded from the live services
+
+    Args:
+        trees (dict, optional): Sentence to bracketed parse tree, with the
+            ROOT node as returned by CoreNLP
+        responses (dict, optional): Request key to JSON response, see
+            request_key
+    """
+
+    def __init__(self, trees=None, responses=None):
+        self.trees = trees or {}
+        self.responses = responses or {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['trees'], data['responses'])
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'trees': self.trees, 'responses': self.responses}, f,
+                      indent=1, sort_keys=True)
+
+    def record(self, engine):
+        """Records the trees and responses of queries answered by engine
+
+        Wraps the CoreNLP parser and the HTTP methods of the WikiData
+        adapter of the engine.
+        """
+        parser = engine.parser.parser
+        parse = parser.parse
+
+        def recording_parse(sent):
+            tree = parse(sent)
+            if len(tree):
+                self.trees[sent] = '(ROOT %s)' % tree.pformat(margin=sys.maxint)
+            return tree
+        parser.parse = recording_parse
+
+        wd = engine.wd
+        get, get_many = wd.get, wd.get_many
+
+        def store(url, params, data):
+            if data is not None:
+                self.responses[request_key(urlparse.urlparse(url).path, params)] = data
+
+        def recording_get(url, params={}, **kwargs):
+            data = get(url, params, **kwargs)
+            store(url, params, data)
+            return data
+
+        def recording_get_many(calls, **kwargs):
+            results = get_many(calls, **kwargs)
+            for (url, params), data in zip(calls, results):
+                store(url, params, data)
+            return results
+        wd.get, wd.get_many = recording_get, recording_get_many
+
+
+class StandIn(object):
+    """WSGI app answering after injected latency, or failing at a rate
+
+    Args:
+        recording (Recording): Recording to serve
+        latency (float, optional): Seconds to wait before answering.
+            Default to 0
+        jitter (float, optional): Seconds of uniform random latency added.
+            Default to 0
+        error_rate (float, optional): Fraction of requests answered with a
+            500. Default to 0
+        seed (int, optional): Seed of the random errors and jitter
+        max_in_flight (int, optional): Requests answered at once, more are
+            answered with a 429 like WDQS does. Default to None, no limit
+    """
+
+    def __init__(self, recording, latency=0, jitter=0, error_rate=0, seed=None,
+                 max_in_flight=None):
+        self.recording = recording
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.requests = 0
+        self.misses = 0
+        self.errors = 0
+        self.throttled = 0
+
+    def __call__(self, environ, start_response):
+        self.requests += 1
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            self.throttled += 1
+            return self.respond(start_response, '429 Too Many Requests', 'Throttled')
+
+        self.in_flight += 1
+        try:
+            delay = self.latency_of(environ) + self.random.uniform(0, self.jitter)
+            if delay:
+                gevent.sleep(delay)
+        finally:
+            self.in_flight -= 1
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            return self.respond(start_response, '500 Internal Server Error', 'Injected error')
+
+        body = self.answer(environ)
+        if body is None:
+            self.misses += 1
+            return self.respond(start_response, '404 Not Found', 'Not recorded')
+        return self.respond(start_response, '200 OK', json.dumps(body), 'application/json')
+
+    def latency_of(self, environ):
+        """Gets seconds to wait before answering a request"""
+        return self.latency
+
+    @staticmethod
+    def respond(start_response, status, body, content_type='text/plain'):
+        start_response(status, [('Content-Type', content_type),
+                                ('Content-Length', str(len(body)))])
+        return [body]
+
+    def answer(self, environ):
+        """Gets the JSON response to a request, or None if not recorded"""
+        raise NotImplementedError
+
+
+class CoreNLPStandIn(StandIn):
+    """Stand-in of the CoreNLP server, answering with recorded parse trees"""
+
+    def answer(self, environ):
+        if environ['REQUEST_METHOD'] != 'POST':
+            # Liveness check of the CoreNLP client
+            return {}
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        sent = environ['wsgi.input'].read(length).decode('utf-8')
+        tree = self.recording.trees.get(sent)
+        if tree is None:
+            return None
+        return {'sentences': [{'parse': tree}]}
+
+
+class WikidataStandIn(StandIn):
+    """Stand-in of the Wikidata API and SPARQL endpoints
+
+    Args:
+        sparql_latency (float, optional): Seconds to wait before answering
+            SPARQL queries. Default to latency
+        See StandIn for other args
+    """
+
+    def __init__(self, recording, sparql_latency=None, **kwargs):
+        StandIn.__init__(self, recording, **kwargs)
+        self.sparql_latency = sparql_latency
+
+    def latency_of(self, environ):
+        if self.sparql_latency is not None and environ['PATH_INFO'] == SPARQL_PATH:
+            return self.sparql_latency
+        return self.latency
+
+    def answer(self, environ):
+        params = dict(urlparse.parse_qsl(environ.get('QUERY_STRING', ''),
+                                         keep_blank_values=True))
+        return self.recording.responses.get(request_key(environ['PATH_INFO'], params))
+
+
+def serve(app, host='127.0.0.1', port=0):
+    """Serves a WSGI app in the background, port 0 picks a free port
+
+    Returns:
+        WSGIServer: Started server, see its server_port
+    """
+    server = WSGIServer((host, port), app, log=None)
+    server.start()
+    return server
+
+
+def point_engine(engine, wikidata_server):
+    """Points the WikiData adapter of an engine at a Wikidata stand-in"""
+    url = 'http://{0}:{1}'.format(wikidata_server.server_host,
+                                  wikidata_server.server_port)
+    engine.wd.WIKIDATA_URL = url + WIKIDATA_PATH
+    engine.wd.WDSPARQL_URL = url + SPARQL_PATH
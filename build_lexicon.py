@@ -0,0 +1,14 @@
+from nlquery.local_store import build_lexicon
+from nlquery.lexicon import DEFAULT_PATH
+import sys
+
+def main(argv):
+    if len(argv) < 2:
+        print "Usage: python build_lexicon.py DUMP VERSION [LEXICON]"
+        sys.exit(1)
+
+    lexicon_path = argv[2] if len(argv) > 2 else DEFAULT_PATH
+    build_lexicon(argv[0], lexicon_path, argv[1])
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
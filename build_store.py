@@ -0,0 +1,15 @@
+from nlquery.local_store import build_store
+import sys
+
+def main(argv):
+    complete = '--complete' in argv
+    argv = [arg for arg in argv if arg != '--complete']
+    if len(argv) < 2:
+        print "Usage: python build_store.py [--complete] DUMP STORE_DIR [PROPERTY ...]"
+        sys.exit(1)
+
+    properties = argv[2:] or None
+    build_store(argv[0], argv[1], properties=properties, complete=complete)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,24 +1,110 @@
 import gevent
-import gevent.wsgi
+import gevent.pywsgi
 
+import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
 import tornado.wsgi
 import tornado.web
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tornado.locks import Semaphore
 from tornado.options import define, options, parse_command_line
 from nlquery.nlquery import NLQueryEngine
+from nlquery.async_engine import AsyncNLQueryEngine
+from nlquery.cache import DiskCache
+from nlquery.metrics import Metrics, WorkerMetrics
 import os
 import json
 import logging
+import signal
+import socket
+import sys
+import time
 
 define("port", default=8888, help="run on the given port", type=int)
 define("debug", default=False, help="run in debug mode")
+define("corenlp_host", default="localhost", help="host of the CoreNLP server")
+define("corenlp_port", default=9000, help="port of the CoreNLP server", type=int)
+define("wikidata_url", default="",
+       help="base URL of a Wikidata stand-in, e.g. for load tests")
+define("mode", default="wsgi",
+       help="wsgi to serve under gevent, or async to serve natively on Tornado")
+define("max_in_flight", default=64, type=int,
+       help="queries answered at once in async mode")
+define("max_queue", default=256, type=int,
+       help="queries waiting for their turn in async mode, more get a 503")
+define("deadline", default=30.0, type=float,
+       help="seconds to answer a query in async mode, or get a 504")
+define("max_clients", default=100, type=int,
+       help="requests to CoreNLP and Wikidata in flight in async mode")
+define("workers", default=1, type=int,
+       help="processes to serve with, 0 for one per core")
+define("cache_dir", default="",
+       help="directory of caches kept across restarts and shared by workers, "
+       "default to cache with several workers")
+define("metrics_interval", default=5.0, type=float,
+       help="seconds between publishes of the metrics of each worker, "
+       "served by /metrics of any worker")
 
 logging.getLogger("requests").setLevel(logging.WARNING)
 logger = logging.getLogger()
 fh = logging.FileHandler('logs/queries.log')
 logger.addHandler(fh)
 
-nlquery = NLQueryEngine('localhost', 9000)
+metrics = Metrics()
+requests_in_flight = metrics.gauge(
+    'nlquery_app_requests_in_flight', 'Requests to /query being handled')
+responses = metrics.counter(
+    'nlquery_app_responses_total', 'Responses to /query', ['code'])
+# Metrics of all workers, when serving with several
+worker_metrics = None
+
+# Seconds a worker must run for its exit not to count as a crash
+MIN_UPTIME = 10
+# Seconds to wait at most before restarting a crashing worker
+MAX_RESPAWN_DELAY = 60
+
+
+def point_engine(engine):
+    if options.wikidata_url:
+        engine.wd.WIKIDATA_URL = options.wikidata_url + '/w/api.php'
+        engine.wd.WDSPARQL_URL = options.wikidata_url + '/sparql'
+    return engine
+
+def make_engine():
+    return point_engine(NLQueryEngine(
+        options.corenlp_host, options.corenlp_port, cache_dir=options.cache_dir or None,
+        metrics=metrics))
+
+def make_async_engine():
+    http_client = AsyncHTTPClient(force_instance=True, max_clients=options.max_clients)
+    return point_engine(AsyncNLQueryEngine(
+        options.corenlp_host, options.corenlp_port, cache_dir=options.cache_dir or None,
+        http_client=http_client, coalesce=True, metrics=metrics))
+
+nlquery = make_engine()
+async_nlquery = None
+
+def serving_engine():
+    """Gets the engine answering queries in the mode served"""
+    return async_nlquery or nlquery
+
+metrics.gauge('nlquery_http_concurrency_limit',
+              'Adaptive limit of requests in flight to each backend endpoint', ['endpoint'],
+              fun=lambda: dict(((endpoint,), stats['limit']) for endpoint, stats
+                               in serving_engine().wd.limiter_stats().items()))
+
+
+class Admission(object):
+    """Bounds queries answered at once and queries waiting for their turn"""
+    def __init__(self, max_in_flight, max_queue):
+        self.semaphore = Semaphore(max_in_flight)
+        self.max_queue = max_queue
+        self.waiting = 0
+
+admission = None
 
 # https://gist.github.com/mminer/5464753
 class JsonHandler(tornado.web.RequestHandler):
@@ -63,43 +149,193 @@ class MainHandler(tornado.web.RequestHandler):
     def get(self):
         self.render('home.html')
 
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write((worker_metrics or metrics).render())
+
 class QueryHandler(JsonHandler):
+    def prepare(self):
+        requests_in_flight.inc()
+        super(QueryHandler, self).prepare()
+
+    def on_finish(self):
+        requests_in_flight.dec()
+        responses.inc(code=self.get_status())
+
     def post(self):
         query = str(self.request.arguments['q'])
         logger.info("Query: %s", query)
 
         try:
-            resp = nlquery.query(query, format_='raw')
+            resp = nlquery.query(query, format_='json')
         except Exception as e:
-            if 'CoreNLP server' in str(e):
-                self.write_error(500, message='Cannot connect to CoreNLP server')
-            else:
-                self.write_error(500, message=str(e))
+            self.query_failed(e)
             return
 
-        if not resp:
-            self.response['data'] = {}
+        self.write_answer(resp)
+
+    def query_failed(self, e):
+        if 'CoreNLP server' in str(e):
+            self.write_error(500, message='Cannot connect to CoreNLP server')
+        else:
+            self.write_error(500, message=str(e))
+
+    def write_answer(self, resp):
+        # The answer is serialized once, tree and SPARQL query are wrapped
+        # in <pre> by the page
+        self.write('{"data":%s}' % resp)
+
+class AsyncQueryHandler(QueryHandler):
+    """Answers queries with the async engine, without blocking the IOLoop
+
+    Identical queries in flight are answered once. Queries over the bounds
+    of admission are turned away with a 503, queries not answered by their
+    deadline get a 504.
+    """
+    @gen.coroutine
+    def post(self):
+        query = str(self.request.arguments['q'])
+        logger.info("Query: %s", query)
+        deadline = tornado.ioloop.IOLoop.current().time() + options.deadline
 
-        if resp.get('tree'):
-            resp['tree'] = '<pre>'+resp['tree']+'</pre>'
-        if resp.get('sparql_query'):
-            resp['sparql_query'] = '<pre>'+resp['sparql_query']+'</pre>'
+        if admission.waiting >= admission.max_queue:
+            self.write_error(503, message='Too many queries, try again later')
+            return
+        admission.waiting += 1
+        try:
+            yield admission.semaphore.acquire(timeout=deadline)
+        except gen.TimeoutError:
+            self.write_error(504, message='Query timed out')
+            return
+        finally:
+            admission.waiting -= 1
+
+        # The turn is given back when the query is answered, even if this
+        # request timed out, so that at most max_in_flight are in flight
+        future = async_nlquery.query(query, format_='json')
+        future.add_done_callback(lambda _: admission.semaphore.release())
+        try:
+            resp = yield gen.with_timeout(deadline, future)
+        except gen.TimeoutError:
+            self.write_error(504, message='Query timed out')
+            return
+        except Exception as e:
+            self.query_failed(e)
+            return
 
-        self.response['data'] = resp
-        self.write_json()
+        self.write_answer(resp)
 
-def make_app():
-    return tornado.wsgi.WSGIApplication([
+def make_app(query_handler=QueryHandler, application=tornado.wsgi.WSGIApplication):
+    return application([
         (r"/", MainHandler),
-        (r"/query", QueryHandler)],
+        (r"/query", query_handler),
+        (r"/metrics", MetricsHandler)],
         template_path=os.path.join(os.path.dirname(__file__), "templates"),
         static_path=os.path.join(os.path.dirname(__file__), "static"),
-        debug=True)
+        debug=options.debug,
+        # Forked workers must not restart themselves on code changes
+        autoreload=options.debug and options.workers == 1)
+
+def make_async_app():
+    metrics.gauge('nlquery_app_queries_waiting', 'Queries waiting for their turn',
+                  fun=lambda: {(): admission.waiting})
+    metrics.gauge('nlquery_app_queries_coalesced', 'Queries answered by a query in flight',
+                  fun=lambda: {(): async_nlquery.coalesced})
+    return make_app(AsyncQueryHandler, tornado.web.Application)
+
+def fork_workers():
+    """Forks the workers, which share the listening socket and the caches
+
+    Returns in each worker. The parent restarts workers that die, and stops
+    them when stopped. A worker exiting within MIN_UPTIME of its start is
+    restarted after a backoff doubling with each such exit in a row, up to
+    MAX_RESPAWN_DELAY.
+
+    Returns:
+        int: Number of the worker, from 0, or None if not forking
+    """
+    if options.workers == 1:
+        return None
+    if not options.cache_dir:
+        options.cache_dir = 'cache'
+    options.workers = options.workers or tornado.process.cpu_count()
+    # Metrics of workers of a previous run are not served
+    metrics_cache().clear()
+    # Worker pid to (number, start time)
+    workers = {}
+    crashes = [0] * options.workers
+
+    def fork(worker):
+        pid = os.fork()
+        if pid:
+            workers[pid] = (worker, time.time())
+        else:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+        return pid
+
+    def stop(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                # Exited, and not waited for yet
+                pass
+        sys.exit(0)
+
+    for worker in range(options.workers):
+        if not fork(worker):
+            return worker
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while True:
+        pid, status = os.wait()
+        worker, started = workers.pop(pid)
+        if time.time() - started < MIN_UPTIME:
+            crashes[worker] += 1
+        else:
+            crashes[worker] = 0
+        delay = min(MAX_RESPAWN_DELAY, 2 ** (crashes[worker] - 1)) if crashes[worker] else 0
+        logger.warning('Worker %d exited with status %d, restarting in %ds',
+                       pid, status, delay)
+        time.sleep(delay)
+        if not fork(worker):
+            return worker
+
+def metrics_cache():
+    return DiskCache(os.path.join(options.cache_dir, 'metrics.db'))
+
+def share_metrics(worker):
+    """Shares the metrics of this worker with the other workers"""
+    global worker_metrics
+    worker_metrics = WorkerMetrics(metrics, metrics_cache(), worker, options.workers)
 
 if __name__ == "__main__":
     parse_command_line()
-    app = make_app()
-    print "Running at localhost:8888"
-    server = gevent.wsgi.WSGIServer(('', 8888), app)
-    server.serve_forever()
+    print "Running at localhost:%d" % options.port
+    # Bound before forking, workers accept from the same socket
+    sockets = tornado.netutil.bind_sockets(options.port, family=socket.AF_INET)
+    worker = fork_workers()
+    if worker is not None:
+        share_metrics(worker)
+    if options.mode == 'async':
+        async_nlquery = make_async_engine()
+        admission = Admission(options.max_in_flight, options.max_queue)
+        server = tornado.httpserver.HTTPServer(make_async_app())
+        server.add_sockets(sockets)
+        if worker_metrics:
+            tornado.ioloop.PeriodicCallback(
+                worker_metrics.publish, options.metrics_interval * 1000).start()
+        tornado.ioloop.IOLoop.current().start()
+    else:
+        nlquery = make_engine()
+        server = gevent.pywsgi.WSGIServer(sockets[0], make_app())
+        if worker_metrics:
+            def publish():
+                while True:
+                    worker_metrics.publish()
+                    gevent.sleep(options.metrics_interval)
+            gevent.spawn(publish)
+        server.serve_forever()
 
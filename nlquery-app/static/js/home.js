@@ -17,8 +17,8 @@ $(document).ready(function(){
                 $('#ans-resp').text(resp.data.plain);
                 $('#query-resp').text(resp.data.query);
                 $('#params-resp').text(JSON.stringify(resp.data.params));
-                $('#tree-resp').html(resp.data.tree);
-                $('#sparql-resp').html(''+resp.data.sparql_query);
+                $('#tree-resp').empty().append($('<pre>').text(resp.data.tree || ''));
+                $('#sparql-resp').empty().append($('<pre>').text(resp.data.sparql_query || ''));
 
                 loading = false;
                 $('#search').show();
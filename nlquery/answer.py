@@ -1,13 +1,46 @@
 from datetime import datetime
 from utils import conv_to_str
+import json
+
+# Compact encoder, reused for every answer
+JSON_ENCODER = json.JSONEncoder(separators=(',', ':'))
+
 
 class Answer(object):
-    """Answer object that holds query data"""
+    """Answer object that holds query data
+
+    Answers are slotted to stay small in large batches. The parse tree is
+    kept as given and only converted to a string when read. Answers of a
+    tracing engine hold the trace of their query, see tracing.Trace.
+    """
+
+    __slots__ = ['query', '_data', 'params', '_tree', 'trace']
+
     def __init__(self, query=None, data=None):
         self.query = query
-        self.data = data
+        self._data = data
         self.params = {}
-        self.tree = None
+        self._tree = None
+        self.trace = None
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    @property
+    def tree(self):
+        """Parse tree of the query as a string"""
+        if self._tree is not None and not isinstance(self._tree, basestring):
+            self._tree = str(self._tree)
+        return self._tree
+
+    @tree.setter
+    def tree(self, tree):
+        self._tree = tree
 
     def to_plain(self):
         if isinstance(self.data, list):
@@ -16,9 +49,17 @@ class Answer(object):
             return conv_to_str(self.data)
 
     def to_dict(self):
-        return {
+        d = {
             'plain': self.to_plain(),
             'query': self.query,
             'params': self.params,
             'tree': self.tree,
-        }
\ No newline at end of file
+        }
+        # After to_plain, so that decoding is traced
+        if self.trace is not None:
+            d['trace'] = self.trace.to_dict()
+        return d
+
+    def to_json(self):
+        """Serializes the dict of the answer, see to_dict, as compact JSON"""
+        return JSON_ENCODER.encode(self.to_dict())
@@ -1,5 +1,16 @@
 import logging
+import random
+import threading
+from thread import get_ident
+# Patches sockets to yield to other greenlets
 import grequests
+import gevent
+import gevent.event
+import requests
+from greenlet import getcurrent
+from requests.adapters import HTTPAdapter
+from ratelimit import EndpointLimiter, parse_retry_after
+from tracing import current_trace
 
 class LoggingInterface:
     """Interface for logging methods"""
@@ -36,12 +47,177 @@ class LoggingInterface:
         self.logger.error(msg)
 
 
+class _Call(object):
+    """Identical requests in flight, answered once by their first caller"""
+
+    def __init__(self):
+        self.thread = get_ident()
+        self.result = None
+        self._done = threading.Event()
+        self._greenlet_done = gevent.event.Event()
+
+    def joinable(self):
+        """Whether the current caller may wait for the call
+
+        Greenlets only wait for calls of their own thread, waiting on
+        another thread would block every greenlet of theirs.
+        """
+        return self.thread == get_ident() or getcurrent().parent is None
+
+    def set(self, result):
+        self.result = result
+        self._done.set()
+        self._greenlet_done.set()
+
+    def wait(self):
+        if self.thread == get_ident():
+            self._greenlet_done.wait()
+        else:
+            self._done.wait()
+        return self.result
+
+
+class SingleFlight(object):
+    """Coalesces identical calls in flight across greenlets and threads
+
+    The first caller of a key makes the call, later callers of the key
+    wait for its result until it finishes.
+
+    Attributes:
+        coalesced (int): Calls answered by a call in flight so far
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def begin(self, key):
+        """Begins a call of key
+
+        Returns:
+            tuple: (call, leader) where leader tells whether the caller
+                makes the call, and must finish it, or waits for it
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.joinable():
+                self.coalesced += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            return call, True
+
+    def finish(self, key, call, result):
+        """Answers the callers waiting for call with result"""
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.set(result)
+
+
 class RestAdapter(LoggingInterface):
     """Adapter for an Rest API endpoint
 
-    Comes with logging methods
+    Comes with logging methods. Requests share a pool of keep-alive
+    connections per host. Identical requests in flight are sent once, their
+    callers share the response, which must not be modified.
+
+    Requests to each endpoint, a URL without query, go through an
+    EndpointLimiter: they are paced by its rate, and its limit of requests
+    in flight adapts to 429 and 503 responses and their Retry-After.
+    Connection errors, timeouts, 429 and 5xx are retried after a backoff
+    with full jitter.
     """
 
+    RETRY_STATUSES = [429, 500, 502, 503, 504]
+    # Statuses of an endpoint asking to slow down
+    THROTTLE_STATUSES = [429, 503]
+
+    def __init__(self, pool_size=10, timeout=30, retries=3, backoff_factor=0.5,
+                 max_backoff=30, single_flight=True, limits=None):
+        """
+        Args:
+            pool_size (int, optional): Connections to keep alive per host.
+                Default to 10
+            timeout (float, optional): Seconds to wait for a response.
+                Default to 30
+            retries (int, optional): Times to retry a failed request. Default
+                to 3
+            backoff_factor (float, optional): Seconds to back off by at most
+                before the first retry, doubling each retry. Default to 0.5
+            max_backoff (float, optional): Seconds to back off by at most.
+                Default to 30
+            single_flight (bool, optional): Whether to coalesce identical
+                requests in flight. Default to True
+            limits (dict, optional): Args of the EndpointLimiter of each
+                endpoint, see endpoint_limits. Default to its defaults
+        """
+        LoggingInterface.__init__(self)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.limits = limits or {}
+        self.limiters = {}
+        self._limiters_lock = threading.Lock()
+
+        # Failed requests are retried by _send, through the limiter
+        self._http = HTTPAdapter(pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('http://', self._http)
+        self.session.mount('https://', self._http)
+        self.flights = SingleFlight() if single_flight else None
+
+    def endpoint_limits(self, endpoint):
+        """Gets the args of the EndpointLimiter of an endpoint
+
+        Args:
+            endpoint (str): URL without query
+
+        Returns:
+            dict: Args of EndpointLimiter
+        """
+        return self.limits
+
+    def limiter(self, url):
+        """Gets the EndpointLimiter of the endpoint of url"""
+        endpoint = url.split('?', 1)[0]
+        limiter = self.limiters.get(endpoint)
+        if limiter is None:
+            with self._limiters_lock:
+                limiter = self.limiters.get(endpoint)
+                if limiter is None:
+                    limiter = self.limiters[endpoint] = EndpointLimiter(
+                        **self.endpoint_limits(endpoint))
+        return limiter
+
+    def limiter_stats(self):
+        """Gets statistics of the limiter of each endpoint, see EndpointLimiter.stats"""
+        return dict((endpoint, limiter.stats())
+                    for endpoint, limiter in self.limiters.items())
+
+    def pool_stats(self):
+        """Gets statistics of the connection pool of each host
+
+        Returns:
+            dict: Host URL to dict of:
+                connections - connections opened so far
+                requests - requests sent so far
+                idle - connections idle in the pool
+        """
+        stats = {}
+        pools = self._http.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            host = '{0}://{1}:{2}'.format(pool.scheme, pool.host, pool.port)
+            stats[host] = {
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+                # Queue is padded with None for connections not yet opened
+                'idle': len(filter(None, list(pool.pool.queue))) if pool.pool else 0,
+            }
+        return stats
+
     def get(self, url, params={}, headers=None, format_='json'):
         """Calls the get method for a REST endpoint. 
 
@@ -55,11 +231,120 @@ class RestAdapter(LoggingInterface):
             dict: Response of request if format is json
             str: Response of request if format is not json
         """
+        return self._get_many([(url, params)], headers, format_)[0]
+
+    def get_many(self, calls, headers=None, format_='json'):
+        """Calls the get method for several REST endpoints concurrently
+
+        Args:
+            calls (list): List of (url, params) tuples to get
+            headers (dict, optional): any additional header attrs. Default to None
+            format_ (str, optional): Format requested. Default to json
+
+        Returns:
+            list: Responses of requests in the order of calls, see get
+        """
+        return self._get_many(calls, headers, format_)
+
+    def coalesced(self):
+        """Gets the number of requests answered by identical ones in flight"""
+        return self.flights.coalesced if self.flights else 0
+
+    @staticmethod
+    def _flight_key(url, params, headers, format_):
+        return (url, tuple(sorted(params.iteritems())),
+                tuple(sorted(headers.iteritems())) if headers else None, format_)
+
+    def _get_many(self, calls, headers, format_):
+        """Sends the calls not already in flight, and waits for the others"""
+        trace = current_trace()
+        results = [None] * len(calls)
+        sent = []
+        waiting = []
+        for i, (url, params) in enumerate(calls):
+            if self.flights is None:
+                sent.append((i, None, None, url, params))
+                continue
+            # Duplicates within calls wait for the first of them too
+            key = self._flight_key(url, params, headers, format_)
+            call, leader = self.flights.begin(key)
+            if leader:
+                sent.append((i, key, call, url, params))
+            else:
+                trace.count('http.coalesced')
+                waiting.append((i, call))
+
+        datas = [None] * len(sent)
         try:
-            greq = grequests.get(url, params=params, headers=headers)
-            response = grequests.map([greq])[0]
-        except requests.exceptions.ConnectionError:
-            print 'ConnectionError'
+            if sent:
+                trace.count('http.requests', len(sent))
+                if len(sent) == 1:
+                    _, _, _, url, params = sent[0]
+                    responses = [self._send(url, params, headers, trace)]
+                else:
+                    jobs = [gevent.spawn(self._send, url, params, headers, trace)
+                            for _, _, _, url, params in sent]
+                    gevent.joinall(jobs)
+                    responses = [job.value for job in jobs]
+                datas = [self._decode(response, format_) for response in responses]
+        finally:
+            # Waiting callers are answered even if sending raised
+            for (i, key, call, _, _), data in zip(sent, datas):
+                if call is not None:
+                    self.flights.finish(key, call, data)
+                results[i] = data
+
+        for i, call in waiting:
+            results[i] = call.wait()
+        return results
+
+    def _backoff(self, retry):
+        """Gets seconds to back off by before a retry, with full jitter"""
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2 ** (retry - 1)))
+
+    def _send(self, url, params, headers, trace):
+        """Sends a request through the limiter of its endpoint, with retries
+
+        Args:
+            trace (Trace): Trace of the caller, counting retries and failures
+
+        Returns:
+            Response: Response, or None if the request failed
+        """
+        limiter = self.limiter(url)
+        for retry in xrange(self.retries + 1):
+            if retry:
+                trace.count('http.retries')
+                gevent.sleep(self._backoff(retry))
+            sent = limiter.acquire()
+            try:
+                response = self.session.get(url, params=params, headers=headers,
+                                            timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                limiter.release(sent, failed=True)
+                self.warn('Request failed: {0}', e)
+                failure = 'http.timeouts' if isinstance(e, requests.exceptions.Timeout) \
+                    else 'http.errors'
+                continue
+
+            status = response.status_code
+            if status not in self.RETRY_STATUSES:
+                limiter.release(sent)
+                return response
+            throttled = status in self.THROTTLE_STATUSES
+            if throttled:
+                trace.count('http.throttled')
+            limiter.release(sent, throttled=throttled, failed=not throttled,
+                            retry_after=parse_retry_after(response.headers.get('Retry-After')))
+            self.warn('Request failed with {0}', status)
+            failure = 'http.errors'
+        trace.count(failure)
+        return None
+
+    def _decode(self, response, format_):
+        """Decodes a response, or returns None if the request failed"""
+        if response is None:
+            self.warn('Request failed')
             return None
         self.info(response.url, _format=False)
 
@@ -0,0 +1,580 @@
+"""Non-blocking variant of NLQueryEngine built on Tornado coroutines
+
+Rule matching and SPARQL building are shared with NLQueryEngine and
+WikiData, only the calls to CoreNLP and WikiData are non-blocking. Methods
+returning Futures can be yielded from Tornado coroutines, and awaited from
+asyncio code when Tornado runs on the asyncio event loop.
+"""
+import json
+from matcher import match_rules
+from nltk.tree import Tree
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httputil import url_concat
+from tornado.locks import Semaphore
+from tornado.stack_context import StackContext
+from answer import Answer
+from cache import MISSING
+from nlquery import NLQueryEngine
+from ratelimit import parse_retry_after
+from tracing import Trace, NULL_TRACE, NULL_SPAN, current_trace
+from utils import dget
+from wikidata import WikiData, WikiDataAnswer
+
+
+def encode_params(params):
+    """Encodes unicode values of params as utf-8 for url_concat"""
+    return dict((k, v.encode('utf-8') if isinstance(v, unicode) else v)
+                for k, v in params.iteritems())
+
+
+class AsyncStanfordServerParser(object):
+    """Non-blocking client of the CoreNLP server, see StanfordServerParser"""
+
+    def __init__(self, host='localhost', port=9000, properties={}, http_client=None):
+        self.url = 'http://{0}:{1}'.format(host, port)
+        self.http_client = http_client or AsyncHTTPClient()
+
+        if not properties:
+            self.properties = {
+                'annotators': 'parse',
+                'outputFormat': 'json',
+            }
+        else:
+            self.properties = properties
+
+    @gen.coroutine
+    def parse(self, sent):
+        """Parses a sentence into a Tree
+
+        Raises:
+            Exception: If the CoreNLP server cannot be reached
+        """
+        url = url_concat(self.url, {'properties': json.dumps(self.properties)})
+        if isinstance(sent, unicode):
+            sent = sent.encode('utf-8')
+        response = yield self.http_client.fetch(
+            url, method='POST', body=sent, raise_error=False)
+
+        if response.code == 599:
+            raise Exception('Check whether you have started the CoreNLP server: %s'
+                            % response.error)
+
+        try:
+            output = json.loads(response.body)
+        except (TypeError, ValueError):
+            # Got random html, return empty tree
+            raise gen.Return(Tree('', []))
+
+        # Strip the ROOT node, as StanfordServerParser does
+        raise gen.Return(Tree.fromstring(output['sentences'][0]['parse'])[0])
+
+
+class AsyncWikiData(WikiData):
+    """Non-blocking adapter for WikiData API endpoint
+
+    Has the same methods as WikiData, returning Futures. Stale SPARQL
+    results are refreshed in a background thread with blocking requests.
+
+    Requests go through the same EndpointLimiter of each endpoint as
+    blocking ones, and are retried and coalesced the same way, see
+    RestAdapter.
+    """
+
+    def __init__(self, id_cache=None, sparql_cache=None, http_client=None,
+                 search_index=None, **kwargs):
+        """
+        Args:
+            http_client (AsyncHTTPClient, optional): Client to send requests
+                with, its max_clients bounds requests in flight
+            See WikiData for other args
+        """
+        WikiData.__init__(self, id_cache, sparql_cache, search_index, **kwargs)
+        self.http_client = http_client or AsyncHTTPClient()
+        self.fetches_coalesced = 0
+        # Flight key to Future of requests in flight
+        self._fetches = {}
+
+    def coalesced(self):
+        """Gets the number of requests answered by identical ones in flight"""
+        return WikiData.coalesced(self) + self.fetches_coalesced
+
+    def fetch(self, url, params={}):
+        """Non-blocking get of a json REST endpoint, see RestAdapter.get
+
+        Returns:
+            Future: Response of request, shared by identical requests in
+                flight, or None if the request failed
+        """
+        if self.flights is None:
+            return self._fetch(url, params)
+        key = self._flight_key(url, params, None, 'json')
+        future = self._fetches.get(key)
+        if future is not None:
+            current_trace().count('http.coalesced')
+            self.fetches_coalesced += 1
+            return future
+        future = self._fetches[key] = self._fetch(url, params)
+        future.add_done_callback(lambda _: self._fetches.pop(key, None))
+        return future
+
+    @gen.coroutine
+    def _acquire(self, limiter):
+        """Waits for the turn of a request without blocking, see EndpointLimiter.acquire"""
+        wait = limiter.pace()
+        if wait:
+            yield gen.sleep(wait)
+        while True:
+            sent, wait = limiter.try_acquire()
+            if sent is not None:
+                raise gen.Return(sent)
+            yield gen.sleep(wait)
+
+    @gen.coroutine
+    def _send_async(self, url, params, trace):
+        """Non-blocking send of a request with retries, see RestAdapter._send"""
+        limiter = self.limiter(url)
+        url = url_concat(url, encode_params(params))
+        for retry in xrange(self.retries + 1):
+            if retry:
+                trace.count('http.retries')
+                yield gen.sleep(self._backoff(retry))
+            sent = yield self._acquire(limiter)
+            response = yield self.http_client.fetch(
+                url, request_timeout=self.timeout, raise_error=False)
+
+            status = response.code
+            if status == 599:
+                # No response, the connection failed or timed out
+                limiter.release(sent, failed=True)
+                self.warn('Request failed: {0}', response.error)
+                failure = 'http.timeouts' if 'Timeout' in str(response.error) \
+                    else 'http.errors'
+                continue
+            if status not in self.RETRY_STATUSES:
+                limiter.release(sent)
+                raise gen.Return(response)
+            throttled = status in self.THROTTLE_STATUSES
+            if throttled:
+                trace.count('http.throttled')
+            limiter.release(sent, throttled=throttled, failed=not throttled,
+                            retry_after=parse_retry_after(response.headers.get('Retry-After')))
+            self.warn('Request failed with {0}', status)
+            failure = 'http.errors'
+        trace.count(failure)
+        raise gen.Return(None)
+
+    @gen.coroutine
+    def _fetch(self, url, params):
+        trace = current_trace()
+        trace.count('http.requests')
+        response = yield self._send_async(url, params, trace)
+
+        if response is None:
+            raise gen.Return(None)
+        if response.error:
+            self.warn('Request failed: {0}', response.error)
+            raise gen.Return(None)
+        self.info(response.effective_url, _format=False)
+
+        try:
+            json_data = json.loads(response.body)
+        except ValueError:
+            json_data = None
+            self.warn('Could not decode json properly')
+        raise gen.Return(json_data)
+
+    @gen.coroutine
+    def fetch_many(self, calls):
+        """Non-blocking get of several json REST endpoints, see RestAdapter.get_many"""
+        results = yield [self.fetch(url, params) for url, params in calls]
+        raise gen.Return(results)
+
+    @gen.coroutine
+    def _query_wdsparql(self, query):
+        params = {
+            'format': 'json',
+            'query': query
+        }
+        self.debug(query)
+        key = self._canonical_sparql(query)
+        ttl = self._sparql_ttl(query)
+        trace = current_trace()
+
+        with trace.span('sparql'):
+            data = self.sparql_cache.peek(
+                key, lambda trace: self.get(self.WDSPARQL_URL, params=params), ttl)
+            if data is MISSING:
+                trace.count('sparql_cache.misses')
+                with trace.span('wdqs'):
+                    data = yield self.fetch(self.WDSPARQL_URL, params)
+                self.sparql_cache.put(key, data, ttl)
+            else:
+                trace.count('sparql_cache.hits')
+        raise gen.Return(data)
+
+    @gen.coroutine
+    def _search_entity(self, name, _type='item'):
+        if _type not in ['item', 'property']:
+            raise gen.Return(None)
+        data = self._index_search(name, _type)
+        if data is None:
+            with current_trace().span('search'):
+                data = yield self.fetch(self.WIKIDATA_URL, self._search_params(name, _type))
+        raise gen.Return(data)
+
+    @gen.coroutine
+    def _search_entities(self, lookups):
+        items, misses = self._index_searches(lookups)
+        calls = [(self.WIKIDATA_URL, self._search_params(*lookups[i]))
+                 for i in misses]
+        if not calls:
+            raise gen.Return(items)
+        with current_trace().span('search'):
+            fetched = yield self.fetch_many(calls)
+        for i, item in zip(misses, fetched):
+            items[i] = item
+        raise gen.Return(items)
+
+    @gen.coroutine
+    def _get_desc(self, subject):
+        data = yield self._search_entity(subject)
+        raise gen.Return(self._desc_answer(data))
+
+    @gen.coroutine
+    def _get_id(self, name, _type='item'):
+        ids = yield self._get_ids([(name, _type)])
+        raise gen.Return(ids[(name, _type)])
+
+    @gen.coroutine
+    def _get_ids(self, lookups):
+        with current_trace().span('resolve'):
+            ids, misses = self._cached_ids(lookups)
+            if misses:
+                items = yield self._search_entities(misses)
+                self._store_ids(ids, misses, items)
+        raise gen.Return(ids)
+
+    @gen.coroutine
+    def _get_property(self, subject, prop, prop_id=None):
+        self.debug('{0}, {1}', subject, prop)
+        lookups = [(subject, 'item')]
+        if not prop_id:
+            lookups.append((prop, 'property'))
+        ids = yield self._get_ids(lookups)
+
+        subject_id = ids[(subject, 'item')]
+        if not prop_id:
+            prop_id = ids[(prop, 'property')]
+
+        if not prop_id or not subject_id:
+            raise gen.Return(None)
+
+        intent = ('property', subject_id, prop_id)
+        ans = self._cached_answer(intent)
+        if ans is None:
+            query = self._property_query(subject_id, prop_id)
+            result = yield self._query_wdsparql(query)
+            ans = self._bindings_answer(query, result)
+            self._store_answer(intent, ans, result)
+        raise gen.Return(ans)
+
+    @gen.coroutine
+    def get_properties(self, pairs, batch_size=None):
+        batches = self._property_batches(pairs, batch_size)
+        queries = [self._properties_query(batch) for batch in batches]
+        trace = current_trace()
+        with trace.span('sparql'), trace.span('wdqs'):
+            results = yield self.fetch_many([
+                (self.WDSPARQL_URL, {'format': 'json', 'query': query}) for query in queries])
+        raise gen.Return(self._properties_answers(pairs, batches, queries, results))
+
+    @gen.coroutine
+    def _get_aliases(self, subject):
+        self.debug('Get alias {0}'.format(subject))
+        subject_id = yield self._get_id(subject, 'item')
+        intent = ('aliases', subject_id)
+        ans = self._cached_answer(intent)
+        if ans is None:
+            query = self._aliases_query(subject_id)
+            result = yield self._query_wdsparql(query)
+            ans = self._bindings_answer(query, result)
+            self._store_answer(intent, ans, result)
+        raise gen.Return(ans)
+
+    @gen.coroutine
+    def _find_entity(self, qtype, inst, params, limit=None):
+        self.info('Get instances of {0} that are {1}'.format(inst, params))
+
+        ids = yield self._get_ids(self._find_entity_lookups(inst, params))
+        intent = self._find_entity_intent(qtype, inst, params, ids, limit)
+        ans = self._cached_answer(intent)
+        if ans is not None:
+            raise gen.Return(ans)
+        query = self._find_entity_query(qtype, inst, params, ids, limit)
+        if not query:
+            raise gen.Return(None)
+
+        data = yield self._query_wdsparql(query)
+        ans = self._find_entity_answer(qtype, query, data)
+        self._store_answer(intent, ans, data)
+        raise gen.Return(ans)
+
+    @gen.coroutine
+    def get_property(self, qtype, subject, prop):
+        if prop is None:
+            ans = yield self._get_desc(subject)
+        elif prop == 'age':
+            bday_ans = yield self._get_property(subject, 'date of birth', 'P569')
+            ans = self._age_answer(bday_ans)
+        elif prop in self.ALIAS_PROPS:
+            ans = yield self._get_aliases(subject)
+        else:
+            prop_id = self._property_id(qtype, prop)
+            ans = yield self._get_property(subject, prop, prop_id=prop_id)
+        raise gen.Return(ans)
+
+    @gen.coroutine
+    def find_entity(self, qtype, inst, props, limit=None):
+        inst = self._qualify_inst(inst, props)
+        ans = yield self._find_entity(qtype, inst, props, limit)
+        raise gen.Return(ans)
+
+    @gen.coroutine
+    def stream_entities(self, qtype, inst, props, on_value, page_size=None, limit=None):
+        """Non-blocking stream of entities, see WikiData.stream_entities
+
+        The next page is queried once on_value was called with the values of
+        the previous page.
+
+        Args:
+            on_value (callable): Called with the value of each entity
+
+        Returns:
+            Future: Number of entities streamed, or None if they cannot be
+                queried
+
+        Raises:
+            ValueError: If qtype is not which or who
+        """
+        if qtype not in ['which', 'who']:
+            raise ValueError('Cannot stream {0} queries'.format(qtype))
+        inst = self._qualify_inst(inst, props)
+        ids = yield self._get_ids(self._find_entity_lookups(inst, props))
+        query = self._find_entity_query(qtype, inst, props, ids)
+        if not query:
+            raise gen.Return(None)
+
+        page_size = page_size or self.PAGE_SIZE
+        offset = 0
+        while limit is None or offset < limit:
+            size = page_size if limit is None else min(page_size, limit - offset)
+            data = yield self._query_wdsparql(self._page_query(query, size, offset))
+            if data is None:
+                self.warn('Stopped streaming at offset {0}', offset)
+                break
+            bindings = dget(data, 'results.bindings') or []
+            for binding in bindings:
+                on_value(WikiDataAnswer.get_value(binding))
+            offset += len(bindings)
+            if len(bindings) < size:
+                break
+        raise gen.Return(offset)
+
+
+class AsyncNLQueryEngine(NLQueryEngine):
+    """Non-blocking NLQueryEngine, query, query_many and stream return Futures
+
+    Coroutines of concurrent queries share a greenlet, so the trace of a
+    query is made current whenever its coroutines run, with a Tornado
+    StackContext, instead of for the greenlet.
+
+    Example:
+        engine = AsyncNLQueryEngine()
+        answer = yield engine.query('Who is Obama?')
+    """
+
+    def __init__(self, host='localhost', port=9000, properties={}, cache_dir=None,
+                 http_client=None, store_dir=None, offline=False, coalesce=False,
+                 trace=False, metrics=None):
+        """
+        Args:
+            http_client (AsyncHTTPClient, optional): Client to send requests
+                with. Create it with a higher max_clients to allow more
+                requests in flight
+            coalesce (bool, optional): Answer identical queries in flight
+                once, see query. Default to False
+            See NLQueryEngine for other args
+        """
+        self.http_client = http_client or AsyncHTTPClient()
+        NLQueryEngine.__init__(self, host, port, properties, cache_dir,
+                               store_dir=store_dir, offline=offline, trace=trace,
+                               metrics=metrics)
+        self.async_parser = AsyncStanfordServerParser(
+            host, port, properties, self.http_client)
+        self.coalesce = coalesce
+        self.coalesced = 0
+        # (sentence, format, limit) to Future of queries in flight
+        self._in_flight = {}
+
+    def _make_wikidata(self, **kwargs):
+        """Creates the non-blocking WikiData backend, see NLQueryEngine"""
+        return AsyncWikiData(http_client=self.http_client, **kwargs)
+
+    @gen.coroutine
+    def parse(self, sent):
+        """Parses a preprocessed sentence, using the parse cache"""
+        trace = current_trace()
+        tree = self.parser.get(sent)
+        if tree is None:
+            trace.count('parse_cache.misses')
+            with trace.span('corenlp'):
+                tree = yield self.async_parser.parse(sent)
+            self.parser.put(sent, tree)
+        else:
+            trace.count('parse_cache.hits')
+        raise gen.Return(tree)
+
+    @gen.coroutine
+    def answer(self, sent, tree, limit=None):
+        """Answers a preprocessed query from its parse tree, see NLQueryEngine"""
+        ans = None
+        params = None
+        for name, rules, _, params_fun in self.families():
+            params = match_rules(tree, rules, params_fun)
+            if not params:
+                continue
+            # The local store does not block, only WikiData is awaited
+            for backend in self.backends():
+                if name == 'find_entity':
+                    ans = backend.find_entity(limit=limit, **params)
+                else:
+                    ans = backend.get_property(**params)
+                if isinstance(ans, Future):
+                    ans = yield ans
+                if ans:
+                    break
+            self.family_hits[name] += 1
+            break
+
+        if not ans:
+            ans = Answer()
+
+        if params:
+            ans.params = params
+        ans.query = sent
+        ans.tree = tree
+        raise gen.Return(ans)
+
+    def query(self, sent, format_='plain', limit=None):
+        """Answers a query, see NLQueryEngine.query
+
+        If coalescing, a query identical to one in flight, after
+        preprocessing, waits for the answer of that query instead of being
+        answered again, and gets the same answer object. Queries coalesced
+        so far are counted in coalesced.
+
+        Returns:
+            Future: Answer of the query
+        """
+        sent = self.preprocess(sent)
+        if not self.coalesce:
+            return self._answer_query(sent, format_, limit)
+
+        key = (sent, format_, limit)
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future
+        future = self._in_flight[key] = self._answer_query(sent, format_, limit)
+        future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return future
+
+    def _answer_query(self, sent, format_, limit=None):
+        """Answers a preprocessed query, traced if tracing or measuring"""
+        trace = Trace() if self.trace or self.metrics else NULL_TRACE
+        if trace is NULL_TRACE:
+            return self._traced_query(sent, format_, limit, trace)
+        with StackContext(trace.activate):
+            return self._traced_query(sent, format_, limit, trace)
+
+    @gen.coroutine
+    def _traced_query(self, sent, format_, limit, trace):
+        if not sent:
+            raise gen.Return(self.format_answer(Answer(query=sent), format_))
+        measure = self.metrics.measure(trace) if self.metrics else NULL_SPAN
+        with measure:
+            with trace.span('parse'):
+                tree = yield self.parse(sent)
+            self.info(tree)
+            ans = yield self.answer(sent, tree, limit)
+            if self.trace:
+                ans.trace = trace
+            result = self.format_answer(ans, format_)
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def stream(self, sent, on_value, page_size=None, limit=None):
+        """Streams the entities answering a which/who query, see NLQueryEngine.stream
+
+        Args:
+            on_value (callable): Called with the value of each entity
+
+        Returns:
+            Future: Number of entities streamed, or None if the query is not
+                a which/who query or cannot be answered
+        """
+        sent = self.preprocess(sent)
+        if not sent:
+            raise gen.Return(None)
+        tree = yield self.parse(sent)
+        params = match_rules(tree, self.find_entity_rules, self.find_entity_params)
+        if not params or params['qtype'] not in ['which', 'who']:
+            raise gen.Return(None)
+
+        for backend in self.backends():
+            if backend is self.local:
+                # The local store does not block, its values are iterated
+                values = backend.stream_entities(
+                    page_size=page_size, limit=limit, **params)
+                if values is None:
+                    continue
+                streamed = 0
+                for value in values:
+                    on_value(value)
+                    streamed += 1
+                raise gen.Return(streamed)
+
+            streamed = yield backend.stream_entities(
+                on_value=on_value, page_size=page_size, limit=limit, **params)
+            if streamed is not None:
+                raise gen.Return(streamed)
+        raise gen.Return(None)
+
+    @gen.coroutine
+    def query_many(self, sents, format_='plain', concurrency=100):
+        """Answers a batch of queries, see NLQueryEngine.query_many
+
+        Returns:
+            list: Answers in the order of sents
+        """
+        if format_ not in self.FORMATS:
+            raise ValueError('Undefined format: %s' % format_)
+
+        semaphore = Semaphore(concurrency)
+        answers = {}
+
+        @gen.coroutine
+        def run(sent):
+            with (yield semaphore.acquire()):
+                try:
+                    ans = yield self.query(sent, format_)
+                except Exception as e:
+                    self.error('Failed to answer {0}: {1}', sent, e)
+                    ans = self.format_answer(Answer(query=sent), format_)
+            answers[sent] = ans
+
+        sents = [self.preprocess(sent) for sent in sents]
+        yield [run(sent) for sent in set(sents)]
+        raise gen.Return([answers[sent] for sent in sents])
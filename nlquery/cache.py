@@ -0,0 +1,459 @@
+import Queue
+import json
+import os
+import sqlite3
+import sys
+import time
+import traceback
+import cPickle as pickle
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import RLock, Thread
+from nltk.tree import Tree
+from tracing import current_trace, NULL_TRACE
+
+# Sentinel returned on a cache miss, so that None can be cached
+MISSING = object()
+
+
+class LRUCache(object):
+    """In-process least recently used cache with optional expiry
+
+    Args:
+        maxsize (int): Maximum number of entries to hold
+        ttl (float, optional): Seconds until an entry expires. Default to
+            None (never expire)
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+    def _expiry(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is None:
+            return None
+        return time.time() + ttl
+
+    def get(self, key, default=MISSING):
+        """Gets value of key, or default if missing or expired"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                return default
+            # Re-insert to mark as most recently used
+            self._data[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Sets value of key
+
+        Args:
+            key: Hashable key
+            value: Value to store
+            ttl (float, optional): Overrides the cache ttl for this entry
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, self._expiry(ttl))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache(object):
+    """On-disk cache backed by SQLite that survives restarts
+
+    Keys are JSON encoded and values are pickled. The database can be
+    shared by processes, e.g. workers of a server: it is written ahead
+    (WAL) so that reads do not wait for writes, writes are serialized by
+    SQLite, and each process opens its own connection, also after a fork.
+    Entries over maxsize are evicted least recently used first, the number
+    of entries is kept in a meta table so that writes need no count.
+
+    Args:
+        path (str): Path of database file
+        maxsize (int): Maximum number of entries to hold
+        ttl (float, optional): Seconds until an entry expires. Default to
+            None (never expire)
+        timeout (float, optional): Seconds to wait for a write of another
+            process. Default to 30
+    """
+
+    # Seconds within which reads of an entry update its access time once,
+    # so that hot entries are not written on every read
+    ACCESS_RESOLUTION = 1.0
+
+    def __init__(self, path, maxsize=100000, ttl=None, timeout=30):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timeout = timeout
+
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        self._pid = None
+        self._db()
+
+    def _db(self):
+        """Gets the connection of this process, connections do not survive a fork"""
+        if self._pid != os.getpid():
+            self._lock = RLock()
+            self._conn = self._connect()
+            self._pid = os.getpid()
+        return self._conn
+
+    def _connect(self):
+        # Transactions are begun explicitly, see _transaction
+        conn = sqlite3.connect(self.path, timeout=self.timeout,
+                               check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)')
+        conn.execute("INSERT OR IGNORE INTO meta SELECT 'count', COUNT(*) FROM cache")
+        conn.execute('COMMIT')
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Runs statements in a write transaction, excluding other processes"""
+        conn = self._db()
+        with self._lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    @staticmethod
+    def _count(conn, delta=0):
+        if delta:
+            conn.execute("UPDATE meta SET value = value + ? WHERE name = 'count'", (delta,))
+        return conn.execute("SELECT value FROM meta WHERE name = 'count'").fetchone()[0]
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(key, sort_keys=True)
+
+    def get(self, key, default=MISSING):
+        """Gets value of key, or default if missing or expired"""
+        entry = self.get_entry(key)
+        if entry is MISSING:
+            return default
+        return entry[0]
+
+    def get_entry(self, key):
+        """Gets value of key with the seconds it has left before it expires
+
+        Returns:
+            tuple: (value, seconds left, or None if it never expires), or
+                MISSING if missing or expired
+        """
+        now = time.time()
+        conn = self._db()
+        with self._lock:
+            row = conn.execute(
+                'SELECT value, expires, accessed FROM cache WHERE key = ?',
+                (self._key(key),)).fetchone()
+            if row is None:
+                return MISSING
+            value, expires, accessed = row
+            if expires is not None and expires < now:
+                return MISSING
+            if accessed < now - self.ACCESS_RESOLUTION:
+                conn.execute('UPDATE cache SET accessed = ? WHERE key = ?',
+                             (now, self._key(key)))
+        return pickle.loads(str(value)), None if expires is None else expires - now
+
+    def set(self, key, value, ttl=None):
+        """Sets value of key, evicting least recently used entries if full"""
+        ttl = self.ttl if ttl is None else ttl
+        blob = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+        with self._transaction() as conn:
+            # Timed once the write lock is held, else entries written by
+            # other processes meanwhile would look more recently used
+            now = time.time()
+            expires = now + ttl if ttl is not None else None
+            updated = conn.execute(
+                'UPDATE cache SET value = ?, expires = ?, accessed = ? WHERE key = ?',
+                (blob, expires, now, self._key(key))).rowcount
+            if updated:
+                return
+            conn.execute('INSERT INTO cache VALUES (?, ?, ?, ?)',
+                         (self._key(key), blob, expires, now))
+            excess = self._count(conn, 1) - self.maxsize
+            if excess > 0:
+                evicted = conn.execute(
+                    'DELETE FROM cache WHERE key IN ('
+                    'SELECT key FROM cache ORDER BY accessed LIMIT ?)', (excess,)).rowcount
+                self._count(conn, -evicted)
+
+    def delete(self, key):
+        with self._transaction() as conn:
+            deleted = conn.execute('DELETE FROM cache WHERE key = ?',
+                                   (self._key(key),)).rowcount
+            self._count(conn, -deleted)
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM cache')
+            conn.execute("UPDATE meta SET value = 0 WHERE name = 'count'")
+
+    def __contains__(self, key):
+        return self.get(key) is not MISSING
+
+    def __len__(self):
+        conn = self._db()
+        with self._lock:
+            return self._count(conn)
+
+
+class TieredCache(object):
+    """Two tier cache of a fast in-process cache in front of a slower one
+
+    Hits on the second tier are promoted to the first tier, for the time
+    they have left on the second tier.
+
+    Args:
+        memory: First tier cache (e.g. LRUCache)
+        disk: Second tier cache with get_entry (e.g. DiskCache)
+    """
+
+    def __init__(self, memory, disk):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=MISSING):
+        value = self.memory.get(key)
+        if value is not MISSING:
+            return value
+        entry = self.disk.get_entry(key)
+        if entry is MISSING:
+            return default
+        value, ttl = entry
+        self.memory.set(key, value, ttl)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.memory.set(key, value, ttl)
+        self.disk.set(key, value, ttl)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not MISSING
+
+    def __len__(self):
+        return len(self.disk)
+
+
+def make_cache(maxsize=1024, ttl=None, path=None):
+    """Creates an in-process cache, backed by a disk cache if path is given
+
+    Args:
+        maxsize (int): Maximum number of in-process entries
+        ttl (float, optional): Seconds until an entry expires
+        path (str, optional): Path of database file for the on-disk tier
+
+    Returns:
+        LRUCache: If path is None
+        TieredCache: If path is given
+    """
+    memory = LRUCache(maxsize=maxsize, ttl=ttl)
+    if path is None:
+        return memory
+    return TieredCache(memory, DiskCache(path, ttl=ttl))
+
+
+class RefreshingCache(object):
+    """Cache that serves expired values while refreshing them in the background
+
+    Values are fresh for their ttl, then served stale for up to stale_ttl
+    seconds while a single background refresh fetches a new value.
+
+    Stale keys are queued to a few refresher threads, started in each
+    process when first needed. A key already queued or being refreshed is
+    not queued again, and keys over max_queued are dropped, to be queued
+    again when next found stale.
+
+    Values are fetched with the trace of the query they are fetched for,
+    or NULL_TRACE when refreshed in the background, as the query that
+    found the value stale is answered without waiting for the refresh.
+
+    Args:
+        cache: Cache to store (value, fresh until) entries in
+        stale_ttl (float): Seconds an expired value may still be served
+        refreshers (int, optional): Refresher threads. Default to 2
+        max_queued (int, optional): Stale keys waiting for a refresher at
+            most. Default to 1000
+    """
+
+    def __init__(self, cache, stale_ttl, refreshers=2, max_queued=1000):
+        self.cache = cache
+        self.stale_ttl = stale_ttl
+        self.refreshers = refreshers
+        self.max_queued = max_queued
+        self._refreshing = set()
+        self._lock = RLock()
+        self._pid = None
+        self._queue = None
+
+    def get(self, key, fetch, ttl):
+        """Gets value of key, fetching it if missing
+
+        Args:
+            key: Hashable key
+            fetch: Function of a trace returning the value of key. Values of
+                None are not cached
+            ttl (float): Seconds the fetched value is fresh for
+
+        Returns:
+            Any: Cached or fetched value
+        """
+        value = self.peek(key, fetch, ttl)
+        if value is MISSING:
+            value = self._fetch(key, fetch, ttl, current_trace())
+        return value
+
+    def peek(self, key, fetch, ttl):
+        """Gets cached value of key without fetching it if missing
+
+        A stale value is still refreshed in the background with fetch.
+
+        Returns:
+            Any: Cached value, or MISSING if not cached
+        """
+        entry = self.cache.get(key)
+        if entry is MISSING:
+            return MISSING
+
+        value, fresh_until = entry
+        if fresh_until < time.time():
+            self._refresh(key, fetch, ttl)
+        return value
+
+    def put(self, key, value, ttl):
+        """Caches value of key for ttl seconds. Values of None are not cached"""
+        if value is not None:
+            self.cache.set(key, (value, time.time() + ttl), ttl + self.stale_ttl)
+
+    def _fetch(self, key, fetch, ttl, trace):
+        value = fetch(trace)
+        self.put(key, value, ttl)
+        return value
+
+    def _refresh(self, key, fetch, ttl):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Threads do not survive a fork, start those of this process
+                self._pid = os.getpid()
+                self._refreshing = set()
+                self._queue = Queue.Queue(self.max_queued)
+                for _ in xrange(self.refreshers):
+                    thread = Thread(target=self._refresher, args=(self._queue,))
+                    thread.daemon = True
+                    thread.start()
+            if key in self._refreshing:
+                return
+            try:
+                self._queue.put_nowait((key, fetch, ttl))
+            except Queue.Full:
+                return
+            self._refreshing.add(key)
+
+    def _refresher(self, queue):
+        while True:
+            key, fetch, ttl = queue.get()
+            try:
+                self._fetch(key, fetch, ttl, NULL_TRACE)
+            except Exception:
+                # Keep refreshing other keys, as a dying thread would have
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+
+class CachedParser(object):
+    """Parser that caches parse trees of sentences
+
+    Trees are stored in single line bracket form, e.g:
+    (SBARQ (WHNP (WP Who)) (SQ (VBZ is) (NP (NNP Obama))) (. ?))
+
+    Args:
+        parser: Parser to parse sentences that are not cached
+        cache: Cache of sentence to bracketed tree
+    """
+
+    def __init__(self, parser, cache):
+        self.parser = parser
+        self.cache = cache
+
+    @staticmethod
+    def dumps(tree):
+        """Serializes a tree to bracket form"""
+        return tree.pformat(margin=sys.maxint)
+
+    @staticmethod
+    def loads(data):
+        """Deserializes a tree from bracket form"""
+        return Tree.fromstring(data)
+
+    def get(self, sent):
+        """Gets cached tree of sentence, or None if not cached"""
+        data = self.cache.get(sent)
+        if data is MISSING:
+            return None
+        return self.loads(data)
+
+    def put(self, sent, tree):
+        """Caches tree of sentence"""
+        # Empty trees are returned when the server fails, do not cache them
+        if len(tree):
+            self.cache.set(sent, self.dumps(tree))
+
+    def parse(self, sent):
+        tree = self.get(sent)
+        if tree is None:
+            trace = current_trace()
+            trace.count('parse_cache.misses')
+            with trace.span('corenlp'):
+                tree = self.parser.parse(sent)
+            self.put(sent, tree)
+        else:
+            current_trace().count('parse_cache.hits')
+        return tree
@@ -0,0 +1,149 @@
+"""Lexicon of WikiData property names
+
+Maps English labels, aliases and their inflected forms to WikiData
+property IDs, so that common properties are resolved without searching
+WikiData. The bundled lexicon is data/properties.json, regenerate it from a
+Wikidata dump with local_store.build_lexicon, which merges in the
+hand-curated names of data/curated_properties.json, e.g. marry or birthday.
+"""
+import json
+import os
+from utils import normalize_name
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'properties.json')
+CURATED_PATH = os.path.join(os.path.dirname(__file__), 'data', 'curated_properties.json')
+
+# Hand-coded property IDs of names by context, the type of question or the
+# operator of a property match. '*' is any context
+CONTEXTS = {
+    'born': {
+        'where': 'P19', # place of birth
+        'when': 'P569', # date of birth
+    },
+    'height': {
+        '*': 'P2044,P2048', # elevation above sea level, height
+    },
+    # Lookup for died defaults to place of death
+    'died': {
+        'where': 'P20', # place of death
+        'when': 'P570', # date of death
+        'from': 'P509', # cause of death
+        'by': 'P509',
+        'of': 'P509',
+    },
+    'killed': {
+        'from': 'P509',
+        'by': 'P509',
+        'of': 'P509',
+    },
+}
+
+IRREGULAR_PLURALS = {
+    'child': 'children',
+    'wife': 'wives',
+    'life': 'lives',
+    'person': 'people',
+    'man': 'men',
+    'woman': 'women',
+    'alumnus': 'alumni',
+    'monarch': 'monarchs',
+}
+
+# Prepositions ending the head of a name, e.g. place of birth
+PREPOSITIONS = ['of', 'in', 'into', 'at', 'on', 'under', 'to', 'by', 'for', 'with',
+                'from', 'after', 'as']
+
+# Words that are not nouns, verb forms ending in -ed and -ing are skipped too
+NOT_NOUNS = PREPOSITIONS + ['a', 'an', 'the', 'born', 'held', 'spoken']
+
+
+def pluralize(word):
+    """Gets the plural of an English noun"""
+    if word in IRREGULAR_PLURALS:
+        return IRREGULAR_PLURALS[word]
+    if word.endswith('man'):
+        return word[:-3] + 'men'
+    if word.endswith('y') and word[-2:-1] not in 'aeiou':
+        return word[:-1] + 'ies'
+    if word.endswith(('s', 'x', 'z', 'ch', 'sh')):
+        return word + 'es'
+    return word + 's'
+
+
+def inflections(name):
+    """Gets inflected forms of a property name, e.g. places of birth
+
+    The head noun of the name, the word before the first preposition or else
+    the last word, is pluralized. Names whose head is already plural or is
+    not a noun, names ending with a preposition like adjacent to, and
+    alternatives like sex or gender, have no inflections.
+
+    Returns:
+        list: Inflected forms, excluding name
+    """
+    words = normalize_name(name).split()
+    if not words or 'or' in words or '/' in words or words[-1] in PREPOSITIONS:
+        return []
+    head = len(words) - 1
+    for i, word in enumerate(words[1:]):
+        if word in PREPOSITIONS:
+            head = i
+            break
+    word = words[head]
+    if word in NOT_NOUNS or word.endswith(('ed', 'ing')) or not word.isalpha():
+        return []
+    if word.endswith('s') and not word.endswith('ss'):
+        return []
+    plural = words[:head] + [pluralize(word)] + words[head + 1:]
+    return [' '.join(plural)]
+
+
+class PropertyLexicon(object):
+    """Resolves property names to WikiData property IDs in memory
+
+    Args:
+        path (str, optional): Path of a lexicon JSON file. Default to the
+            bundled lexicon
+    """
+
+    def __init__(self, path=None):
+        with open(path or DEFAULT_PATH) as f:
+            lexicon = json.load(f)
+        self.version = lexicon['version']
+        self.names = lexicon['names']
+        self.contexts = lexicon.get('contexts', {})
+
+    def __len__(self):
+        return len(self.names)
+
+    def get(self, name, context=None):
+        """Gets the property ID of a name
+
+        Args:
+            name (str): Property name, e.g. wife
+            context (str, optional): Type of question or operator of a
+                property match, for hand-coded mappings
+
+        Returns:
+            str: Comma separated WikiData property IDs, or None if unknown
+        """
+        if not name:
+            return None
+        name = normalize_name(name)
+        contexts = self.contexts.get(name, {})
+        if context in contexts:
+            return contexts[context]
+        if '*' in contexts:
+            return contexts['*']
+        return self.names.get(name)
+
+
+_default = None
+
+
+def default_lexicon():
+    """Gets the bundled lexicon, loaded once"""
+    global _default
+    if _default is None:
+        _default = PropertyLexicon()
+    return _default
@@ -0,0 +1,632 @@
+"""Offline knowledge store built from a Wikidata JSON dump
+
+The store is a directory of memory-mapped files:
+
+- strings.bin, strings.idx: Every string in the store, in sorted order, so
+  that the index of a string is its rank and can be found by binary search
+- spo.bin: (subject, property, object, kind) records sorted by subject and
+  property, to get the values of a property of a subject
+- pos.bin: The same triples as (property, object, subject, kind) records
+  sorted by property and object, to get the subjects having a property value
+- names.bin: (name, entity, kind, sitelinks) records sorted by normalized
+  English label or alias. As names are sorted, the names starting with a
+  prefix are a range found by binary search, like the leaves of a trie
+
+Labels, descriptions, aliases and sitelink counts are stored as triples of
+the pseudo properties in META_PROPS. How the store was built is recorded in
+meta.json.
+"""
+import bz2
+import gzip
+import json
+import mmap
+import os
+import sqlite3
+import struct
+from answer import Answer
+from api_adapter import LoggingInterface
+from lexicon import CONTEXTS, CURATED_PATH, default_lexicon, inflections
+from utils import normalize_name
+from wikidata import WikiData, WikiDataAnswer
+
+# Kinds of objects
+ITEM, STRING, TIME, QUANTITY = range(4)
+# Kinds of names
+LABEL, ALIAS = range(2)
+
+LABEL_PROP = 'label'
+DESC_PROP = 'description'
+ALIAS_PROP = 'alias'
+SITELINKS_PROP = 'sitelinks'
+META_PROPS = [LABEL_PROP, DESC_PROP, ALIAS_PROP, SITELINKS_PROP]
+
+TRIPLE = struct.Struct('<IIII')
+NAME = struct.Struct('<IIII')
+OFFSET = struct.Struct('<Q')
+
+
+def open_dump(path):
+    """Opens a dump, which may be compressed with gzip or bz2"""
+    if path.endswith('.gz'):
+        return gzip.open(path)
+    if path.endswith('.bz2'):
+        return bz2.BZ2File(path)
+    return open(path)
+
+
+def read_dump(path):
+    """Reads entities from a Wikidata JSON dump, one entity per line"""
+    with open_dump(path) as f:
+        for line in f:
+            line = line.strip().rstrip(',')
+            if line in ['', '[', ']']:
+                continue
+            yield json.loads(line)
+
+
+def claim_value(snak):
+    """Gets (value, kind) of a claim's main snak, or None if not supported"""
+    if snak.get('snaktype') != 'value':
+        return None
+    datavalue = snak['datavalue']
+    value = datavalue['value']
+    value_type = datavalue['type']
+
+    if value_type == 'wikibase-entityid':
+        if 'id' in value:
+            return value['id'], ITEM
+        prefix = 'P' if value.get('entity-type') == 'property' else 'Q'
+        return '%s%d' % (prefix, value['numeric-id']), ITEM
+    if value_type == 'time':
+        return value['time'].lstrip('+'), TIME
+    if value_type == 'quantity':
+        return value['amount'].lstrip('+'), QUANTITY
+    if value_type == 'string':
+        return value, STRING
+    if value_type == 'monolingualtext':
+        return value['text'], STRING
+    return None
+
+
+def entity_triples(entity, language='en', properties=None):
+    """Gets (subject, property, object, kind) triples of a dump entity
+
+    Args:
+        entity (dict): Entity of the dump
+        language (str): Language of labels, descriptions and aliases
+        properties (set, optional): Properties to keep claims of. Default to
+            None (all properties)
+    """
+    subject = entity['id']
+    label = entity.get('labels', {}).get(language)
+    if not label:
+        return
+
+    yield subject, LABEL_PROP, label['value'], STRING
+    desc = entity.get('descriptions', {}).get(language)
+    if desc:
+        yield subject, DESC_PROP, desc['value'], STRING
+    for alias in entity.get('aliases', {}).get(language, []):
+        yield subject, ALIAS_PROP, alias['value'], STRING
+    yield subject, SITELINKS_PROP, str(len(entity.get('sitelinks', {}))), QUANTITY
+
+    for prop, claims in entity.get('claims', {}).iteritems():
+        if properties is not None and prop not in properties:
+            continue
+        for claim in claims:
+            value = claim_value(claim['mainsnak'])
+            if value:
+                yield (subject, prop) + value
+
+
+def build_store(dump_path, store_dir, language='en', properties=None, complete=False):
+    """Builds a store from a Wikidata JSON dump
+
+    Triples and names are streamed to a temporary SQLite database in
+    store_dir, which sorts them on disk, so memory does not grow with the
+    size of the dump.
+
+    Args:
+        dump_path (str): Path of the dump, may be compressed with gzip or bz2
+        store_dir (str): Directory to write the store to
+        language (str): Language of labels, descriptions and aliases
+        properties (list, optional): Properties to keep claims of. Default to
+            None (all properties)
+        complete (bool, optional): Whether the dump has every entity, so
+            that the entities matching a query can be listed and counted
+            from the store, see LocalWikiData. Default to False
+    """
+    if properties is not None:
+        properties = set(properties)
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+
+    db_path = os.path.join(store_dir, 'build.db')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = sqlite3.connect(db_path)
+    db.text_factory = str
+    try:
+        db.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            PRAGMA temp_store = FILE;
+            CREATE TABLE triples (s TEXT, p TEXT, o TEXT, kind INTEGER);
+            CREATE TABLE names (n TEXT, e TEXT, kind INTEGER, sitelinks INTEGER);
+            CREATE TABLE strings (s TEXT PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE ids (s TEXT PRIMARY KEY, id INTEGER) WITHOUT ROWID;
+        """)
+        for entity in read_dump(dump_path):
+            sitelinks = len(entity.get('sitelinks', {}))
+            triples = list(entity_triples(entity, language, properties))
+            db.executemany('INSERT INTO triples VALUES (?, ?, ?, ?)', triples)
+            db.executemany('INSERT INTO names VALUES (?, ?, ?, ?)', [
+                (normalize_name(obj), subject,
+                 LABEL if prop == LABEL_PROP else ALIAS, sitelinks)
+                for subject, prop, obj, _ in triples
+                if prop in [LABEL_PROP, ALIAS_PROP]])
+
+        # Text is compared as UTF-8 bytes, so strings are in byte order
+        for column in ['s', 'p', 'o']:
+            db.execute('INSERT OR IGNORE INTO strings SELECT %s FROM triples' % column)
+        db.execute('INSERT OR IGNORE INTO strings SELECT n FROM names')
+        with open(os.path.join(store_dir, 'strings.bin'), 'wb') as strings, \
+                open(os.path.join(store_dir, 'strings.idx'), 'wb') as offsets:
+            offset = 0
+            offsets.write(OFFSET.pack(offset))
+            ids = []
+            for i, (string,) in enumerate(db.execute('SELECT s FROM strings ORDER BY s')):
+                strings.write(string)
+                offset += len(string)
+                offsets.write(OFFSET.pack(offset))
+                ids.append((string, i))
+                if len(ids) >= 10000:
+                    db.executemany('INSERT INTO ids VALUES (?, ?)', ids)
+                    ids = []
+            db.executemany('INSERT INTO ids VALUES (?, ?)', ids)
+
+        triples = """
+            SELECT DISTINCT %s FROM triples t
+            JOIN ids s ON s.s = t.s JOIN ids p ON p.s = t.p JOIN ids o ON o.s = t.o
+            ORDER BY 1, 2, 3, 4"""
+        write_records(db, os.path.join(store_dir, 'spo.bin'), TRIPLE,
+                      triples % 's.id, p.id, o.id, t.kind')
+        write_records(db, os.path.join(store_dir, 'pos.bin'), TRIPLE,
+                      triples % 'p.id, o.id, s.id, t.kind')
+        write_records(db, os.path.join(store_dir, 'names.bin'), NAME, """
+            SELECT DISTINCT ni.id, ei.id, n.kind, n.sitelinks FROM names n
+            JOIN ids ni ON ni.s = n.n JOIN ids ei ON ei.s = n.e
+            ORDER BY 1, 2, 3, 4""")
+    finally:
+        db.close()
+        os.remove(db_path)
+
+    with open(os.path.join(store_dir, 'meta.json'), 'w') as f:
+        json.dump({
+            'language': language,
+            'properties': sorted(properties) if properties is not None else None,
+            'complete': complete,
+        }, f)
+
+
+def write_records(db, path, record, query):
+    """Writes the rows of a query to a file of fixed size records"""
+    with open(path, 'wb') as f:
+        for row in db.execute(query):
+            f.write(record.pack(*row))
+
+
+def build_lexicon(dump_path, lexicon_path, version, language='en',
+                  curated_path=CURATED_PATH):
+    """Builds a property lexicon from the properties of a Wikidata JSON dump
+
+    Names are labels, aliases, the hand-curated names of curated_path and
+    their inflections. A name of several properties resolves to an
+    uninflected name before an inflected one, to a curated name before a
+    label before an alias, then to the property with the lowest ID.
+
+    Args:
+        dump_path (str): Path of the dump, may be compressed with gzip or bz2
+        lexicon_path (str): Path to write the lexicon JSON to
+        version (str): Version of the lexicon
+        language (str): Language of labels and aliases
+        curated_path (str, optional): Path of a JSON file of curated names
+            to property IDs, or None. Default to the bundled curated names
+    """
+    ranks = {}
+
+    def add(name, kind, prop_id):
+        name = normalize_name(name)
+        forms = [(name, False)] + [(form, True) for form in inflections(name)]
+        for form, inflected in forms:
+            rank = (inflected, kind, int(prop_id[1:]), prop_id)
+            if form not in ranks or rank < ranks[form]:
+                ranks[form] = rank
+
+    if curated_path:
+        with open(curated_path) as f:
+            for name, prop_id in json.load(f)['names'].iteritems():
+                # Curated names rank before labels
+                add(name, LABEL - 1, prop_id)
+
+    for entity in read_dump(dump_path):
+        if entity.get('type') != 'property':
+            continue
+        label = entity.get('labels', {}).get(language)
+        if not label:
+            continue
+
+        prop_id = entity['id']
+        names = [(label['value'], LABEL)]
+        names += [(alias['value'], ALIAS)
+                  for alias in entity.get('aliases', {}).get(language, [])]
+        for name, kind in names:
+            add(name, kind, prop_id)
+
+    lexicon = {
+        'version': version,
+        'contexts': CONTEXTS,
+        'names': dict((name, rank[-1]) for name, rank in ranks.iteritems()),
+    }
+    with open(lexicon_path, 'w') as f:
+        json.dump(lexicon, f, indent=1, sort_keys=True, separators=(',', ': '))
+        f.write('\n')
+
+
+def map_file(path):
+    """Memory-maps a file read only, or returns an empty string if empty"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Records(object):
+    """Sorted fixed size records of a memory-mapped file"""
+
+    def __init__(self, data, record):
+        self.data = data
+        self.record = record
+
+    def __len__(self):
+        return len(self.data) // self.record.size
+
+    def __getitem__(self, i):
+        return self.record.unpack_from(self.data, i * self.record.size)
+
+    def lower_bound(self, prefix):
+        """Gets index of the first record not less than the fields of prefix"""
+        n = len(prefix)
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid][:n] < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, prefix):
+        """Gets records starting with the fields of prefix"""
+        n = len(prefix)
+        records = []
+        for i in xrange(self.lower_bound(prefix), len(self)):
+            record = self[i]
+            if record[:n] != prefix:
+                break
+            records.append(record)
+        return records
+
+
+class TripleStore(object):
+    """Reader of a store built by build_store
+
+    Files are memory-mapped, so worker processes share their pages.
+
+    Args:
+        store_dir (str): Directory of the store
+
+    Attributes:
+        complete (bool): Whether the store was built from a dump of every
+            entity, False for stores without meta.json
+    """
+
+    # Names starting with a searched prefix to rank at most
+    MAX_PREFIX_MATCHES = 10000
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self._strings = map_file(os.path.join(store_dir, 'strings.bin'))
+        self._offsets = Records(map_file(os.path.join(store_dir, 'strings.idx')), OFFSET)
+        self._spo = Records(map_file(os.path.join(store_dir, 'spo.bin')), TRIPLE)
+        self._pos = Records(map_file(os.path.join(store_dir, 'pos.bin')), TRIPLE)
+        self._names = Records(map_file(os.path.join(store_dir, 'names.bin')), NAME)
+        meta_path = os.path.join(store_dir, 'meta.json')
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        self.complete = meta.get('complete', False)
+
+    def _bytes(self, i):
+        start = self._offsets[i][0]
+        end = self._offsets[i + 1][0]
+        return self._strings[start:end]
+
+    def string(self, i):
+        """Gets string of index"""
+        return self._bytes(i).decode('utf-8')
+
+    def _lower_bound(self, s):
+        """Gets index of the first string not less than s"""
+        lo, hi = 0, len(self._offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._bytes(mid) < s:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def index(self, s):
+        """Gets index of string, or None if not in the store"""
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        i = self._lower_bound(s)
+        if i < len(self._offsets) - 1 and self._bytes(i) == s:
+            return i
+        return None
+
+    def objects(self, subject, prop):
+        """Gets (object, kind) values of a property of a subject"""
+        s, p = self.index(subject), self.index(prop)
+        if s is None or p is None:
+            return []
+        return [(self.string(o), kind) for _, _, o, kind in self._spo.range((s, p))]
+
+    def subjects(self, prop, obj):
+        """Gets subjects having obj as a value of a property"""
+        p, o = self.index(prop), self.index(obj)
+        if p is None or o is None:
+            return []
+        return [self.string(s) for _, _, s, _ in self._pos.range((p, o))]
+
+    def first(self, subject, prop):
+        """Gets first value of a property of a subject, or None"""
+        values = self.objects(subject, prop)
+        return values[0][0] if values else None
+
+    def search(self, name, _type='item', limit=7, exact=False):
+        """Searches entities by English label or alias, like wbsearchentities
+
+        Entities whose label or alias is name come first, then those whose
+        label or alias starts with name. Within each, labels come before
+        aliases and entities with more sitelinks first.
+
+        Args:
+            name (str): Name to search for, case and spacing are ignored
+            _type (str): One of 'item' or 'property'
+            limit (int): Maximum results
+            exact (bool, optional): Only match entities whose label or alias
+                is name. Default to False
+
+        Returns:
+            list: IDs of matching entities, best first
+        """
+        prefix = normalize_name(name).encode('utf-8')
+        if not prefix:
+            return []
+        id_prefix = 'P' if _type == 'property' else 'Q'
+
+        matches = []
+        lo = self._names.lower_bound((self._lower_bound(prefix),))
+        for i in xrange(lo, min(lo + self.MAX_PREFIX_MATCHES, len(self._names))):
+            n, e, kind, sitelinks = self._names[i]
+            key = self._bytes(n)
+            if not key.startswith(prefix) or (exact and key != prefix):
+                break
+            entity = self.string(e)
+            if entity.startswith(id_prefix):
+                matches.append((key != prefix, kind, -sitelinks, entity))
+
+        ids = []
+        for _, _, _, entity in sorted(matches):
+            if entity not in ids:
+                ids.append(entity)
+        return ids[:limit]
+
+    def search_result(self, name, _type='item', limit=7):
+        """Searches entities whose label or alias is name, see search
+
+        Names only starting with name are left to wbsearchentities, which
+        ranks them better than the store.
+
+        Returns:
+            dict: Result in the format of the wbsearchentities API, or None
+                if nothing matches
+        """
+        ids = self.search(name, _type, limit, exact=True)
+        if not ids:
+            return None
+        return {
+            'search': [{
+                'id': entity,
+                'label': self.first(entity, LABEL_PROP),
+                'description': self.first(entity, DESC_PROP),
+            } for entity in ids],
+        }
+
+
+class LocalWikiData(WikiData):
+    """Adapter answering WikiData queries from a local TripleStore
+
+    Has the same interface as WikiData. Queries that cannot be answered
+    from the store, e.g. because an entity or property value is missing or
+    a qualifier is needed, return None so that another backend can answer.
+    Entities are only listed or counted from a complete store, as entities
+    missing from a partial dump would be missing from the answer.
+
+    Nothing is requested from WikiData, so no session, caches or limiters
+    are created.
+
+    Args:
+        store (TripleStore, str): Store, or directory of the store
+        lexicon (PropertyLexicon, optional): Lexicon to resolve property
+            names with. Default to the bundled lexicon
+    """
+
+    KIND_TYPES = {
+        TIME: WikiDataAnswer.TIME_VALUE,
+        QUANTITY: WikiDataAnswer.QUANTITY_VALUE,
+    }
+
+    def __init__(self, store, lexicon=None):
+        LoggingInterface.__init__(self)
+        self.lexicon = lexicon or default_lexicon()
+        if not isinstance(store, TripleStore):
+            store = TripleStore(store)
+        self.store = store
+
+    def _get_ids(self, lookups):
+        ids = {}
+        for name, _type in lookups:
+            found = self.store.search(name, _type, limit=1, exact=True)
+            ids[(name, _type)] = found[0] if found else None
+        return ids
+
+    def _binding(self, value, kind):
+        """Builds a SPARQL style binding of a value"""
+        if kind == ITEM:
+            value = self.store.first(value, LABEL_PROP) or value
+        binding = {'valLabel': {'value': value}}
+        if kind in self.KIND_TYPES:
+            binding['type'] = {'value': self.KIND_TYPES[kind]}
+        return binding
+
+    def _get_desc(self, subject):
+        subject_id = self._get_id(subject)
+        desc = subject_id and self.store.first(subject_id, DESC_PROP)
+        if not desc:
+            return None
+        return Answer(data=desc)
+
+    def _get_property(self, subject, prop, prop_id=None):
+        lookups = [(subject, 'item')]
+        if not prop_id:
+            lookups.append((prop, 'property'))
+        ids = self._get_ids(lookups)
+
+        subject_id = ids[(subject, 'item')]
+        if not prop_id:
+            prop_id = ids[(prop, 'property')]
+
+        if not prop_id or not subject_id:
+            return None
+
+        bindings = [self._binding(value, kind)
+                    for pid in prop_id.split(',')
+                    for value, kind in self.store.objects(subject_id, pid)]
+        if not bindings:
+            return None
+        return WikiDataAnswer(sparql_query=None, bindings=bindings)
+
+    def get_properties(self, pairs, batch_size=None):
+        return [WikiDataAnswer(sparql_query=None, bindings=[
+            self._binding(value, kind)
+            for pid in prop_id.split(',')
+            for value, kind in self.store.objects(subject_id, pid)])
+            for subject_id, prop_id in pairs]
+
+    def _get_aliases(self, subject):
+        subject_id = self._get_id(subject)
+        if not subject_id:
+            return None
+        bindings = [self._binding(value, kind)
+                    for prop in [ALIAS_PROP, LABEL_PROP]
+                    for value, kind in self.store.objects(subject_id, prop)]
+        return WikiDataAnswer(sparql_query=None, bindings=bindings)
+
+    def find_entity(self, qtype, inst, props, limit=None):
+        # Leave props untouched for the next backend
+        return WikiData.find_entity(self, qtype, inst, list(props), limit)
+
+    def stream_entities(self, qtype, inst, props, page_size=None, limit=None):
+        if qtype not in ['which', 'who']:
+            raise ValueError('Cannot stream {0} queries'.format(qtype))
+        ans = self.find_entity(qtype, inst, props, limit)
+        if not ans:
+            return None
+        return iter(ans.data or [])
+
+    def _find_entity(self, qtype, inst, params, limit=None):
+        if qtype not in ['how many', 'which', 'who'] or not self.store.complete:
+            return None
+
+        ids = self._get_ids(self._find_entity_lookups(inst, params))
+        inst_id = ids[(inst, 'item')]
+        if not inst_id:
+            return None
+
+        # Instances of inst, or humans holding the position inst
+        vals = set(self.store.subjects('P31', inst_id))
+        vals.update(val for val in self.store.subjects('P39', inst_id)
+                    if ('Q5', ITEM) in self.store.objects(val, 'P31'))
+
+        for prop, prop_val, op in params:
+            if op in ['>', '<']:
+                prop_id = self._property_id(op, prop) or ids[(prop, 'property')]
+                if not prop_id:
+                    return None
+                try:
+                    bound = float(prop_val.replace(',', ''))
+                except ValueError:
+                    return None
+                vals = set(val for val in vals
+                           if self._compare(val, prop_id, op, bound))
+            elif op in ['in', 'by', 'of', 'from']:
+                if op == 'in' and prop_val.isdigit():
+                    # Needs start and end date qualifiers of the position
+                    return None
+                elif op == 'of' and prop_val:
+                    # Needs employer qualifier of the position
+                    return None
+
+                prop_val_id = ids[(prop_val, 'item')]
+                if not prop_val_id:
+                    return None
+                if prop:
+                    prop_id = self._property_id(op, prop) or ids[(prop, 'property')]
+                    if not prop_id:
+                        return None
+                    prop_ids = prop_id.split(',')
+                else:
+                    # Infer property from the classes of the value
+                    prop_ids = [pid for cls, _ in self.store.objects(prop_val_id, 'P31')
+                                for pid, _ in self.store.objects(cls, 'P1687')]
+                matches = set()
+                for prop_id in prop_ids:
+                    matches.update(self.store.subjects(prop_id, prop_val_id))
+                vals &= matches
+
+        if not vals:
+            return None
+        if qtype == 'how many':
+            return WikiDataAnswer(sparql_query=None, data=str(len(vals)))
+        bindings = [self._binding(val, ITEM) for val in sorted(vals)[:limit]]
+        return WikiDataAnswer(sparql_query=None, bindings=bindings)
+
+    def _compare(self, subject, prop_id, op, bound):
+        """Checks if any quantity value of the properties compares to bound
+
+        Args:
+            prop_id (str): Comma separated WikiData IDs of properties
+        """
+        values = [value for pid in prop_id.split(',')
+                  for value in self.store.objects(subject, pid)]
+        for value, kind in values:
+            if kind != QUANTITY:
+                continue
+            value = float(value)
+            if (op == '>' and value > bound) or (op == '<' and value < bound):
+                return True
+        return False
@@ -0,0 +1,284 @@
+from lango.matcher import get_tokens, get_raw_lower, get_raw, get_object_lower, get_object
+from nltk import Tree
+from tracing import current_trace
+
+ARG_TYPE_TO_FUNC = {
+    'r': get_raw_lower,
+    'R': get_raw,
+    'o': get_object_lower,
+    'O': get_object,
+}
+
+
+class Template(object):
+    """Compiled node of a rule template, e.g. NP:subject-o in "( NP:subject-o )"
+
+    Matches trees with the same semantics as lango.matcher.match_tokens, see
+    lango for the template syntax.
+    """
+
+    def __init__(self, tokens):
+        root_token = tokens[0]
+
+        # Equality
+        self.words = None
+        if root_token.find('=') >= 0:
+            self.words = root_token.split('=')[1].lower().split('|')
+            root_token = root_token.split('=')[0]
+
+        # Arg
+        self.arg_name = None
+        self.arg_func = None
+        if root_token.find(':') >= 0:
+            arg_tokens = root_token.split(':')[1].split('-')
+            self.arg_name = arg_tokens[0]
+            if len(arg_tokens) > 1:
+                self.arg_func = ARG_TYPE_TO_FUNC[arg_tokens[1]]
+            root_token = root_token.split(':')[0]
+
+        # Labels, None for wild card
+        self.labels = None if root_token == '.' else frozenset(root_token.split('/'))
+
+        # End symbol
+        self.exact = tokens[-1] == '$'
+        if self.exact:
+            tokens = tokens[:-1]
+
+        self.children = [Template(child) for child in tokens[1:]]
+
+    def match(self, tree, args):
+        """Checks if template matches tree
+
+        Args:
+            tree (Tree): Parsed tree structure
+            args (list): List to append matched (name, func, tree) to.
+                Arguments are only converted once the whole rule matches
+
+        Returns:
+            bool: If they match or not
+        """
+        if not isinstance(tree, Tree):
+            return False
+        if self.labels is not None and tree.label() not in self.labels:
+            return False
+        if self.exact:
+            if len(tree) != len(self.children):
+                return False
+        elif len(tree) < len(self.children):
+            return False
+        if self.words is not None and get_raw_lower(tree) not in self.words:
+            return False
+
+        if self.arg_name is not None:
+            args.append((self.arg_name, self.arg_func, tree))
+
+        for i, child in enumerate(self.children):
+            if not child.match(tree[i], args):
+                return False
+        return True
+
+    def disjoint(self, other):
+        """Checks if no tree can match both this and the other template"""
+        if self.labels is not None and other.labels is not None and \
+                not self.labels & other.labels:
+            return True
+        if self.words is not None and other.words is not None and \
+                not set(self.words) & set(other.words):
+            return True
+        if self.exact and len(other.children) > len(self.children):
+            return True
+        if other.exact and len(self.children) > len(other.children):
+            return True
+        for child, other_child in zip(self.children, other.children):
+            if child.disjoint(other_child):
+                return True
+        return False
+
+    def key_labels(self):
+        """Returns labels indexing the template: (root labels, first child labels)
+
+        Either may be None to match any label.
+        """
+        first_labels = self.children[0].labels if self.children else None
+        return self.labels, first_labels
+
+
+class CompiledRules(object):
+    """Rules compiled from a lango rules dict
+
+    Templates are parsed once, and indexed by the labels of the root and
+    first child of the tree they match, so that only candidate templates
+    are tried against a tree. Candidates keep the order of the rules.
+
+    Hits of each rule are counted. If adaptive, candidates are tried in
+    order of hits, but a rule is never moved ahead of an earlier rule that
+    could match the same tree, so the matched rule does not change.
+
+    Args:
+        rules (dict): A dictionary of query rules, see lango.matcher.match_rules
+    """
+
+    # Matches between reorderings of adaptive rules
+    REORDER_EVERY = 1000
+
+    def __init__(self, rules):
+        self.rules = []
+        for template, child_rules in rules.iteritems():
+            compiled_children = [(key, compile_rules(child))
+                                 for key, child in child_rules.iteritems()]
+            self.rules.append((len(self.rules), template,
+                               Template(get_tokens(template.split())),
+                               compiled_children))
+        self.hits = [0] * len(self.rules)
+        self.adaptive = False
+        self._candidates = {}
+        self._since_reorder = 0
+
+    def set_adaptive(self, adaptive=True):
+        """Enables or disables ordering by hits, for these and child rules"""
+        self.adaptive = adaptive
+        self._candidates = {}
+        for _, _, _, child_rules in self.rules:
+            for _, rules in child_rules:
+                rules.set_adaptive(adaptive)
+
+    def stats(self):
+        """Gets hits of the rules
+
+        Returns:
+            list: Dicts of template, hits and children (key to stats of child
+                rules), in order of rules
+        """
+        return [{
+            'template': template,
+            'hits': self.hits[index],
+            'children': dict((key, rules.stats()) for key, rules in child_rules),
+        } for index, template, _, child_rules in self.rules]
+
+    def disjoint(self, other):
+        """Checks if no tree can match both these and the other rules"""
+        return all(rule[2].disjoint(other_rule[2])
+                   for rule in self.rules for other_rule in other.rules)
+
+    def candidates(self, tree):
+        """Gets rules that may match tree, in order"""
+        label = tree.label()
+        first = tree[0] if len(tree) else None
+        first_label = first.label() if isinstance(first, Tree) else None
+
+        key = (label, first_label)
+        candidates = self._candidates.get(key)
+        if candidates is None:
+            candidates = []
+            for rule in self.rules:
+                labels, first_labels = rule[2].key_labels()
+                if labels is not None and label not in labels:
+                    continue
+                if first_labels is not None and first_label not in first_labels:
+                    continue
+                candidates.append(rule)
+            if self.adaptive:
+                candidates = order_by_hits(
+                    candidates, lambda rule: self.hits[rule[0]],
+                    lambda rule, other: rule[2].disjoint(other[2]))
+            self._candidates[key] = candidates
+        return candidates
+
+    def _hit(self, index):
+        self.hits[index] += 1
+        if self.adaptive:
+            self._since_reorder += 1
+            if self._since_reorder >= self.REORDER_EVERY:
+                self._since_reorder = 0
+                self._candidates = {}
+
+    def match_context(self, tree, parent_context={}):
+        """Recursively matches a Tree with the rules and returns context
+
+        Args:
+            tree (Tree): Parsed tree structure
+            parent_context (dict): Context of parent call
+
+        Returns:
+            dict: Context matched dictionary of matched rules or None if no
+                match
+        """
+        if not isinstance(tree, Tree):
+            return None
+
+        for index, _, template, child_rules in self.candidates(tree):
+            args = []
+            if not template.match(tree, args):
+                continue
+
+            context = parent_context.copy()
+            for name, func, arg_tree in args:
+                context[name] = func(arg_tree) if func else arg_tree
+
+            for key, rules in child_rules:
+                child_context = rules.match_context(context[key], context)
+                if child_context:
+                    context.update(child_context)
+                else:
+                    return None
+            self._hit(index)
+            return context
+        return None
+
+
+def order_by_hits(items, hits, disjoint):
+    """Orders items by most hits, keeping overlapping items in their order
+
+    An item is only moved ahead of an earlier item if they are disjoint.
+
+    Args:
+        items (list): Items in order of priority
+        hits: Function returning hits of an item
+        disjoint: Function checking if two items can never both match
+
+    Returns:
+        list: Reordered items
+    """
+    remaining = list(items)
+    ordered = []
+    while remaining:
+        # Items that do not overlap with any remaining item before them
+        available = [item for i, item in enumerate(remaining)
+                     if all(disjoint(item, prev) for prev in remaining[:i])]
+        best = max(available, key=hits)
+        ordered.append(best)
+        remaining.remove(best)
+    return ordered
+
+
+def compile_rules(rules):
+    """Compiles a lango rules dict, see CompiledRules"""
+    if isinstance(rules, CompiledRules):
+        return rules
+    return CompiledRules(rules)
+
+
+def match_rules(tree, rules, fun):
+    """Matches a Tree structure with rules, see lango.matcher.match_rules
+
+    Args:
+        tree (Tree): Parsed tree structure
+        rules (CompiledRules, dict): Compiled rules, or a dictionary of query
+            rules to compile
+        fun: Function to call
+
+    Returns:
+        Result of function call with context or None if nothing matched
+    """
+    trace = current_trace()
+    with trace.span('match'):
+        context = compile_rules(rules).match_context(tree)
+    if not context:
+        return None
+    args = fun.__code__.co_varnames
+    action_context = {}
+    for arg in args:
+        if arg in context:
+            action_context[arg] = context[arg]
+    with trace.span(fun.__name__):
+        return fun(**action_context)
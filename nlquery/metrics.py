@@ -0,0 +1,368 @@
+"""In-process metrics in the Prometheus text exposition format
+
+Metrics aggregates the traces of the queries of an engine, see
+NLQueryEngine metrics and tracing.Trace, into latency histograms of
+pipeline stages and backends, counters of queries, HTTP requests, errors
+and cache hits, and gauges of queries in flight. Metrics.render gives the
+text to serve on a /metrics endpoint.
+
+WorkerMetrics shares the metrics of the worker processes of a server, so
+that the /metrics endpoint of any worker serves the metrics of all.
+"""
+from cache import MISSING
+from tracing import timer
+
+# Upper bounds of latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Traced stages of a query, see tracing
+STAGES = ['parse', 'match', 'resolve', 'search', 'sparql', 'decode']
+
+# Spans of calls to backends to backend names
+BACKEND_SPANS = {
+    'corenlp': 'corenlp',
+    'search': 'wbsearchentities',
+    'wdqs': 'wdqs',
+}
+
+# Caches counted by traces, e.g. id_cache.hits
+CACHES = ['parse_cache', 'id_cache', 'answer_cache', 'sparql_cache', 'search_index']
+
+
+def format_value(value):
+    """Formats a sample value, e.g. 1, 0.25 or +Inf"""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(names, values):
+    """Formats labels of a sample, e.g. {stage="parse"}"""
+    if not names:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"')
+                     .replace('\n', r'\n'))
+        for name, value in zip(names, values))
+
+
+def render_family(name, help_, type_, samples):
+    """Gets a metric family in the text exposition format
+
+    Args:
+        samples (list): (name suffix, label names, label values, value)
+            tuples, see Metric.samples
+    """
+    lines = ['# HELP %s %s' % (name, help_), '# TYPE %s %s' % (name, type_)]
+    for suffix, names, values, value in samples:
+        lines.append('%s%s%s %s' % (name, suffix, format_labels(names, values),
+                                    format_value(value)))
+    return '\n'.join(lines)
+
+
+class Metric(object):
+    """Metric with a value per combination of label values
+
+    Args:
+        name (str): Name of the metric, e.g. nlquery_queries_total
+        help_ (str): Description of the metric
+        labels (list, optional): Names of labels. Default to none
+    """
+
+    type_ = None
+
+    def __init__(self, name, help_, labels=()):
+        self.name = name
+        self.help = help_
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        """Gets (name suffix, label names, label values, value) tuples"""
+        if not self.labels and not self.values:
+            return [('', (), (), 0)]
+        return [('', self.labels, key, value)
+                for key, value in sorted(self.values.iteritems())]
+
+    def render(self):
+        """Gets the metric in the text exposition format"""
+        return render_family(self.name, self.help, self.type_, self.samples())
+
+
+class Counter(Metric):
+    """Metric that only goes up, e.g. queries answered"""
+
+    type_ = 'counter'
+
+    def inc(self, n=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + n
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """Metric that goes up and down, e.g. queries in flight
+
+    Args:
+        fun (function, optional): Function getting a dict of label values
+            to the value of the gauge when rendered. Default to None
+        See Metric for other args
+    """
+
+    type_ = 'gauge'
+
+    def __init__(self, name, help_, labels=(), fun=None):
+        Metric.__init__(self, name, help_, labels)
+        self.fun = fun
+
+    def inc(self, n=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + n
+
+    def dec(self, n=1, **labels):
+        self.inc(-n, **labels)
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self.fun is not None:
+            self.values = self.fun()
+        return Metric.samples(self)
+
+
+class Histogram(Metric):
+    """Metric counting observations in buckets, e.g. latencies
+
+    Args:
+        buckets (tuple, optional): Upper bounds of buckets. Default to
+            DEFAULT_BUCKETS
+        See Metric for other args
+    """
+
+    type_ = 'histogram'
+
+    def __init__(self, name, help_, labels=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, help_, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        counts = self.values.get(key)
+        if counts is None:
+            # Count of each bucket, then sum of values
+            counts = self.values[key] = [0] * len(self.buckets) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        counts[-1] += value
+
+    def count(self, **labels):
+        counts = self.values.get(self._key(labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def samples(self):
+        samples = []
+        names = self.labels + ('le',)
+        for key, counts in sorted(self.values.iteritems()):
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                samples.append(('_bucket', names, key + (format_value(float(bound)),), total))
+            samples.append(('_sum', self.labels, key, counts[-1]))
+            samples.append(('_count', self.labels, key, total))
+        return samples
+
+
+class Metrics(object):
+    """Registry of metrics, with the metrics of an engine
+
+    Args:
+        buckets (tuple, optional): Upper bounds of latency buckets in
+            seconds. Default to DEFAULT_BUCKETS
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.metrics = []
+
+        self.queries = self.counter(
+            'nlquery_queries_total', 'Queries answered')
+        self.query_errors = self.counter(
+            'nlquery_query_errors_total', 'Queries that raised an error', ['error'])
+        self.query_seconds = self.histogram(
+            'nlquery_query_seconds', 'Latency of queries')
+        self.queries_in_flight = self.gauge(
+            'nlquery_queries_in_flight', 'Queries being answered')
+        self.stage_seconds = self.histogram(
+            'nlquery_stage_seconds', 'Latency of stages of queries', ['stage'])
+        self.backend_seconds = self.histogram(
+            'nlquery_backend_seconds', 'Latency of calls to backends', ['backend'])
+        self.http_requests = self.counter(
+            'nlquery_http_requests_total', 'HTTP requests to backends')
+        self.http_coalesced = self.counter(
+            'nlquery_http_coalesced_total',
+            'HTTP requests to backends answered by identical ones in flight')
+        self.http_retries = self.counter(
+            'nlquery_http_retries_total', 'HTTP requests to backends retried')
+        self.http_throttled = self.counter(
+            'nlquery_http_throttled_total', 'HTTP responses of backends asking to slow down')
+        self.http_errors = self.counter(
+            'nlquery_http_errors_total', 'HTTP requests to backends that failed', ['kind'])
+        self.cache_requests = self.counter(
+            'nlquery_cache_requests_total', 'Cache lookups', ['cache', 'result'])
+        self.cache_hit_ratio = self.gauge(
+            'nlquery_cache_hit_ratio', 'Ratio of cache lookups that hit', ['cache'],
+            fun=self._cache_hit_ratios)
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_, labels=()):
+        """Registers a Counter"""
+        return self._register(Counter(name, help_, labels))
+
+    def gauge(self, name, help_, labels=(), fun=None):
+        """Registers a Gauge"""
+        return self._register(Gauge(name, help_, labels, fun))
+
+    def histogram(self, name, help_, labels=(), buckets=None):
+        """Registers a Histogram"""
+        return self._register(Histogram(name, help_, labels, buckets or self.buckets))
+
+    def _cache_hit_ratios(self):
+        ratios = {}
+        for cache in CACHES:
+            hits = self.cache_requests.get(cache=cache, result='hit')
+            total = hits + self.cache_requests.get(cache=cache, result='miss')
+            if total:
+                ratios[(cache,)] = float(hits) / total
+        return ratios
+
+    def measure(self, trace):
+        """Gets a context manager measuring a query answered in trace"""
+        return _Measurement(self, trace)
+
+    def observe_trace(self, trace):
+        """Aggregates the stages, backend calls and counts of a trace"""
+        for name, seconds in trace.stages().iteritems():
+            if name in STAGES:
+                self.stage_seconds.observe(seconds, stage=name)
+        for name, _, duration, _ in trace.spans:
+            if name in BACKEND_SPANS and duration is not None:
+                self.backend_seconds.observe(duration, backend=BACKEND_SPANS[name])
+
+        counts = trace.counts
+        for cache in CACHES:
+            if cache + '.hits' in counts:
+                self.cache_requests.inc(counts[cache + '.hits'], cache=cache, result='hit')
+            if cache + '.misses' in counts:
+                self.cache_requests.inc(counts[cache + '.misses'], cache=cache, result='miss')
+        if 'http.requests' in counts:
+            self.http_requests.inc(counts['http.requests'])
+        if 'http.coalesced' in counts:
+            self.http_coalesced.inc(counts['http.coalesced'])
+        if 'http.retries' in counts:
+            self.http_retries.inc(counts['http.retries'])
+        if 'http.throttled' in counts:
+            self.http_throttled.inc(counts['http.throttled'])
+        for kind in ['timeouts', 'errors']:
+            if 'http.' + kind in counts:
+                self.http_errors.inc(counts['http.' + kind], kind=kind[:-1])
+
+    def render(self):
+        """Gets all metrics in the text exposition format"""
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+    def snapshot(self):
+        """Gets the samples of all metrics, see WorkerMetrics
+
+        Returns:
+            list: (name, help, type, samples) tuples, see Metric.samples
+        """
+        return [(metric.name, metric.help, metric.type_, metric.samples())
+                for metric in self.metrics]
+
+
+class WorkerMetrics(object):
+    """Metrics of the worker processes of a server, shared in a cache
+
+    Each worker publishes snapshots of its metrics under its number.
+    Rendering gives the samples of every worker with a worker label, so
+    that each sample comes from one worker and only goes up, whichever
+    worker is scraped. The snapshot of a worker is as old as its last
+    publish, workers should publish periodically.
+
+    Args:
+        metrics (Metrics): Metrics of this worker
+        cache: Cache shared by the workers, e.g. a DiskCache
+        worker (int): Number of this worker, from 0
+        workers (int): Number of workers
+    """
+
+    def __init__(self, metrics, cache, worker, workers):
+        self.metrics = metrics
+        self.cache = cache
+        self.worker = worker
+        self.workers = workers
+
+    def publish(self):
+        """Publishes a snapshot of the metrics of this worker"""
+        self.cache.set(self.worker, self.metrics.snapshot())
+
+    def render(self):
+        """Gets the metrics of all workers in the text exposition format
+
+        Publishes the metrics of this worker first, so that they are fresh.
+        """
+        self.publish()
+        families = []
+        samples = {}
+        for worker in xrange(self.workers):
+            snapshot = self.cache.get(worker)
+            if snapshot is MISSING:
+                continue
+            for name, help_, type_, family_samples in snapshot:
+                if name not in samples:
+                    families.append((name, help_, type_))
+                    samples[name] = []
+                samples[name].extend(
+                    (suffix, ('worker',) + tuple(names), (worker,) + tuple(values), value)
+                    for suffix, names, values, value in family_samples)
+        return '\n'.join(render_family(name, help_, type_, samples[name])
+                         for name, help_, type_ in families) + '\n'
+
+
+class _Measurement(object):
+
+    def __init__(self, metrics, trace):
+        self.metrics = metrics
+        self.trace = trace
+        self.start = None
+
+    def __enter__(self):
+        self.start = timer()
+        self.metrics.queries_in_flight.inc()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        metrics = self.metrics
+        metrics.queries_in_flight.dec()
+        metrics.queries.inc()
+        if exc_type is not None:
+            metrics.query_errors.inc(error=exc_type.__name__)
+        metrics.query_seconds.observe(timer() - self.start)
+        metrics.observe_trace(self.trace)
+        return False
@@ -1,13 +1,18 @@
+import os
 from collections import OrderedDict
-from lango.matcher import match_rules
+from matcher import compile_rules, match_rules, order_by_hits
 from lango.parser import StanfordServerParser
 from pattern.en import singularize
 from wikidata import WikiData
-from utils import first
+from local_store import LocalWikiData
 from api_adapter import LoggingInterface
 from answer import Answer
+from cache import make_cache, CachedParser
+from tracing import Trace, NULL_TRACE, NULL_SPAN
+from rules import SUBJ_RULES, SUBJECT_PROP_RULES, PROP_RULES, FIND_ENTITY_RULES
 
 from threading import local
+from gevent.pool import Pool
 
 class NLQueryEngine(LoggingInterface):
     """
@@ -16,151 +21,96 @@ class NLQueryEngine(LoggingInterface):
     - What is X's Y
     """
 
-    def __init__(self, host='localhost', port=9000, properties={}):
-        LoggingInterface.__init__(self)
-        self.parser = StanfordServerParser(host, port, properties)
+    # Formats of answers, see query
+    FORMATS = ['raw', 'plain', 'json']
 
+    def __init__(self, host='localhost', port=9000, properties={}, cache_dir=None,
+                 adaptive=False, store_dir=None, offline=False, trace=False,
+                 metrics=None):
         """
-        Rule for matching a subject and/or property of NP
-        Matches:
-        - subject            : Subject to get property of
-        - prop     (optional): Propert to get of subject
-
-        Examples:
-        - Obama born
-        - Obama
-        - Obama's birthday
-        - Barack Obama's wife
-        """
-        self.subj_rules = OrderedDict([
-            # When was (Obama born)
-            ('( NP ( NP:subject-o ) ( VP:prop-o ) )', {}),
-            # What is (the birth day of Obama)
-            ('( NP ( NP:prop-o ) ( PP ( IN ) ( NP:subject-o ) ) )', {}),
-            # What is (Obama's birthday)
-            ('( NP ( NP:subject-o ( NNP ) ( POS ) ) ( NN/NNS:prop-o ) $ )', {}),
-            # What is (Obama's birth day)
-            ('( NP ( NP:subject-o ( NNP ) ( POS ) ) ( NN/JJ:prop-o ) ( NN/NNS:prop2-o ) )', {}),
-            # What is (Barrack Obama's birthday)
-            ('( NP ( NP:subject-o ( NNP ) ( NNP ) ( POS ) ) ( NN/NNS:prop-o ) $ )', {}),
-            # What is (Barack Obama's birth day)
-            ('( NP ( NP:subject-o ( NNP ) ( NNP ) ( POS ) ) ( NN/JJ:prop-o ) ( NN/NNS:prop2-o ) )', {}),
-            ('( NP:subject-o )', {}),
-        ])
+        Args:
+            host (str): Host of the CoreNLP server
+            port (int): Port of the CoreNLP server
+            properties (dict): Properties for the CoreNLP server
+            cache_dir (str, optional): Directory to persist caches in. Default
+                to None (in-process caches only)
+            adaptive (bool, optional): Try rules and families of rules in
+                order of hits of this engine, where that cannot change the
+                matched rule. Default to False
+            store_dir (str, optional): Directory of a local store built from
+                a Wikidata dump, see local_store.build_store. Queries are
+                answered from the store before WikiData. Default to None
+            offline (bool, optional): Only answer queries from the local
+                store. Default to False
+            trace (bool, optional): Trace the stages of each query, the
+                trace is in the raw format of answers, see tracing.Trace.
+                Default to False
+            metrics (Metrics, optional): Metrics to aggregate the traces of
+                queries in, see metrics.Metrics. Default to None
 
+        Raises:
+            ValueError: If offline without a store_dir
         """
-        Rule for matching subject property query
-        Matches:
-        - qtype               : Question type (who, where, what, when)
-        - subject             :  Subject to get property of
-        - prop      (optional): Property to get of subject
-        - prop2     (optional): Second part of property
-        - prop3     (optional): Overwrite property
-        - jj        (optional): Adjective that will be property (e.g. many/tall/high)
-
-        Examples:
-        - What religion is Obama?
-        - Who did Obama marry?
-        - Who is Obama?
-        - Who is Barack Obama's wife?
-        - How tall is Mt. Everest?
-        """
-        self.subject_prop_rules = {
-            '( SBARQ ( WHNP/WHADVP/WHADJP:qtype_t ) ( SQ:sq_t ) )': {
-                'qtype_t': OrderedDict([
-                    # What religion
-                    ('( WHNP ( WDT:qtype-o=what ) ( NN:prop3-o ) )', {}),
-                    # How many/tall
-                    ('( WHADJP ( WRB:qtype-o ) ( JJ:jj-o ) )', {}),
-                    # What/where/who
-                    ('( WHNP/WHADVP:qtype-o )', {}),
-                ]),
-                'sq_t': {
-                    # What ethnicity is Obama
-                    '( SQ ( VP ( ADVP:prop-o ) ) ( VBZ ) ( VP:suject-o ) )': {},
-                    # Who did Obama marry
-                    '( SQ ( VBD:action-o ) ( NP:subj_t ) ( VP:prop-o ) )': {
-                        'subj_t': self.subj_rules
-                    },
-                    # Who did 
-                    '( SQ ( VP ( VBZ/VBD/VBP:action-o ) ( NP:subj_t ) ) )': {
-                        'subj_t': self.subj_rules
-                    },
-                    # Who is Edward Thatch known as
-                    '( SQ ( VBZ:action-o ) ( NP:subj_t ) ( VP:prop-o ) )': {
-                        'subj_t': self.subj_rules,
-                    },
-                    # What is Obama
-                    '( SQ ( VBZ/VBD/VBP:action-o ) ( NP:subj_t ) )': {
-                        'subj_t': self.subj_rules
-                    }
-                }
-            }
-        }
+        if offline and not store_dir:
+            raise ValueError('Offline engine needs a store_dir')
+        LoggingInterface.__init__(self)
+        self.cache_dir = cache_dir
+        self.adaptive = adaptive
+        self.trace = trace
+        self.metrics = metrics
+        self.family_hits = {'find_entity': 0, 'subject_prop': 0}
+        # Rules are compiled per engine, so that the hits and order of rules
+        # of an engine do not change other engines, see rules.py
+        self.subj_rules = compile_rules(SUBJ_RULES)
+        self.subject_prop_rules = compile_rules(SUBJECT_PROP_RULES)
+        self.prop_rules = compile_rules(PROP_RULES)
+        self.find_entity_rules = compile_rules(FIND_ENTITY_RULES)
+        if adaptive:
+            for rules in [self.find_entity_rules, self.subject_prop_rules]:
+                rules.set_adaptive()
+        self.parser = CachedParser(
+            StanfordServerParser(host, port, properties),
+            make_cache(maxsize=10000, path=self._cache_path('trees.db')))
+        self.local = LocalWikiData(store_dir) if store_dir else None
+        self.offline = offline
+        # Names are searched in the local store before wbsearchentities
+        self.wd = self._make_wikidata(
+            id_cache=make_cache(maxsize=10000, ttl=WikiData.ID_TTL,
+                                path=self._cache_path('ids.db')),
+            sparql_cache=make_cache(maxsize=1000,
+                                    path=self._cache_path('sparql.db')),
+            answer_cache=make_cache(maxsize=10000,
+                                    path=self._cache_path('answers.db')),
+            search_index=self.local.store if self.local else None)
+
+    def _make_wikidata(self, **kwargs):
+        """Creates the WikiData backend with the caches of the engine, see WikiData"""
+        return WikiData(**kwargs)
+
+    def _cache_path(self, name):
+        """Returns path of a persisted cache, or None if not persisting"""
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, name)
 
-        """
-        Rule for getting property of NP or VP
-        Matches:
-        prop : Property of instance to match
-        op   : Operation to match property
-        value: Value of property 
-
-        Examples:
-        - born in 1950
-        - have population over 100,000
-        """
-        self.prop_rules = OrderedDict([
-            # 
-            ('( SQ/VP ( VB/VBP/VBD ) ( VP ( VBN:prop-o ) ( PP ( IN:op-o ) ( NP:value-o ) ) ) )', {}),
-            # are in Asia
-            ('( SQ/VP ( VB/VBP/VBD=are ) ( PP ( IN:op-o ) ( NP:value-o ) ) )', {}),
-            # died from laryngitis
-            ('( SQ/VP ( VB/VBP/VBD:prop-o ) ( PP ( IN:op-o ) ( NP:value-o ) ) )', {}),
-            # have population over 1000000
-            ('( SQ/VP ( VB/VBP/VBD ) ( NP ( NP:prop-o ) ( PP ( IN:op-o ) ( NP/CD/JJ:value-o ) ) ) )', {}),
-            ('( SQ/VP ( VB/VBP/VBD ) ( NP:prop-o ) ( NP ( QP ( JJR:op-o ) ( IN ) ( CD:value-o ) ) ) )', {}),
-            ('( SQ/VP ( VB/VBP/VBD ) ( NP ( QP ( JJR:op-o ) ( IN=than ) ( NP/CD/JJ:value-o ) ) ( NNS:value_units-o ) ) )', {}),
-            ('( PP ( IN:op-o ) ( NP ( NP:value-o ) ( PP:pp_t ) ) )', {}),
-            ('( PP ( IN:op-o ) ( NP:value-o ) )', {}),
-        ])
+    def subject_query(self, qtype, subject, action, jj=None, prop=None, prop2=None, prop3=None):
+        """Transforms matched context into query parameters and performs query
 
+        See subject_params for args
+
+        Returns:
+            Answer: Answer from query, or empty Answer if None
         """
-        Rules for finding entity queries
-        Matches:
-        qtype                   : question type (how many, which)
-        inst                    : instance of entity to match
-        prop_match_t  (optional): Parse tree for first property match
-        prop_match2_t (optional): Parse tree for second property match
-
-        Examples:
-        - How many POTUS are there?
-        - Which POTUS are born in 1950?
-        - How many books are written by George Orwell?
-        - How many countries are in Asia and have population over 100,000?
-        """
-        self.find_entity_rules = OrderedDict([
-            ('( SBARQ ( WHNP ( WHNP ( WHADJP:qtype-o ) ( NNS:inst-O ) ) ( PP:prop_match_t ) ) )', {}),
-            ('( SBARQ ( WHNP:qtype-o=who ) ( SQ:sq_t ) )', {
-                'sq_t': {
-                    '( SQ ( VBD/VBZ ) ( NP ( NP:inst-O ) ( PP:prop_match_t ) ) )': {}
-                },
-            }),
-            ('( SBARQ ( WHNP ( WHADJP/WDT/WHNP:qtype-o ) ( NNS/NN/NP:inst-O ) ) ( SQ:sq_t ) )', {
-                'sq_t': OrderedDict([
-                    # are there
-                    ('( SQ ( VBP ) ( NP ( EX=there ) ) )', {}),
-                    # are in Asia and have population over 100,000
-                    ('( SQ ( VP ( VP:prop_match_t ) ( CC ) ( VP:prop_match2_t ) ) )', {}),
-                    ('( SQ ( VP:prop_match_t ) )', {}),
-                    ('( SQ:prop_match_t )', {}),
-                ])
-            }),
-        ])
-
-        self.wd = WikiData()
+        params = self.subject_params(qtype, subject, action, jj, prop, prop2, prop3)
+        ans = self.get_property(**params)
+        if not ans:
+            ans = Answer()
 
-    def subject_query(self, qtype, subject, action, jj=None, prop=None, prop2=None, prop3=None):
-        """Transforms matched context into query parameters and performs query
+        ans.params = params
+        return ans
+
+    def subject_params(self, qtype, subject, action, jj=None, prop=None, prop2=None, prop3=None):
+        """Transforms matched context into query parameters
 
         Args:
             qtype: Matched type of query (what, who, where, etc.)
@@ -172,7 +122,7 @@ class NLQueryEngine(LoggingInterface):
             prop3 (optional): Matched prop
 
         Returns:
-            Answer: Answer from query, or empty Answer if None
+            dict: Arguments of get_property
         """
         if jj == 'old':
             # How old is Obama?
@@ -192,16 +142,11 @@ class NLQueryEngine(LoggingInterface):
             if action not in ['is', 'was']:
                 prop = action
 
-        ans = self.get_property(qtype, subject, prop)
-        if not ans:
-            ans = Answer()
-
-        ans.params = {
+        return {
             'qtype': qtype,
             'subject': subject,
             'prop': prop,
         }
-        return ans
 
     def get_prop_tuple(self, prop=None, value=None, op=None, value_units=None, pp_t=None):
         """Returns a property tuple (prop, value, op). E.g. (population, 1000000, >)
@@ -249,6 +194,27 @@ class NLQueryEngine(LoggingInterface):
         """Transforms matched context into query parameters and performs query for
         queries to find entities
 
+        See find_entity_params for args
+
+        Returns:
+            Answer: Answer from query, empty Answer if None, or None if
+                properties do not match
+        """
+        params = self.find_entity_params(qtype, inst, prop_match_t, prop_match2_t)
+        if not params:
+            return
+
+        ans = self.find_entity(**params)
+        if not ans:
+            ans = Answer()
+
+        ans.params = params
+        return ans
+
+    def find_entity_params(self, qtype, inst, prop_match_t=None, prop_match2_t=None):
+        """Transforms matched context into query parameters for queries to
+        find entities
+
         Args:
             qtype (str): Matched type of query (what, who, where, etc.)
             inst (str): Matched instance of entity to match (Obama)
@@ -257,7 +223,8 @@ class NLQueryEngine(LoggingInterface):
             prop_match2_t (Tree): Matched property Tree
 
         Returns:
-            Answer: Answer from query, or empty Answer if None
+            dict: Arguments of WikiData.find_entity, or None if properties do
+                not match
         """
         props = []
         if prop_match_t:
@@ -279,16 +246,11 @@ class NLQueryEngine(LoggingInterface):
         if not inst.isupper():
             inst = singularize(inst)
 
-        ans = self.wd.find_entity(qtype, inst, props)
-        if not ans:
-            ans = Answer()
-
-        ans.params = {
+        return {
             'qtype': qtype,
             'inst': inst,
             'props': props,
         }
-        return ans
 
     def get_property(self, qtype, subject, prop):
         """Gets property of a subject
@@ -299,55 +261,243 @@ class NLQueryEngine(LoggingInterface):
             subject: Subject to get property of
             prop: Property to get of subject
 
-        Todo:
-            * Add other APIs here
+        Returns:
+            Answer: Answer from the first backend answering, or None
+        """
+        for backend in self.backends():
+            ans = backend.get_property(qtype, subject, prop)
+            if ans:
+                return ans
+        return None
+
+    def find_entity(self, qtype, inst, props, limit=None):
+        """Finds entities, see WikiData.find_entity
 
         Returns:
-            Answer: Answer from query
+            Answer: Answer from the first backend answering, or None
         """
-        return self.wd.get_property(qtype, subject, prop)
+        for backend in self.backends():
+            ans = backend.find_entity(qtype, inst, props, limit)
+            if ans:
+                return ans
+        return None
+
+    def backends(self):
+        """Gets the knowledge backends to answer from, in order"""
+        backends = [self.local] if self.local else []
+        if not self.offline:
+            backends.append(self.wd)
+        return backends
 
     def preprocess(self, sent):
-        """Preprocesses a query by adding punctuation"""
-        if sent[-1] != '?':
+        """Preprocesses a query by normalizing whitespace and adding punctuation
+
+        A blank query is preprocessed to an empty string, see _query.
+        """
+        sent = ' '.join(sent.split())
+        if sent and sent[-1] != '?':
             sent = sent + '?'
         return sent
 
-    def query(self, sent, format_='plain'):
+    def answer(self, sent, tree, limit=None):
+        """Answers a preprocessed query from its parse tree
+
+        Args:
+            sent: Preprocessed query sentence
+            tree: Parse tree of sentence
+            limit (int, optional): Maximum entities answering which/who
+                queries. Default to None (all entities)
+
+        Returns:
+            Answer: Answer from query, or empty Answer if None
+        """
+        ans = None
+        params = None
+        for name, rules, _, params_fun in self.families():
+            params = match_rules(tree, rules, params_fun)
+            if not params:
+                continue
+            if name == 'find_entity':
+                ans = self.find_entity(limit=limit, **params)
+            else:
+                ans = self.get_property(**params)
+            self.family_hits[name] += 1
+            break
+
+        if not ans:
+            ans = Answer()
+
+        if params:
+            ans.params = params
+        ans.query = sent
+        ans.tree = tree
+        return ans
+
+    def families(self):
+        """Gets the families of rules in the order to try them
+
+        The first family whose rules match and whose query function returns
+        an answer answers the query.
+
+        Returns:
+            list: (name, rules, query function, params function) tuples
+        """
+        families = [
+            ('find_entity', self.find_entity_rules,
+             self.find_entity_query, self.find_entity_params),
+            ('subject_prop', self.subject_prop_rules,
+             self.subject_query, self.subject_params),
+        ]
+        if self.adaptive:
+            families = order_by_hits(
+                families, lambda family: self.family_hits[family[0]],
+                lambda family, other: family[1].disjoint(other[1]))
+        return families
+
+    def rule_stats(self):
+        """Gets hits of the families of rules and of each rule
+
+        Returns:
+            dict: families - family name to queries answered
+                  rules - family name to stats of its rules, see
+                      CompiledRules.stats
+        """
+        return {
+            'families': dict(self.family_hits),
+            'rules': dict((name, rules.stats())
+                          for name, rules, _, _ in self.families()),
+        }
+
+    def format_answer(self, ans, format_='plain'):
+        """Formats an answer, see query
+
+        Raises:
+            ValueError: If format_ is incorrect
+        """
+        if format_ == 'raw':
+            return ans.to_dict()
+        elif format_ == 'plain':
+            return ans.to_plain()
+        elif format_ == 'json':
+            return ans.to_json()
+        else:
+            raise ValueError('Undefined format: %s' % format_)
+
+    def query(self, sent, format_='plain', limit=None):
         """Answers a query
 
         If format is plain, will return the answer as a string
         If format is raw, will return the raw context of query
+        If format is json, will return the raw context as a JSON string
 
         Args:
             sent: Query sentence
             format_: Format of answer to return (Default to plain)
+            limit (int, optional): Maximum entities answering which/who
+                queries, to get a first page quickly. Default to None (all
+                entities)
 
         Returns:
             dict: Answer context
-            str: Answer as a string
+            str: Answer as a string, or answer context as JSON
 
         Raises:
             ValueError: If format_ is incorrect
         """
+        return self._query(self.preprocess(sent), format_, limit)
+
+    def _query(self, sent, format_, limit=None):
+        """Answers a preprocessed query, traced if tracing or measuring"""
+        if not sent:
+            return self.format_answer(Answer(query=sent), format_)
+        trace = Trace() if self.trace or self.metrics else NULL_TRACE
+        measure = self.metrics.measure(trace) if self.metrics else NULL_SPAN
+        with measure, trace.activate():
+            with trace.span('parse'):
+                tree = self.parser.parse(sent)
+            self.info(tree)
+            ans = self.answer(sent, tree, limit)
+            if self.trace:
+                ans.trace = trace
+            return self.format_answer(ans, format_)
+
+    def stream(self, sent, page_size=None, limit=None):
+        """Streams the entities answering a which/who query
+
+        Args:
+            sent: Query sentence
+            page_size (int, optional): Entities per page queried from
+                WikiData, see WikiData.stream_entities
+            limit (int, optional): Maximum entities. Default to None (all
+                entities)
+
+        Returns:
+            iterator: Values of the entities, or None if the query is not a
+                which/who query or cannot be answered
+        """
         sent = self.preprocess(sent)
         tree = self.parser.parse(sent)
-        context = {'query': sent, 'tree': tree}
-        self.info(tree)
-        ans = first([
-            match_rules(tree, self.find_entity_rules, self.find_entity_query),
-            match_rules(tree, self.subject_prop_rules, self.subject_query),
-        ])
+        params = match_rules(tree, self.find_entity_rules, self.find_entity_params)
+        if not params or params['qtype'] not in ['which', 'who']:
+            return None
 
-        if not ans:
-            ans = Answer()
+        for backend in self.backends():
+            values = backend.stream_entities(
+                page_size=page_size, limit=limit, **params)
+            if values is not None:
+                return values
+        return None
 
-        ans.query = sent
-        ans.tree = str(tree)
+    def query_many(self, sents, format_='plain', concurrency=10, stream=False):
+        """Answers a batch of queries concurrently
 
-        if format_ == 'raw':
-            return ans.to_dict()
-        elif format_ == 'plain':
-            return ans.to_plain()
-        else:
+        Identical queries are answered once. Each query is parsed and
+        answered in its own greenlet, with at most concurrency queries in
+        flight, so parsing, ID resolution and SPARQL queries of different
+        queries overlap. A query that fails is logged and answered with an
+        empty Answer.
+
+        Args:
+            sents (list): Query sentences
+            format_: Format of answers to return, see query
+            concurrency (int): Maximum queries in flight (Default to 10)
+            stream (bool): If True, yield answers as they complete (Default
+                to False)
+
+        Returns:
+            list: Answers in the order of sents, if stream is False
+            generator: (index, answer) tuples in order of completion, if
+                stream is True
+
+        Raises:
+            ValueError: If format_ is incorrect
+        """
+        if format_ not in self.FORMATS:
             raise ValueError('Undefined format: %s' % format_)
+
+        # Preprocessed sentence to indexes of sents
+        indexes = OrderedDict()
+        for index, sent in enumerate(sents):
+            indexes.setdefault(self.preprocess(sent), []).append(index)
+
+        results = self._query_many(indexes, format_, concurrency)
+        if stream:
+            return results
+
+        answers = [None] * len(sents)
+        for index, ans in results:
+            answers[index] = ans
+        return answers
+
+    def _query_many(self, indexes, format_, concurrency):
+        def run(sent):
+            try:
+                return sent, self._query(sent, format_)
+            except Exception as e:
+                self.error('Failed to answer {0}: {1}', sent, e)
+                return sent, self.format_answer(Answer(query=sent), format_)
+
+        pool = Pool(concurrency)
+        for sent, ans in pool.imap_unordered(run, indexes.keys()):
+            for index in indexes[sent]:
+                yield index, ans
@@ -0,0 +1,196 @@
+"""Client side rate limiting and adaptive concurrency of endpoints
+
+An EndpointLimiter paces the requests to an endpoint with a TokenBucket,
+and bounds the requests in flight by a limit adapted to the endpoint:
+additive increase while it answers, multiplicative decrease when it
+throttles, and a pause of all requests for the Retry-After it asks for.
+
+Waits of acquire sleep with gevent, yielding to other greenlets, and state
+is guarded by a thread lock, so that a limiter is shared by greenlets and
+threads. Callers that cannot block, like Tornado coroutines, wait for their
+turn with pace and try_acquire instead.
+
+Example:
+    limiter = EndpointLimiter(rate=10, limit=5)
+    sent = limiter.acquire()
+    response = ...
+    limiter.release(sent, throttled=response.status_code == 429)
+"""
+import email.utils
+import threading
+import time
+import gevent
+
+# Seconds between checks for a turn when requests are at the limit
+POLL_INTERVAL = 0.01
+
+
+def parse_retry_after(value):
+    """Gets seconds to wait of a Retry-After header
+
+    Args:
+        value (str): Header value, seconds or an HTTP date
+
+    Returns:
+        float: Seconds to wait, or None if value is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
+class TokenBucket(object):
+    """Paces events at rate per second, with bursts of up to burst
+
+    Not thread safe, see EndpointLimiter.
+
+    Args:
+        rate (float): Tokens added per second
+        burst (float, optional): Tokens held at most. Default to rate, at
+            least 1
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.tokens = self.burst
+        self.updated = time.time()
+
+    def take(self):
+        """Takes a token, ahead of time if none is left
+
+        Returns:
+            float: Seconds to wait for the token, 0 if it was there
+        """
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class EndpointLimiter(object):
+    """Rate limit and adaptive limit of requests in flight to an endpoint
+
+    The limit grows by one per limit answered requests and is multiplied by
+    decrease when a request is throttled, once per round of requests sent
+    over the previous limit.
+
+    Args:
+        rate (float, optional): Requests per second. Default to None, no
+            rate limit
+        burst (float, optional): Requests sent at once after idling, see
+            TokenBucket
+        limit (float, optional): Requests in flight at first. Default to 10
+        min_limit (float, optional): Lowest limit. Default to 1
+        max_limit (float, optional): Highest limit. Default to 100
+        decrease (float, optional): Factor of the limit when throttled.
+            Default to 0.5
+        max_pause (float, optional): Seconds of Retry-After honoured at
+            most. Default to 60
+
+    Attributes:
+        limit (float): Current limit of requests in flight
+        in_flight (int): Requests in flight
+        throttled (int): Requests throttled so far
+    """
+
+    def __init__(self, rate=None, burst=None, limit=10, min_limit=1, max_limit=100,
+                 decrease=0.5, max_pause=60):
+        self._lock = threading.Lock()
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.max_pause = max_pause
+        self.in_flight = 0
+        self.throttled = 0
+        self.paused_until = 0
+        self.decreased_at = 0
+
+    def acquire(self):
+        """Waits for the turn of a request, which must then be released
+
+        Returns:
+            float: Time the request is sent at, see release
+        """
+        wait = self.pace()
+        if wait:
+            gevent.sleep(wait)
+        while True:
+            sent, wait = self.try_acquire()
+            if sent is not None:
+                return sent
+            gevent.sleep(wait)
+
+    def pace(self):
+        """Takes the rate limit token of a request, before try_acquire
+
+        Returns:
+            float: Seconds to wait before trying to acquire a turn
+        """
+        if not self.bucket:
+            return 0
+        with self._lock:
+            return self.bucket.take()
+
+    def try_acquire(self):
+        """Takes the turn of a request without waiting, if there is one
+
+        Returns:
+            float: Time the request is sent at, see release, or None if
+                there is no turn
+            float: Seconds to wait before trying again, if there is no turn
+        """
+        with self._lock:
+            now = time.time()
+            if now >= self.paused_until and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return now, 0
+            return None, max(self.paused_until - now, POLL_INTERVAL)
+
+    def release(self, sent, throttled=False, failed=False, retry_after=None):
+        """Ends a request, adapting the limit to how it went
+
+        Args:
+            sent (float): Time the request was sent at, see acquire
+            throttled (bool, optional): Whether the endpoint throttled the
+                request, decreasing the limit
+            failed (bool, optional): Whether the request failed otherwise,
+                keeping the limit. Requests neither throttled nor failed
+                increase it
+            retry_after (float, optional): Seconds the endpoint asked to wait
+                before the next request
+        """
+        with self._lock:
+            self.in_flight -= 1
+            now = time.time()
+            if retry_after:
+                self.paused_until = max(self.paused_until,
+                                        now + min(retry_after, self.max_pause))
+            if throttled:
+                self.throttled += 1
+                # Requests sent before the last decrease were sent over the
+                # previous limit, their throttling is already accounted for
+                if sent >= self.decreased_at:
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self.decreased_at = now
+            elif not failed:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def stats(self):
+        """Gets the limit, requests in flight and requests throttled"""
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'throttled': self.throttled,
+            }
@@ -0,0 +1,138 @@
+from collections import OrderedDict
+
+"""
+Rule for matching a subject and/or property of NP
+Matches:
+- subject            : Subject to get property of
+- prop     (optional): Propert to get of subject
+
+Examples:
+- Obama born
+- Obama
+- Obama's birthday
+- Barack Obama's wife
+"""
+SUBJ_RULES = OrderedDict([
+    # When was (Obama born)
+    ('( NP ( NP:subject-o ) ( VP:prop-o ) )', {}),
+    # What is (the birth day of Obama)
+    ('( NP ( NP:prop-o ) ( PP ( IN ) ( NP:subject-o ) ) )', {}),
+    # What is (Obama's birthday)
+    ('( NP ( NP:subject-o ( NNP ) ( POS ) ) ( NN/NNS:prop-o ) $ )', {}),
+    # What is (Obama's birth day)
+    ('( NP ( NP:subject-o ( NNP ) ( POS ) ) ( NN/JJ:prop-o ) ( NN/NNS:prop2-o ) )', {}),
+    # What is (Barrack Obama's birthday)
+    ('( NP ( NP:subject-o ( NNP ) ( NNP ) ( POS ) ) ( NN/NNS:prop-o ) $ )', {}),
+    # What is (Barack Obama's birth day)
+    ('( NP ( NP:subject-o ( NNP ) ( NNP ) ( POS ) ) ( NN/JJ:prop-o ) ( NN/NNS:prop2-o ) )', {}),
+    ('( NP:subject-o )', {}),
+])
+
+"""
+Rule for matching subject property query
+Matches:
+- qtype               : Question type (who, where, what, when)
+- subject             :  Subject to get property of
+- prop      (optional): Property to get of subject
+- prop2     (optional): Second part of property
+- prop3     (optional): Overwrite property
+- jj        (optional): Adjective that will be property (e.g. many/tall/high)
+
+Examples:
+- What religion is Obama?
+- Who did Obama marry?
+- Who is Obama?
+- Who is Barack Obama's wife?
+- How tall is Mt. Everest?
+"""
+SUBJECT_PROP_RULES = {
+    '( SBARQ ( WHNP/WHADVP/WHADJP:qtype_t ) ( SQ:sq_t ) )': {
+        'qtype_t': OrderedDict([
+            # What religion
+            ('( WHNP ( WDT:qtype-o=what ) ( NN:prop3-o ) )', {}),
+            # How many/tall
+            ('( WHADJP ( WRB:qtype-o ) ( JJ:jj-o ) )', {}),
+            # What/where/who
+            ('( WHNP/WHADVP:qtype-o )', {}),
+        ]),
+        'sq_t': {
+            # What ethnicity is Obama
+            '( SQ ( VP ( ADVP:prop-o ) ) ( VBZ ) ( VP:suject-o ) )': {},
+            # Who did Obama marry
+            '( SQ ( VBD:action-o ) ( NP:subj_t ) ( VP:prop-o ) )': {
+                'subj_t': SUBJ_RULES
+            },
+            # Who did 
+            '( SQ ( VP ( VBZ/VBD/VBP:action-o ) ( NP:subj_t ) ) )': {
+                'subj_t': SUBJ_RULES
+            },
+            # Who is Edward Thatch known as
+            '( SQ ( VBZ:action-o ) ( NP:subj_t ) ( VP:prop-o ) )': {
+                'subj_t': SUBJ_RULES,
+            },
+            # What is Obama
+            '( SQ ( VBZ/VBD/VBP:action-o ) ( NP:subj_t ) )': {
+                'subj_t': SUBJ_RULES
+            }
+        }
+    }
+}
+
+"""
+Rule for getting property of NP or VP
+Matches:
+prop : Property of instance to match
+op   : Operation to match property
+value: Value of property 
+
+Examples:
+- born in 1950
+- have population over 100,000
+"""
+PROP_RULES = OrderedDict([
+    # 
+    ('( SQ/VP ( VB/VBP/VBD ) ( VP ( VBN:prop-o ) ( PP ( IN:op-o ) ( NP:value-o ) ) ) )', {}),
+    # are in Asia
+    ('( SQ/VP ( VB/VBP/VBD=are ) ( PP ( IN:op-o ) ( NP:value-o ) ) )', {}),
+    # died from laryngitis
+    ('( SQ/VP ( VB/VBP/VBD:prop-o ) ( PP ( IN:op-o ) ( NP:value-o ) ) )', {}),
+    # have population over 1000000
+    ('( SQ/VP ( VB/VBP/VBD ) ( NP ( NP:prop-o ) ( PP ( IN:op-o ) ( NP/CD/JJ:value-o ) ) ) )', {}),
+    ('( SQ/VP ( VB/VBP/VBD ) ( NP:prop-o ) ( NP ( QP ( JJR:op-o ) ( IN ) ( CD:value-o ) ) ) )', {}),
+    ('( SQ/VP ( VB/VBP/VBD ) ( NP ( QP ( JJR:op-o ) ( IN=than ) ( NP/CD/JJ:value-o ) ) ( NNS:value_units-o ) ) )', {}),
+    ('( PP ( IN:op-o ) ( NP ( NP:value-o ) ( PP:pp_t ) ) )', {}),
+    ('( PP ( IN:op-o ) ( NP:value-o ) )', {}),
+])
+
+"""
+Rules for finding entity queries
+Matches:
+qtype                   : question type (how many, which)
+inst                    : instance of entity to match
+prop_match_t  (optional): Parse tree for first property match
+prop_match2_t (optional): Parse tree for second property match
+
+Examples:
+- How many POTUS are there?
+- Which POTUS are born in 1950?
+- How many books are written by George Orwell?
+- How many countries are in Asia and have population over 100,000?
+"""
+FIND_ENTITY_RULES = OrderedDict([
+    ('( SBARQ ( WHNP ( WHNP ( WHADJP:qtype-o ) ( NNS:inst-O ) ) ( PP:prop_match_t ) ) )', {}),
+    ('( SBARQ ( WHNP:qtype-o=who ) ( SQ:sq_t ) )', {
+        'sq_t': {
+            '( SQ ( VBD/VBZ ) ( NP ( NP:inst-O ) ( PP:prop_match_t ) ) )': {}
+        },
+    }),
+    ('( SBARQ ( WHNP ( WHADJP/WDT/WHNP:qtype-o ) ( NNS/NN/NP:inst-O ) ) ( SQ:sq_t ) )', {
+        'sq_t': OrderedDict([
+            # are there
+            ('( SQ ( VBP ) ( NP ( EX=there ) ) )', {}),
+            # are in Asia and have population over 100,000
+            ('( SQ ( VP ( VP:prop_match_t ) ( CC ) ( VP:prop_match2_t ) ) )', {}),
+            ('( SQ ( VP:prop_match_t ) )', {}),
+            ('( SQ:prop_match_t )', {}),
+        ])
+    }),
+])
@@ -0,0 +1,178 @@
+"""Per-question timing traces
+
+A trace records spans, the timings of the stages answering a question
+(parse, match, resolve, search, sparql, decode...), and counts of network
+calls and cache hits and misses. Code reports to the trace of the current
+greenlet, see current_trace. Tracing is off unless a trace is activated:
+the current trace is then NULL_TRACE, whose methods do nothing.
+
+Example:
+    trace = Trace()
+    with trace.activate():
+        with current_trace().span('parse'):
+            ...
+    trace.to_dict()
+"""
+from gevent.local import local
+import timeit
+
+timer = timeit.default_timer
+
+
+class NullSpan(object):
+    """Span that records nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class NullTrace(object):
+    """Trace that records nothing, the current trace when not tracing"""
+
+    enabled = False
+
+    def span(self, name):
+        return NULL_SPAN
+
+    def activate(self):
+        return NULL_SPAN
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class _Current(local):
+    trace = NULL_TRACE
+
+
+_current = _Current()
+
+# Traces activated in any greenlet, greenlet locals are only read if some are
+_active = [0]
+
+
+def current_trace():
+    """Gets the trace of the current greenlet, or NULL_TRACE"""
+    if not _active[0]:
+        return NULL_TRACE
+    return _current.trace
+
+
+class Span(object):
+    """Records the timing of a stage of a trace, see Trace.span"""
+
+    __slots__ = ['trace', 'name', 'record']
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.record = None
+
+    def __enter__(self):
+        trace = self.trace
+        # Spans are listed in the order they start
+        self.record = [self.name, timer() - trace.start, None, trace.depth]
+        trace.spans.append(self.record)
+        trace.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.depth -= 1
+        self.record[2] = timer() - self.trace.start - self.record[1]
+        return False
+
+
+class Trace(object):
+    """Spans and counts recorded while answering a question"""
+
+    enabled = True
+
+    def __init__(self):
+        self.start = timer()
+        self.depth = 0
+        self.spans = []
+        self.counts = {}
+
+    def span(self, name):
+        """Gets a context manager timing a stage named name"""
+        return Span(self, name)
+
+    def count(self, name, n=1):
+        """Adds n to the count named name, e.g. http.requests"""
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def activate(self):
+        """Gets a context manager making this the current trace"""
+        return _Activation(self)
+
+    def elapsed(self):
+        """Gets seconds since the trace started"""
+        return timer() - self.start
+
+    def stages(self):
+        """Gets span name to total seconds of its finished spans
+
+        Spans nested in a span of the same name, e.g. recursive rule
+        matching, are not counted.
+        """
+        stages = {}
+        open_names = []
+        for name, _, duration, depth in self.spans:
+            del open_names[depth:]
+            if duration is not None and name not in open_names:
+                stages[name] = stages.get(name, 0) + duration
+            open_names.append(name)
+        return stages
+
+    def to_dict(self):
+        """Gets the trace with times in milliseconds
+
+        Returns:
+            dict: total - milliseconds since the trace started
+                  spans - list of dicts of name, start, duration and depth
+                      of spans, in the order they started. Spans nest in
+                      the spans before them of lower depth
+                  stages - span name to total duration of its spans,
+                      except spans nested in a span of the same name
+                  counts - count name to count
+        """
+        spans = [{
+            'name': name,
+            'start': round(start * 1000, 3),
+            'duration': None if duration is None else round(duration * 1000, 3),
+            'depth': depth,
+        } for name, start, duration, depth in self.spans]
+        return {
+            'total': round(self.elapsed() * 1000, 3),
+            'spans': spans,
+            'stages': dict((name, round(duration * 1000, 3))
+                           for name, duration in self.stages().iteritems()),
+            'counts': dict(self.counts),
+        }
+
+
+class _Activation(object):
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.previous = None
+
+    def __enter__(self):
+        _active[0] += 1
+        self.previous = _current.trace
+        _current.trace = self.trace
+        return self.trace
+
+    def __exit__(self, *exc):
+        _current.trace = self.previous
+        _active[0] -= 1
+        return False
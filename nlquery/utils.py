@@ -19,6 +19,11 @@ def isfloat(value):
         return False
 
 
+def normalize_name(name):
+    """Normalizes a name for lookups, ignoring case and spacing"""
+    return ' '.join(name.lower().split())
+
+
 def first(lst):
     return next((x for x in lst if x), None)
 
@@ -55,3 +60,48 @@ def dget(d, dkey, default=None):
             else:
                 return default
     return obj
+
+
+def dgetter(dkey, default=None):
+    """Compiles a nested key into a function getting the field, see dget
+
+    The key is split once, so the getter is faster than dget for keys used
+    on many objects.
+
+    Args:
+        dkey (str): Nested key separated by periods
+        default (optional): Default object to return if value not found
+
+    Returns:
+        function: Function of a dictionary/list returning the field
+    """
+    keys = [int(key) if key.isdigit() else key for key in dkey.split('.')]
+
+    if not any(isinstance(key, int) for key in keys):
+        # Only dictionary keys, missing keys and non dictionaries raise
+        def get_keys(d):
+            try:
+                obj = d
+                for key in keys:
+                    obj = obj[key]
+                return obj
+            except (KeyError, TypeError, IndexError):
+                return default
+        return get_keys
+
+    def get(d):
+        obj = d
+        for key in keys:
+            if not obj:
+                return default
+            if isinstance(key, int):
+                if isinstance(obj, list) and key < len(obj):
+                    obj = obj[key]
+                else:
+                    return default
+            elif isinstance(obj, dict) and key in obj:
+                obj = obj[key]
+            else:
+                return default
+        return obj
+    return get
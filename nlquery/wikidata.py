@@ -1,14 +1,67 @@
 from api_adapter import RestAdapter
-from utils import dget
+from cache import LRUCache, RefreshingCache, MISSING
+from lexicon import default_lexicon
+from utils import dget, dgetter
 from dateutil import parser, relativedelta
 from datetime import datetime
 import arrow
+import re
 from dateutil.relativedelta import relativedelta
 from answer import Answer
+from collections import OrderedDict
+from tracing import current_trace
+
+
+# Wikidata timestamp, e.g. 1961-08-04T00:00:00Z or +1961-00-00T00:00:00Z for
+# year precision in dumps
+TIME_RE = re.compile(
+    r'^([+-]?)(\d{1,})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?Z$')
+
+# Marks data that is decoded when read
+UNDECODED = object()
+
+# Fields of SPARQL bindings
+_get_type = dgetter('type.value')
+_get_label = dgetter('valLabel.value')
+
+
+def parse_time(value):
+    """Parses a Wikidata timestamp into a naive datetime
+
+    Months and days of 00, of timestamps with year or month precision, are
+    read as 1. Years before 1 (BCE) and after 9999 cannot be datetimes and
+    are returned as is. Other formats are parsed by dateutil, and returned
+    as is if it cannot parse them.
+
+    Args:
+        value (str): Timestamp
+
+    Returns:
+        datetime: Time of timestamp, or value if out of range or unparseable
+    """
+    match = TIME_RE.match(value)
+    if not match:
+        try:
+            return parser.parse(value).replace(tzinfo=None)
+        except (ValueError, OverflowError):
+            return value
+
+    sign, year, month, day, hour, minute, second, fraction = match.groups()
+    year = int(year)
+    if sign == '-' or not 1 <= year <= 9999:
+        return value
+    return datetime(year, int(month) or 1, int(day) or 1, int(hour), int(minute),
+                    int(second), int(fraction.ljust(6, '0')) if fraction else 0)
 
 
 class WikiDataAnswer(Answer):
-    """Answer object from WikiData source"""
+    """Answer object from WikiData source
+
+    Data of bindings is decoded when first read, then the bindings are
+    released. The SPARQL query is the string sent, not a copy.
+    """
+
+    __slots__ = ['sparql_query', 'bindings']
 
     TIME_VALUE = 'http://wikiba.se/ontology#TimeValue'
     QUANTITY_VALUE = 'http://wikiba.se/ontology#QuantityValue'
@@ -19,10 +72,23 @@ class WikiDataAnswer(Answer):
 
         if bindings:
             self.bindings = bindings
-            self.data = self.get_data(bindings)
+            self._data = UNDECODED
         else:
+            self.bindings = None
             self.data = data
 
+    @property
+    def data(self):
+        if self._data is UNDECODED:
+            with current_trace().span('decode'):
+                self._data = self.get_data(self.bindings)
+            self.bindings = None
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+
     def to_dict(self):
         d = super(WikiDataAnswer, self).to_dict()
         d['sparql_query'] = self.sparql_query
@@ -30,31 +96,110 @@ class WikiDataAnswer(Answer):
 
     @staticmethod
     def get_data(bindings):
-        """Gets values from the list of results"""
-        return [WikiDataAnswer.get_value(b) for b in bindings]
+        """Gets values from the list of results in one pass"""
+        get_type = _get_type
+        get_label = _get_label
+        time_value = WikiDataAnswer.TIME_VALUE
+        quantity_value = WikiDataAnswer.QUANTITY_VALUE
+
+        values = []
+        append = values.append
+        for data in bindings:
+            data_type = get_type(data)
+            value = get_label(data)
+            if data_type is None:
+                append(value)
+            elif data_type == time_value:
+                append(parse_time(value))
+            elif data_type == quantity_value and value.isdigit():
+                append(float(value))
+            else:
+                append(value)
+        return values
 
     @staticmethod
     def get_value(data):
         """Gets Python type value from WikiData response field"""
-        data_type = dget(data, 'type.value')
-        value = dget(data, 'valLabel.value')
-
-        if data_type == WikiDataAnswer.TIME_VALUE:
-            dt = parser.parse(value)
-            dt = dt.replace(tzinfo=None)
-            return dt
-        elif data_type == WikiDataAnswer.QUANTITY_VALUE:
-            if value.isdigit():
-                return float(value)
-            return value
-        else:
-            return value
+        return WikiDataAnswer.get_data([data])[0]
 
 
 class WikiData(RestAdapter):
     """REST Adapter for WikiData API endpoint"""
     WIKIDATA_URL = 'https://www.wikidata.org/w/api.php'
     WDSPARQL_URL = 'https://query.wikidata.org/sparql'
+    LANGUAGE = 'en'
+
+    # Properties answered by the aliases of the subject
+    ALIAS_PROPS = ['nickname', 'known as', 'alias', 'called']
+
+    # Seconds to remember names that resolve, and names that do not resolve
+    ID_TTL = 7 * 24 * 60 * 60
+    NEGATIVE_ID_TTL = 60 * 60
+
+    # Seconds to cache SPARQL results by shape of query, first match wins
+    SPARQL_TTLS = [
+        ('count(*)', 24 * 60 * 60), # Counting entities
+        ('wdt:P31', 6 * 60 * 60), # Finding entities
+    ]
+    # Seconds to cache other SPARQL results (properties, aliases)
+    SPARQL_TTL = 60 * 60
+    # Seconds to serve expired SPARQL results while they are refreshed
+    SPARQL_STALE_TTL = 24 * 60 * 60
+    # Maximum (subject, property) pairs per batched SPARQL query
+    SPARQL_BATCH_SIZE = 50
+    # Entities per page when streaming entities
+    PAGE_SIZE = 1000
+    # Limits of requests to WDQS, which answers 5 queries in parallel per
+    # client, see RestAdapter.endpoint_limits
+    WDSPARQL_LIMITS = {'limit': 5, 'max_limit': 5}
+
+    def __init__(self, id_cache=None, sparql_cache=None, search_index=None, lexicon=None,
+                 answer_cache=None, **kwargs):
+        """
+        Args:
+            id_cache (optional): Cache of (name, type, language) to WikiData
+                ID. Default to an in-process LRUCache
+            sparql_cache (optional): Cache of SPARQL query to result. Default
+                to an in-process LRUCache
+            search_index (TripleStore, optional): Local index to search
+                entities in before the wbsearchentities API. Default to None
+            lexicon (PropertyLexicon, optional): Lexicon to resolve property
+                names with before searching for them. Default to the bundled
+                lexicon
+            answer_cache (optional): Cache of resolved intent to answer data,
+                see _cached_answer. Default to an in-process LRUCache
+            kwargs: Connection pool, retry and limit settings, see RestAdapter
+        """
+        RestAdapter.__init__(self, **kwargs)
+        self.search_index = search_index
+        self.lexicon = lexicon or default_lexicon()
+        if id_cache is None:
+            id_cache = LRUCache(maxsize=10000, ttl=self.ID_TTL)
+        if sparql_cache is None:
+            sparql_cache = LRUCache(maxsize=1000)
+        self.id_cache = id_cache
+        self.sparql_cache = RefreshingCache(sparql_cache, self.SPARQL_STALE_TTL)
+        if answer_cache is None:
+            answer_cache = LRUCache(maxsize=10000)
+        self.answer_cache = answer_cache
+
+    def endpoint_limits(self, endpoint):
+        if endpoint == self.WDSPARQL_URL:
+            return dict(self.limits, **self.WDSPARQL_LIMITS)
+        return self.limits
+
+    @staticmethod
+    def _canonical_sparql(query):
+        """Strips comments and whitespace from SPARQL query for cache keys"""
+        query = re.sub(r'#[^\n]*', '', query)
+        return ' '.join(query.split())
+
+    def _sparql_ttl(self, query):
+        """Returns seconds to cache result of SPARQL query for"""
+        for pattern, ttl in self.SPARQL_TTLS:
+            if pattern in query:
+                return ttl
+        return self.SPARQL_TTL
 
     def _query_wdsparql(self, query):
         params = {
@@ -62,52 +207,231 @@ class WikiData(RestAdapter):
             'query': query
         }
         self.debug(query)
-        return self.get(self.WDSPARQL_URL, params=params)
+        trace = current_trace()
+        fetched = []
+
+        def fetch(fetch_trace):
+            # Background refreshes of stale results fetch with NULL_TRACE
+            if fetch_trace is trace:
+                fetched.append(True)
+            with fetch_trace.span('wdqs'):
+                return self.get(self.WDSPARQL_URL, params=params)
+
+        with trace.span('sparql'):
+            data = self.sparql_cache.get(
+                self._canonical_sparql(query), fetch, self._sparql_ttl(query))
+        trace.count('sparql_cache.misses' if fetched else 'sparql_cache.hits')
+        return data
 
     def _query_wikidata(self, params):
         return self.get(self.WIKIDATA_URL, params=params)
 
-    def _search_entity(self, name, _type='item'):
-        """Search for an entity from string"""
-        if _type not in ['item', 'property']:
-            return None
-
-        params = {
+    def _search_params(self, name, _type):
+        return {
             'action': 'wbsearchentities',
             'format': 'json',
             'search': name,
-            'language': 'en',
+            'language': self.LANGUAGE,
             'type': _type,
         }
 
-        data = self._query_wikidata(params)
+    def _search_entity(self, name, _type='item'):
+        """Search for an entity from string"""
+        if _type not in ['item', 'property']:
+            return None
+
+        data = self._index_search(name, _type)
+        if data is None:
+            with current_trace().span('search'):
+                data = self._query_wikidata(self._search_params(name, _type))
+        return data
+
+    def _search_entities(self, lookups):
+        """Search for several entities from (name, type) tuples concurrently"""
+        items, misses = self._index_searches(lookups)
+        calls = [(self.WIKIDATA_URL, self._search_params(*lookups[i]))
+                 for i in misses]
+        if not calls:
+            return items
+        with current_trace().span('search'):
+            fetched = self.get_many(calls)
+        for i, item in zip(misses, fetched):
+            items[i] = item
+        return items
+
+    def _index_search(self, name, _type):
+        """Search for an entity in the local search index
+
+        Returns:
+            dict: Result in the format of wbsearchentities, or None if there
+                is no index or nothing matches
+        """
+        if self.search_index is None:
+            return None
+        data = self.search_index.search_result(name, _type)
+        current_trace().count('search_index.misses' if data is None else 'search_index.hits')
         return data
 
+    def _index_searches(self, lookups):
+        """Search for (name, type) tuples in the local search index
+
+        Returns:
+            list: Results of _index_search, in the order of lookups
+            list: Indexes of lookups to search for with the API
+        """
+        items = [self._index_search(name, _type) for name, _type in lookups]
+        misses = [i for i, item in enumerate(items) if item is None]
+        return items, misses
+
 
     def _get_desc(self, subject):
         """Get WikiData description of subject"""
         data = self._search_entity(subject)
+        return self._desc_answer(data)
+
+
+    def _desc_answer(self, data):
+        """Builds answer from the description of the first search result"""
         desc = dget(data, 'search.0.description')
         return Answer(data=desc)
 
 
     def _get_id(self, name, _type='item'):
         """Get WikiData ID of a name"""
-        item = self._search_entity(name, _type)
-        return dget(item, 'search.0.id')
+        return self._get_ids([(name, _type)])[(name, _type)]
+
+
+    def _get_ids(self, lookups):
+        """Get WikiData IDs of (name, type) tuples
+
+        Names that are not cached are searched for concurrently.
+
+        Args:
+            lookups (list): List of (name, type) tuples, type is one of
+                'item' or 'property'
+
+        Returns:
+            dict: (name, type) to WikiData ID, or None if not found
+        """
+        with current_trace().span('resolve'):
+            ids, misses = self._cached_ids(lookups)
+            if misses:
+                self._store_ids(ids, misses, self._search_entities(misses))
+        return ids
+
+
+    def _cached_ids(self, lookups):
+        """Get cached WikiData IDs of (name, type) tuples
+
+        Returns:
+            dict: (name, type) to cached WikiData ID, or None if not cached
+            list: (name, type) tuples that are not cached
+        """
+        ids = {}
+        misses = []
+        trace = current_trace()
+        for name, _type in lookups:
+            if (name, _type) in ids:
+                continue
+            entity_id = self.id_cache.get((name, _type, self.LANGUAGE))
+            trace.count('id_cache.misses' if entity_id is MISSING else 'id_cache.hits')
+            if entity_id is MISSING:
+                ids[(name, _type)] = None
+                if _type in ['item', 'property']:
+                    misses.append((name, _type))
+            else:
+                ids[(name, _type)] = entity_id
+        return ids, misses
+
+
+    def _store_ids(self, ids, misses, items):
+        """Stores WikiData IDs from search results of misses in ids and cache"""
+        for lookup, item in zip(misses, items):
+            if item is None:
+                # Request failed, do not remember the failure
+                continue
+            entity_id = dget(item, 'search.0.id')
+            key = lookup + (self.LANGUAGE,)
+            if entity_id:
+                self.id_cache.set(key, entity_id, self.ID_TTL)
+            else:
+                self.id_cache.set(key, None, self.NEGATIVE_ID_TTL)
+            ids[lookup] = entity_id
+
+
+    def _cached_answer(self, intent):
+        """Gets the cached answer of a resolved intent
+
+        Questions resolving to the same intent, e.g. paraphrases, share the
+        answer of the first of them, without querying WDQS or decoding.
+
+        Args:
+            intent (tuple): Kind of query and the WikiData IDs, operators
+                and values it is built from
+
+        Returns:
+            WikiDataAnswer: Answer with a copy of the cached bindings, decoded
+                when read, or of the cached data, or None if not cached
+        """
+        entry = self.answer_cache.get(intent)
+        current_trace().count('answer_cache.misses' if entry is MISSING else 'answer_cache.hits')
+        if entry is MISSING:
+            return None
+        query, bindings, data = entry
+        if bindings is not None:
+            return WikiDataAnswer(sparql_query=query, bindings=list(bindings))
+        return WikiDataAnswer(sparql_query=query,
+                              data=list(data) if isinstance(data, list) else data)
+
+
+    def _store_answer(self, intent, ans, result):
+        """Caches a copy of the answer of an intent, unless its query failed
+
+        Bindings not decoded yet are cached as is, so that the answer is
+        still decoded only if read, and the caller keeps its own list.
+        """
+        if ans is None or result is None:
+            return
+        if ans.bindings is not None:
+            entry = (ans.sparql_query, list(ans.bindings), None)
+        else:
+            data = ans.data
+            entry = (ans.sparql_query, None, list(data) if isinstance(data, list) else data)
+        self.answer_cache.set(intent, entry, self._sparql_ttl(ans.sparql_query))
 
 
     def _get_property(self, subject, prop, prop_id=None):
         """Queries Wikidata to get property"""
         self.debug('{0}, {1}', subject, prop)
-        subject_id = self._get_id(subject, 'item')
+        lookups = [(subject, 'item')]
+        if not prop_id:
+            lookups.append((prop, 'property'))
+        ids = self._get_ids(lookups)
 
+        subject_id = ids[(subject, 'item')]
         if not prop_id:
-            prop_id = self._get_id(prop, 'property')
+            prop_id = ids[(prop, 'property')]
 
         if not prop_id or not subject_id:
             return None
 
+        intent = ('property', subject_id, prop_id)
+        ans = self._cached_answer(intent)
+        if ans is None:
+            query = self._property_query(subject_id, prop_id)
+            result = self._query_wdsparql(query)
+            ans = self._bindings_answer(query, result)
+            self._store_answer(intent, ans, result)
+        return ans
+
+
+    def _property_query(self, subject_id, prop_id):
+        """Builds SPARQL query for property of subject
+
+        Args:
+            subject_id (str): WikiData ID of subject
+            prop_id (str): Comma separated WikiData IDs of properties
+        """
         query = """
         SELECT ?valLabel ?type
         WHERE {
@@ -128,8 +452,94 @@ class WikiData(RestAdapter):
             SERVICE wikibase:label { bd:serviceParam wikibase:language "en"} 
         }
         """
+        return query
+
 
-        result =  self._query_wdsparql(query)
+    def get_properties(self, pairs, batch_size=None):
+        """Gets properties of many subjects with batched SPARQL queries
+
+        Pairs are merged into VALUES driven queries of at most batch_size
+        pairs, sent concurrently. Batched results are not cached.
+
+        Args:
+            pairs (list): (subject_id, prop_id) tuples of WikiData IDs,
+                prop_id may be comma separated IDs
+            batch_size (int, optional): Maximum pairs per query. Default to
+                SPARQL_BATCH_SIZE
+
+        Returns:
+            list: WikiDataAnswer of each pair, or None if its query failed
+        """
+        batches = self._property_batches(pairs, batch_size)
+        queries = [self._properties_query(batch) for batch in batches]
+        trace = current_trace()
+        with trace.span('sparql'), trace.span('wdqs'):
+            results = self.get_many([(self.WDSPARQL_URL, {'format': 'json', 'query': query})
+                                     for query in queries])
+        return self._properties_answers(pairs, batches, queries, results)
+
+
+    def _property_batches(self, pairs, batch_size=None):
+        """Splits unique (subject_id, prop_id) pairs into batches"""
+        batch_size = batch_size or self.SPARQL_BATCH_SIZE
+        unique = OrderedDict.fromkeys(pairs).keys()
+        return [unique[i:i + batch_size] for i in xrange(0, len(unique), batch_size)]
+
+
+    def _properties_query(self, pairs):
+        """Builds SPARQL query for properties of subjects, see _property_query
+
+        Args:
+            pairs (list): (subject_id, prop_id) tuples
+        """
+        values = '\n'.join(
+            '(wd:%s p:%s ps:%s psv:%s)' % (subject_id, pid, pid, pid)
+            for subject_id, prop_id in pairs for pid in prop_id.split(','))
+        return """
+        SELECT ?subject ?p ?valLabel ?type
+        WHERE {
+            VALUES (?subject ?p ?ps ?psv) {
+                %s
+            }
+            ?subject ?p ?prop .
+            ?prop ?ps ?val .
+            OPTIONAL {
+                ?prop ?psv ?propVal .
+                ?propVal rdf:type ?type .
+            }
+            SERVICE wikibase:label { bd:serviceParam wikibase:language "en"}
+        }
+        """ % values
+
+
+    def _properties_answers(self, pairs, batches, queries, results):
+        """Splits results of batched queries into answers of each pair"""
+        # (subject_id, pid) to (query, bindings), None if the query failed
+        found = {}
+        for batch, query, result in zip(batches, queries, results):
+            bindings = dget(result, 'results.bindings') if result is not None else None
+            for subject_id, prop_id in batch:
+                for pid in prop_id.split(','):
+                    found[(subject_id, pid)] = (query, None if bindings is None else [])
+            for binding in bindings or []:
+                subject_id = dget(binding, 'subject.value', '').rsplit('/', 1)[-1]
+                pid = dget(binding, 'p.value', '').rsplit('/', 1)[-1]
+                if (subject_id, pid) in found:
+                    found[(subject_id, pid)][1].append(binding)
+
+        answers = []
+        for subject_id, prop_id in pairs:
+            parts = [found[(subject_id, pid)] for pid in prop_id.split(',')]
+            if any(bindings is None for _, bindings in parts):
+                answers.append(None)
+                continue
+            bindings = [binding for _, pid_bindings in parts for binding in pid_bindings]
+            answers.append(WikiDataAnswer(sparql_query=parts[0][0], bindings=bindings))
+        return answers
+
+
+    def _bindings_answer(self, query, result):
+        """Builds answer from the bindings of a SPARQL result"""
         bindings = dget(result, 'results.bindings')
         return WikiDataAnswer(sparql_query=query, bindings=bindings)
 
@@ -138,7 +548,19 @@ class WikiData(RestAdapter):
         """Get all aliases of an entity"""
         self.debug('Get alias {0}'.format(subject))
         subject_id = self._get_id(subject, 'item')
-        query = """
+        intent = ('aliases', subject_id)
+        ans = self._cached_answer(intent)
+        if ans is None:
+            query = self._aliases_query(subject_id)
+            result = self._query_wdsparql(query)
+            ans = self._bindings_answer(query, result)
+            self._store_answer(intent, ans, result)
+        return ans
+
+
+    def _aliases_query(self, subject_id):
+        """Builds SPARQL query for aliases of subject"""
+        return """
         SELECT ?valLabel
         WHERE {
             { wd:%s skos:altLabel ?val FILTER (LANG (?val) = "en") }
@@ -147,15 +569,97 @@ class WikiData(RestAdapter):
             SERVICE wikibase:label { bd:serviceParam wikibase:language "en"} 
         }""" % (subject_id, subject_id)
 
-        result =  self._query_wdsparql(query)
-        bindings = dget(result, 'results.bindings')
-        return WikiDataAnswer(sparql_query=query, bindings=bindings)
+    def _find_entity_lookups(self, inst, params):
+        """Plans the (name, type) lookups needed to find entities, so that
+        they can be resolved concurrently before building the query
 
-    def _find_entity(self, qtype, inst, params):
+        Must mirror the lookups made in _find_entity
+        """
+        lookups = [(inst, 'item')]
+        for prop, prop_val, op in params:
+            if op in ['>', '<']:
+                if not self._property_id(op, prop):
+                    lookups.append((prop, 'property'))
+            elif op in ['in', 'by', 'of', 'from']:
+                if op == 'in' and prop_val.isdigit():
+                    continue
+                lookups.append((prop_val, 'item'))
+                if op == 'of' and prop_val:
+                    continue
+                if prop and not self._property_id(op, prop):
+                    lookups.append((prop, 'property'))
+        return lookups
+
+    def _find_entity(self, qtype, inst, params, limit=None):
         """Count number of things instance/subclass of inst with props"""
         self.info('Get instances of {0} that are {1}'.format(inst, params))
 
-        inst_id = self._get_id(inst)
+        ids = self._get_ids(self._find_entity_lookups(inst, params))
+        intent = self._find_entity_intent(qtype, inst, params, ids, limit)
+        ans = self._cached_answer(intent)
+        if ans is not None:
+            return ans
+        query = self._find_entity_query(qtype, inst, params, ids, limit)
+        if not query:
+            return None
+
+        try:
+            data = self._query_wdsparql(query)
+        except ValueError:
+            self.error('Error parsing data')
+            return WikiDataAnswer(sparql_query=query)
+
+        ans = self._find_entity_answer(qtype, query, data)
+        self._store_answer(intent, ans, data)
+        return ans
+
+    def _find_entity_intent(self, qtype, inst, params, ids, limit=None):
+        """Gets the resolved intent of finding entities, see _cached_answer
+
+        Must mirror _find_entity_query: queries of the same intent find the
+        same entities. Property matches, which must all hold, are sorted.
+
+        Args:
+            ids (dict): (name, type) to WikiData ID of _find_entity_lookups
+
+        Returns:
+            tuple: (kind of query, instance ID, property matches, limit)
+        """
+        matches = []
+        for prop, prop_val, op in params:
+            if op in ['>', '<']:
+                prop_id = self._property_id(op, prop) or ids[(prop, 'property')]
+                matches.append((op, prop_id, prop_val))
+            elif op in ['in', 'by', 'of', 'from']:
+                if op == 'in' and prop_val.isdigit():
+                    matches.append(('held in', prop_val))
+                elif op == 'of' and prop_val:
+                    matches.append(('employer', ids[(prop_val, 'item')]))
+                else:
+                    prop_id = (self._property_id(op, prop) or ids[(prop, 'property')]) \
+                        if prop else '*'
+                    matches.append(('=', prop_id, ids[(prop_val, 'item')]))
+
+        if qtype == 'how many':
+            kind, limit = 'count', None
+        elif qtype in ['which', 'who']:
+            kind = 'values'
+        else:
+            kind = qtype
+        return (kind, ids[(inst, 'item')], tuple(sorted(matches)), limit)
+
+    def _find_entity_query(self, qtype, inst, params, ids, limit=None):
+        """Builds SPARQL query to find entities, see _find_entity
+
+        Args:
+            ids (dict): (name, type) to WikiData ID of _find_entity_lookups
+            limit (int, optional): Maximum entities of which/who queries.
+                Default to None (all entities)
+
+        Returns:
+            str: SPARQL query, or None if it cannot be built
+        """
+        inst_id = ids[(inst, 'item')]
 
         if not inst_id:
             self.info('Cannot find id of: {0}'.format(inst))
@@ -183,15 +687,19 @@ class WikiData(RestAdapter):
 
         for prop, prop_val, op in params:
             if op in ['>', '<']:
-                prop_id = self._get_id(prop, 'property')
+                prop_id = self._property_id(op, prop) or ids[(prop, 'property')]
+                if not prop_id:
+                    self.info('Cannot find id of: {0}'.format(prop))
+                    return None
                 self.info('Count number of {0} where {1} {2} {3}'.format(
                     inst, prop_id, op, prop_val))
                 query += """
-                        ?val wdt:%s ?value FILTER(?value %s %s) . # Filter by value
-                        """ % (prop_id, op, prop_val)
+                        ?val %s ?value FILTER(?value %s %s) . # Filter by value
+                        """ % (self._direct_path(prop_id), op, prop_val)
             elif op in ['in', 'by', 'of', 'from']:
                 if op == 'in' and prop_val.isdigit():
-                    iso_time = parser.parse(prop_val).isoformat()
+                    # Start of the year, not today's date in that year
+                    iso_time = parser.parse(prop_val, default=datetime(1, 1, 1)).isoformat()
 
                     query += """
                     ?pos pq:P580 ?startDate . # pos.startDate
@@ -199,24 +707,22 @@ class WikiData(RestAdapter):
                     FILTER (?startDate < "%s"^^xsd:dateTime && ?endDate > "%s"^^xsd:dateTime)
                     """ % (iso_time, iso_time)
                 elif op == 'of' and prop_val:
-                    prop_val_id = self._get_id(prop_val)
+                    prop_val_id = ids[(prop_val, 'item')]
 
                     query += """
                     ?pos pq:P108 wd:%s . # pos.employer
                     """ % (prop_val_id)
                 else:
                     # Get value entity
-                    prop_val_id = self._get_id(prop_val)
+                    prop_val_id = ids[(prop_val, 'item')]
 
                     if prop:
-                        # Get property id
-                        if prop in ['died', 'killed'] and op in ['from', 'by', 'of']:
-                            # slight hack because lookup for died defaults to place of death
-                            # cause of death
-                            prop_id = 'P509'
-                        else:
-                            prop_id = self._get_id(prop, 'property')
-                        query += '?val wdt:%s wd:%s .\n' % (prop_id, prop_val_id)
+                        # Get property id, e.g. died from is cause of death
+                        prop_id = self._property_id(op, prop) or ids[(prop, 'property')]
+                        if not prop_id:
+                            self.info('Cannot find id of: {0}'.format(prop))
+                            return None
+                        query += '?val %s wd:%s .\n' % (self._direct_path(prop_id), prop_val_id)
                     else:
                         # Infer property from value (e.g. How many countries are in China?)
                         # e.g. infer: How many countries with continent China?
@@ -231,17 +737,26 @@ class WikiData(RestAdapter):
                         inst, prop_id, prop_val_id))
 
         query += 'SERVICE wikibase:label { bd:serviceParam wikibase:language "en"} }'
+        if limit and qtype in ['which', 'who']:
+            query += '\nLIMIT %d' % limit
+        return query
+
+    @staticmethod
+    def _page_query(query, size, offset):
+        """Builds SPARQL query of a page of the results of a query"""
+        return '%s\nORDER BY ?val\nLIMIT %d\nOFFSET %d' % (query, size, offset)
 
+    @staticmethod
+    def _direct_path(prop_id):
+        """Builds SPARQL path of direct claims of comma separated property IDs"""
+        return '|'.join('wdt:%s' % pid for pid in prop_id.split(','))
+
+    def _find_entity_answer(self, qtype, query, data):
+        """Builds answer from the SPARQL result of finding entities"""
         result = {
             'sparql_query': query,
         }
 
-        try:
-            data = self._query_wdsparql(query)
-        except ValueError:
-            self.error('Error parsing data')
-            return WikiDataAnswer(**result)
-
         if qtype == 'how many':
             result['data'] = dget(data, 'results.bindings.0.count.value')
         elif qtype in ['which', 'who']:
@@ -262,37 +777,42 @@ class WikiData(RestAdapter):
             WikiDataAnswer: Answer from result
         """
 
-        prop_id = None
-
         if prop is None:
             return self._get_desc(subject)
 
         if prop == 'age':
             bday_ans = self._get_property(subject, 'date of birth', 'P569')
-            if not bday_ans:
-                return None
-            import pdb;pdb.set_trace()
-            birthday = bday_ans.data[0]
-            years = relativedelta(datetime.now(), birthday).years
-            bday_ans.data = years
-            return bday_ans
-
-        if prop == 'born':
-            if qtype == 'where':
-                prop_id = 'P19'
-            elif qtype == 'when':
-                prop_id = 'P569'
-
-        if prop == 'height':
-            prop_id = 'P2044,P2048'
-
-        if prop in ['nickname', 'known as', 'alias', 'called']:
+            return self._age_answer(bday_ans)
+
+        if prop in self.ALIAS_PROPS:
             return self._get_aliases(subject)
 
+        prop_id = self._property_id(qtype, prop)
         return self._get_property(subject, prop, prop_id=prop_id)
 
+    def _property_id(self, context, prop):
+        """Gets WikiData ID of property from the lexicon, or None to search for it
+
+        Args:
+            context (str): Type of question, or operator of a property match
+            prop (str): Property name
+        """
+        return self.lexicon.get(prop, context)
+
+    def _age_answer(self, bday_ans):
+        """Converts answer of date of birth to answer of age in years, or None
+        if no date of birth was found or it is not a datetime, e.g. BCE"""
+        if not bday_ans or not bday_ans.data:
+            return None
+        birthday = bday_ans.data[0]
+        if not isinstance(birthday, datetime):
+            return None
+        years = relativedelta(datetime.now(), birthday).years
+        bday_ans.data = years
+        return bday_ans
+
 
-    def find_entity(self, qtype, inst, props):
+    def find_entity(self, qtype, inst, props, limit=None):
         """Count number of things instance/subclass of inst with prop = prop_val
 
         Args:
@@ -304,17 +824,71 @@ class WikiData(RestAdapter):
                 value - value that property should be
                 op - One of  '=', '<' or '>'
                 If property is None, then property will be inferred by instance of value
+            limit (int, optional): Maximum entities of which/who queries, in
+                no particular order. Default to None (all entities)
 
         Returns:
             WikiDataAnswer: Answer from result
         """
+        inst = self._qualify_inst(inst, props)
+        ans = self._find_entity(qtype, inst, props, limit)
+
+        return ans
+
+    def stream_entities(self, qtype, inst, props, page_size=None, limit=None):
+        """Streams entities of a which/who query, see find_entity
+
+        Pages of entities, ordered by ID, are queried with LIMIT and OFFSET
+        as the previous page is consumed, and their values are converted one
+        at a time.
+
+        Args:
+            page_size (int, optional): Entities per page. Default to PAGE_SIZE
+            limit (int, optional): Maximum entities. Default to None (all
+                entities)
+
+        Returns:
+            generator: Values of the entities, or None if they cannot be
+                queried
+
+        Raises:
+            ValueError: If qtype is not which or who
+        """
+        if qtype not in ['which', 'who']:
+            raise ValueError('Cannot stream {0} queries'.format(qtype))
+        inst = self._qualify_inst(inst, props)
+        ids = self._get_ids(self._find_entity_lookups(inst, props))
+        query = self._find_entity_query(qtype, inst, props, ids)
+        if not query:
+            return None
+        return self._stream_pages(query, page_size or self.PAGE_SIZE, limit)
+
+    def _stream_pages(self, query, page_size, limit=None):
+        """Yields values of the bindings of a query, page by page"""
+        offset = 0
+        while limit is None or offset < limit:
+            size = page_size if limit is None else min(page_size, limit - offset)
+            data = self._query_wdsparql(self._page_query(query, size, offset))
+            if data is None:
+                self.warn('Stopped streaming at offset {0}', offset)
+                return
+            bindings = dget(data, 'results.bindings') or []
+            for binding in bindings:
+                yield WikiDataAnswer.get_value(binding)
+            if len(bindings) < size:
+                return
+            offset += size
+
+    def _qualify_inst(self, inst, props):
+        """Moves the 'of' property of a position into the instance, e.g.
+        president with (None, United States, of) is president of United States
+
+        Pops the moved property from props.
+        """
         if inst.lower() in ['the president', 'president', 'the prime minister', 'prime minister']:
             for index, tup in enumerate(props):
                 prop, prop_val, op = tup
                 if op == 'of':
                     inst = '{0} {1} {2}'.format(inst, op, prop_val)
                     props.pop(index)
-
-        ans = self._find_entity(qtype, inst, props)
-
-        return ans
+        return inst
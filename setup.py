@@ -12,6 +12,7 @@ setup(
     name='nlquery',
     version='0.11',
     packages=find_packages(exclude=["tests", "tests.*", "nlquery-app"]),
+    package_data={'nlquery': ['data/*.json']},
     test_suite='tests',
     url='http://github.com/ayoungprogrammer/nlquery',
     cmdclass={
@@ -22,5 +23,13 @@ setup(
         'pattern',
         'arrow',
         'grequests',
+        'gevent',
+        'greenlet',
+        'requests',
+        'nltk',
+        'python-dateutil',
     ],
+    extras_require={
+        'async': ['tornado<6'],
+    },
 )
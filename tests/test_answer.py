@@ -0,0 +1,36 @@
+from nlquery.answer import Answer
+from nlquery.wikidata import WikiDataAnswer
+from nltk.tree import Tree
+import json
+import unittest
+
+
+class AnswerTest(unittest.TestCase):
+
+    def test_slots(self):
+        ans = WikiDataAnswer('SELECT ?val', data='3')
+        assert not hasattr(ans, '__dict__')
+        with self.assertRaises(AttributeError):
+            ans.extra = 1
+
+    def test_lazy_tree(self):
+        tree = Tree('SBARQ', [Tree('WHNP', ['who'])])
+        ans = Answer(query='who')
+        ans.tree = tree
+        assert ans._tree is tree
+        assert ans.tree == str(tree)
+        assert ans._tree == str(tree)
+        assert Answer().tree is None
+
+    def test_bindings_released(self):
+        ans = WikiDataAnswer('SELECT ?val', bindings=[{'valLabel': {'value': 'Honolulu'}}])
+        assert ans.data == ['Honolulu']
+        assert ans.bindings is None
+
+    def test_to_json(self):
+        ans = WikiDataAnswer('SELECT ?val', data=['Honolulu', 'Chicago'])
+        ans.query = 'where'
+        ans.params = {'subject': 'obama'}
+        ans.tree = Tree('SBARQ', [])
+        assert json.loads(ans.to_json()) == ans.to_dict()
+        assert ' ' not in Answer(data='x').to_json()
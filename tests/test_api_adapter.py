@@ -0,0 +1,126 @@
+from nlquery.api_adapter import RestAdapter
+from gevent.pywsgi import WSGIServer
+import gevent
+import json
+import threading
+import time
+import unittest
+
+
+class RestAdapterTest(unittest.TestCase):
+
+    def setUp(self):
+        super(RestAdapterTest, self).setUp()
+        self.statuses = []
+        self.queries = []
+        self.delay = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.server = WSGIServer(('127.0.0.1', 0), self.app, log=None)
+        self.server.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+        self.adapter = RestAdapter(pool_size=2, timeout=5, backoff_factor=0)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def app(self, env, start_response):
+        self.queries.append(env['QUERY_STRING'])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if self.delay:
+            gevent.sleep(self.delay)
+        self.in_flight -= 1
+        status = self.statuses.pop(0) if self.statuses else '200 OK'
+        headers = []
+        if isinstance(status, tuple):
+            status, headers = status[0], [('Retry-After', status[1])]
+        body = json.dumps({'query': env['QUERY_STRING']})
+        start_response(status, [('Content-Type', 'application/json'),
+                                ('Content-Length', str(len(body)))] + headers)
+        return [body]
+
+    def test_get(self):
+        assert self.adapter.get(self.url, {'a': 1}) == {'query': 'a=1'}
+
+    def test_get_many(self):
+        resps = self.adapter.get_many([(self.url, {'a': i}) for i in xrange(3)])
+        assert resps == [{'query': 'a=%d' % i} for i in xrange(3)]
+
+    def test_retries(self):
+        self.statuses = ['503 Service Unavailable', '429 Too Many Requests']
+        assert self.adapter.get(self.url, {'a': 1}) == {'query': 'a=1'}
+
+    def test_retries_exhausted(self):
+        self.statuses = ['500 Internal Server Error'] * 2
+        adapter = RestAdapter(timeout=5, retries=1, backoff_factor=0)
+        assert adapter.get(self.url) is None
+        assert len(self.queries) == 2
+
+    def test_throttled(self):
+        self.statuses = [('429 Too Many Requests', '0.05')]
+        start = time.time()
+        assert self.adapter.get(self.url, {'a': 1}) == {'query': 'a=1'}
+        assert time.time() - start >= 0.04
+        stats = self.adapter.limiter_stats()[self.url]
+        assert stats['throttled'] == 1
+        assert stats['limit'] < 10
+
+    def test_limits(self):
+        self.delay = 0.02
+        adapter = RestAdapter(timeout=5, limits={'limit': 2, 'max_limit': 2})
+        resps = adapter.get_many([(self.url, {'a': i}) for i in xrange(6)])
+        assert resps == [{'query': 'a=%d' % i} for i in xrange(6)]
+        assert self.max_in_flight == 2
+
+    def test_pool_stats(self):
+        self.adapter.get(self.url)
+        self.adapter.get(self.url)
+        stats = self.adapter.pool_stats()
+        host = 'http://127.0.0.1:%d' % self.server.server_port
+        assert stats[host] == {'connections': 1, 'requests': 2, 'idle': 1}
+
+    def test_coalesce_greenlets(self):
+        self.delay = 0.05
+        params = [{'a': 1, 'b': 2}, {'b': 2, 'a': 1}, {'a': 1, 'b': 2}, {'a': 2}]
+        greenlets = [gevent.spawn(self.adapter.get, self.url, p) for p in params]
+        gevent.joinall(greenlets)
+        resps = [greenlet.value for greenlet in greenlets]
+        assert resps[0] is resps[1] is resps[2]
+        assert resps[3] == {'query': 'a=2'}
+        assert len(self.queries) == 2
+        assert self.adapter.coalesced() == 2
+
+        # Answered requests are sent again
+        self.adapter.get(self.url, params[0])
+        assert len(self.queries) == 3
+
+    def test_coalesce_get_many(self):
+        resps = self.adapter.get_many([(self.url, {'a': 1}), (self.url, {'a': 2}),
+                                       (self.url, {'a': 1})])
+        assert resps == [{'query': 'a=1'}, {'query': 'a=2'}, {'query': 'a=1'}]
+        assert sorted(self.queries) == ['a=1', 'a=2']
+        assert self.adapter.coalesced() == 1
+
+    def test_coalesce_threads(self):
+        self.delay = 0.05
+        resps = []
+
+        def get():
+            resps.append(self.adapter.get(self.url, {'a': 1}))
+        threads = [threading.Thread(target=get) for _ in xrange(3)]
+        for thread in threads:
+            thread.start()
+        # The server answers in the hub of this thread
+        while any(thread.is_alive() for thread in threads):
+            gevent.sleep(0.01)
+        assert resps == [{'query': 'a=1'}] * 3
+        assert len(self.queries) == 1
+        assert self.adapter.coalesced() == 2
+
+    def test_no_single_flight(self):
+        self.delay = 0.05
+        adapter = RestAdapter(timeout=5, single_flight=False)
+        gevent.joinall([gevent.spawn(adapter.get, self.url, {'a': 1}) for _ in xrange(2)])
+        assert len(self.queries) == 2
+        assert adapter.coalesced() == 0
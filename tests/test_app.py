@@ -0,0 +1,121 @@
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.testing import AsyncHTTPTestCase, gen_test
+import atexit
+import imp
+import os
+import shutil
+import tempfile
+import tornado.web
+import unittest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'nlquery-app')
+
+
+_app = None
+
+
+def load_app():
+    """Loads the app module once, logging queries in a temporary directory
+
+    The app defines its options when loaded, which can only be done once.
+    """
+    global _app
+    if _app is not None:
+        return _app
+    log_dir = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, log_dir, True)
+    os.mkdir(os.path.join(log_dir, 'logs'))
+    cwd = os.getcwd()
+    os.chdir(log_dir)
+    try:
+        _app = imp.load_source('nlquery_app', os.path.join(APP_DIR, 'main.py'))
+        return _app
+    finally:
+        os.chdir(cwd)
+
+
+class Engine(object):
+    """Async engine answering queries when answered is resolved"""
+
+    def __init__(self):
+        self.answered = Future()
+
+    @gen.coroutine
+    def query(self, sent, format_='plain'):
+        yield self.answered
+        raise gen.Return('{"plain": "Michelle Obama"}')
+
+
+class AsyncQueryHandlerTest(AsyncHTTPTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.main = load_app()
+
+    def setUp(self):
+        super(AsyncQueryHandlerTest, self).setUp()
+        self.engine = self.main.async_nlquery = Engine()
+        self.main.admission = self.main.Admission(max_in_flight=1, max_queue=1)
+        self.main.options.deadline = 0.2
+
+    def get_app(self):
+        return self.main.make_app(self.main.AsyncQueryHandler, tornado.web.Application)
+
+    def post(self, query):
+        return self.http_client.fetch(self.get_url('/query'), method='POST',
+                                      body='{"q": "%s"}' % query, raise_error=False)
+
+    @gen_test
+    def test_answer(self):
+        self.engine.answered.set_result(None)
+        response = yield self.post("Who is Obama's wife?")
+        assert response.code == 200
+        assert response.body == '{"data":{"plain": "Michelle Obama"}}'
+
+    @gen_test
+    def test_queue_full(self):
+        # One query in flight and one waiting, the next is turned away
+        in_flight = self.post('Who is Obama?')
+        waiting = self.post('Who is Trump?')
+        yield gen.sleep(0.05)
+        response = yield self.post('Who is Clinton?')
+        assert response.code == 503
+
+        self.engine.answered.set_result(None)
+        responses = yield [in_flight, waiting]
+        assert [response.code for response in responses] == [200, 200]
+
+    @gen_test
+    def test_deadline(self):
+        response = yield self.post('Who is Obama?')
+        assert response.code == 504
+        # The turn is held until the query is answered
+        assert self.main.admission.semaphore._value == 0
+        self.engine.answered.set_result(None)
+        yield gen.sleep(0.01)
+        assert self.main.admission.semaphore._value == 1
+
+
+class MakeAppTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.main = load_app()
+
+    def tearDown(self):
+        self.main.options.debug = False
+        self.main.options.workers = 1
+
+    def settings(self, debug, workers):
+        self.main.options.debug = debug
+        self.main.options.workers = workers
+        settings = self.main.make_app(application=tornado.web.Application).settings
+        return settings['debug'], settings['autoreload']
+
+    def test_debug(self):
+        assert self.settings(False, 1) == (False, False)
+        assert self.settings(True, 1) == (True, True)
+        assert self.settings(True, 4) == (True, False)
+        assert self.settings(True, 0) == (True, False)
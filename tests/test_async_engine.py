@@ -0,0 +1,336 @@
+from nlquery.answer import Answer
+from nlquery.async_engine import AsyncNLQueryEngine, AsyncWikiData
+from nlquery.metrics import Metrics
+from nlquery.tracing import Trace
+from nltk.tree import Tree
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPError, HTTPRequest, HTTPResponse
+from tornado.httputil import HTTPHeaders
+from tornado.stack_context import StackContext
+from tornado.testing import AsyncTestCase, gen_test
+from io import BytesIO
+import re
+import time
+
+
+class CoalesceTest(AsyncTestCase):
+
+    def setUp(self):
+        super(CoalesceTest, self).setUp()
+        self.parsed = []
+
+        @gen.coroutine
+        def parse(sent):
+            self.parsed.append(sent)
+            yield gen.sleep(0.01)
+            raise gen.Return(Tree('ROOT', []))
+
+        self.engine = AsyncNLQueryEngine(coalesce=True)
+        self.engine.parse = parse
+
+    @gen_test
+    def test_coalesce(self):
+        answers = yield [
+            self.engine.query('Who is Obama', format_='raw'),
+            self.engine.query('Who  is Obama?', format_='raw'),
+            self.engine.query('Who is Obama?', format_='plain'),
+        ]
+        assert answers[0] is answers[1]
+        assert self.parsed == ['Who is Obama?', 'Who is Obama?']
+        assert self.engine.coalesced == 1
+
+        # Answered queries are not coalesced
+        yield self.engine.query('Who is Obama?', format_='raw')
+        assert len(self.parsed) == 3
+
+    @gen_test
+    def test_no_coalesce(self):
+        self.engine.coalesce = False
+        yield [self.engine.query('Who is Obama?'), self.engine.query('Who is Obama?')]
+        assert len(self.parsed) == 2
+        assert self.engine.coalesced == 0
+
+
+WIFE_TREE = "(SBARQ (WHNP (WP Who)) (SQ (VBZ is) (NP (NP (NNP Obama) (POS 's)) (NN wife))) (. ?))"
+
+
+class Backend(object):
+
+    def __init__(self, ans=None, coroutine=False):
+        self.ans = ans
+        self.coroutine = coroutine
+        self.calls = []
+
+    def get_property(self, **params):
+        self.calls.append(params)
+        if self.coroutine:
+            future = Future()
+            future.set_result(self.ans)
+            return future
+        return self.ans
+
+    find_entity = get_property
+
+
+class AsyncQueryTest(AsyncTestCase):
+
+    def setUp(self):
+        super(AsyncQueryTest, self).setUp()
+        self.parsed = []
+
+        @gen.coroutine
+        def parse(sent):
+            self.parsed.append(sent)
+            if sent.startswith('Fail'):
+                raise ValueError('Cannot parse')
+            raise gen.Return(Tree.fromstring(WIFE_TREE))
+
+        self.engine = AsyncNLQueryEngine()
+        self.engine.async_parser.parse = parse
+        self.engine.wd = Backend(Answer(data=['Michelle Obama']), coroutine=True)
+
+    def test_async_backends(self):
+        engine = AsyncNLQueryEngine()
+        assert engine.wd.__class__ is AsyncWikiData
+        assert engine.wd.http_client is engine.http_client
+
+    @gen_test
+    def test_parse_cache(self):
+        yield self.engine.query("Who is Obama's wife?")
+        ans = yield self.engine.query("Who is Obama's wife?")
+        assert ans == 'Michelle Obama'
+        assert self.parsed == ["Who is Obama's wife?"]
+
+    @gen_test
+    def test_backend_order(self):
+        self.engine.local = Backend(Answer(data=['Michelle']))
+        ans = yield self.engine.query("Who is Obama's wife?")
+        assert ans == 'Michelle'
+        assert len(self.engine.local.calls) == 1
+        assert self.engine.wd.calls == []
+
+        # WikiData answers what the local store does not
+        self.engine.local.ans = None
+        ans = yield self.engine.query("Who is Obama's wife?")
+        assert ans == 'Michelle Obama'
+        assert self.engine.local.calls[1] == self.engine.wd.calls[0]
+
+    @gen_test
+    def test_query_many(self):
+        sents = ["Who is Obama's wife?", 'Fail now?', ' ', "Who is  Obama's wife"]
+        answers = yield self.engine.query_many(sents, format_='raw')
+        assert [ans['query'] for ans in answers] == \
+            ["Who is Obama's wife?", 'Fail now?', '', "Who is Obama's wife?"]
+        assert answers[0]['plain'] == 'Michelle Obama'
+        assert answers[1]['tree'] is None
+        assert sorted(self.parsed) == ['Fail now?', "Who is Obama's wife?"]
+
+
+class AsyncMetricsTest(AsyncTestCase):
+
+    def setUp(self):
+        super(AsyncMetricsTest, self).setUp()
+
+        @gen.coroutine
+        def parse(sent):
+            yield gen.sleep(0.01)
+            raise gen.Return(Tree.fromstring(WIFE_TREE))
+
+        @gen.coroutine
+        def fetch(url, params={}):
+            yield gen.sleep(0.01)
+            if 'search' in params:
+                raise gen.Return({'search': [{'id': 'Q76'}]})
+            raise gen.Return({'results': {'bindings': [
+                {'valLabel': {'value': 'Michelle Obama'}}]}})
+
+        self.metrics = Metrics()
+        self.engine = AsyncNLQueryEngine(trace=True, metrics=self.metrics)
+        self.engine.async_parser.parse = parse
+        self.engine.wd.fetch = fetch
+
+    @gen_test
+    def test_metrics(self):
+        answers = yield [self.engine.query("Who is Obama's wife?", format_='raw'),
+                         self.engine.query("Who is Barack's wife?", format_='raw')]
+        assert [ans['plain'] for ans in answers] == ['Michelle Obama'] * 2
+
+        # Concurrent queries are traced apart
+        for ans in answers:
+            assert [span['name'] for span in ans['trace']['spans']] == [
+                'parse', 'corenlp', 'match', 'match', 'subject_params', 'resolve',
+                'search', 'sparql', 'wdqs', 'decode']
+        assert answers[0]['trace']['counts'] == {
+            'parse_cache.misses': 1,
+            'id_cache.misses': 1,
+            'answer_cache.misses': 1,
+            'sparql_cache.misses': 1,
+        }
+
+        metrics = self.metrics
+        assert metrics.queries.get() == 2
+        assert metrics.queries_in_flight.get() == 0
+        assert metrics.stage_seconds.count(stage='parse') == 2
+        assert metrics.backend_seconds.count(backend='wdqs') == 2
+        assert metrics.cache_requests.get(cache='parse_cache', result='miss') == 2
+
+        yield self.engine.query("Who is Obama's wife?")
+        assert metrics.cache_requests.get(cache='parse_cache', result='hit') == 1
+        assert metrics.cache_requests.get(cache='answer_cache', result='hit') == 1
+
+
+class HTTPClient(object):
+    """Stand-in of AsyncHTTPClient answering (code, headers, body) responses in turn"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.urls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @gen.coroutine
+    def fetch(self, url, request_timeout=None, raise_error=True):
+        self.urls.append(url)
+        code, headers, body = self.responses.pop(0)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        yield gen.sleep(0.01)
+        self.in_flight -= 1
+        request = HTTPRequest(url)
+        if code == 599:
+            raise gen.Return(HTTPResponse(request, 599, error=HTTPError(599, 'Timeout')))
+        raise gen.Return(HTTPResponse(request, code, headers=HTTPHeaders(headers),
+                                      buffer=BytesIO(body), effective_url=url))
+
+
+class AsyncFetchTest(AsyncTestCase):
+
+    URL = 'http://wikidata/w/api.php'
+
+    def make_wd(self, responses, **kwargs):
+        self.client = HTTPClient(responses)
+        return AsyncWikiData(http_client=self.client, backoff_factor=0.01, **kwargs)
+
+    @gen.coroutine
+    def fetch(self, wd, params={}):
+        self.trace = Trace()
+        with StackContext(self.trace.activate):
+            future = wd.fetch(self.URL, params)
+        data = yield future
+        raise gen.Return(data)
+
+    @gen_test
+    def test_retry_after(self):
+        wd = self.make_wd([(503, {'Retry-After': '0.1'}, ''), (200, {}, '{"id": "Q76"}')])
+        start = time.time()
+        data = yield self.fetch(wd, {'search': 'obama'})
+        assert data == {'id': 'Q76'}
+        assert time.time() - start >= 0.1
+        assert self.client.urls == [self.URL + '?search=obama'] * 2
+        assert self.trace.counts == {
+            'http.requests': 1, 'http.retries': 1, 'http.throttled': 1}
+        stats = wd.limiter(self.URL).stats()
+        assert (stats['throttled'], stats['in_flight']) == (1, 0)
+        # Halved when throttled, then increased when answered
+        self.assertAlmostEqual(stats['limit'], 5.2)
+
+    @gen_test
+    def test_failed(self):
+        wd = self.make_wd([(599, {}, ''), (500, {}, ''), (404, {}, '')], retries=2)
+        data = yield self.fetch(wd)
+        assert data is None
+        assert len(self.client.urls) == 3
+        assert self.trace.counts == {'http.requests': 1, 'http.retries': 2}
+
+        wd = self.make_wd([(599, {}, '')] * 2, retries=1)
+        data = yield self.fetch(wd)
+        assert data is None
+        assert self.trace.counts == {
+            'http.requests': 1, 'http.retries': 1, 'http.timeouts': 1}
+
+    @gen_test
+    def test_coalesce(self):
+        wd = self.make_wd([(200, {}, '{"id": "Q76"}')] * 2)
+        first, second = yield [wd.fetch(self.URL, {'search': 'obama'}),
+                               wd.fetch(self.URL, {'search': 'obama'})]
+        assert first is second
+        assert len(self.client.urls) == 1
+        assert wd.coalesced() == 1
+
+        # Answered requests are not coalesced
+        yield wd.fetch(self.URL, {'search': 'obama'})
+        assert len(self.client.urls) == 2
+
+    @gen_test
+    def test_limit(self):
+        wd = self.make_wd([(200, {}, '{}')] * 3, limits={'limit': 1, 'max_limit': 1})
+        yield [wd.fetch(self.URL, {'search': name}) for name in ['a', 'b', 'c']]
+        assert self.client.max_in_flight == 1
+
+
+COUNTRIES_TREE = ('(SBARQ (WHNP (WDT Which) (NNS countries)) (SQ (VP (VBP have) '
+                  '(NP (NP (DT a) (NN population)) (PP (IN over) (NP (CD 1000000000)))))) (. ?))')
+
+
+class AsyncStreamTest(AsyncTestCase):
+
+    def setUp(self):
+        super(AsyncStreamTest, self).setUp()
+        self.names = ['Country %02d' % i for i in xrange(25)]
+        self.queries = []
+
+        @gen.coroutine
+        def get_ids(lookups):
+            raise gen.Return(dict((lookup, 'Q6256') for lookup in lookups))
+
+        @gen.coroutine
+        def query_wdsparql(query):
+            self.queries.append(query)
+            limit = int(re.search(r'LIMIT (\d+)', query).group(1))
+            offset = int(re.search(r'OFFSET (\d+)', query).group(1))
+            raise gen.Return({'results': {'bindings': [
+                {'valLabel': {'value': name}}
+                for name in self.names[offset:offset + limit]]}})
+
+        @gen.coroutine
+        def parse(sent):
+            raise gen.Return(Tree.fromstring(COUNTRIES_TREE))
+
+        self.engine = AsyncNLQueryEngine()
+        self.engine.async_parser.parse = parse
+        self.engine.wd._get_ids = get_ids
+        self.engine.wd._query_wdsparql = query_wdsparql
+
+    @gen_test
+    def test_stream_entities(self):
+        values = []
+        streamed = yield self.engine.wd.stream_entities(
+            'which', 'country', [], values.append, page_size=10, limit=12)
+        assert streamed == 12
+        assert values == self.names[:12]
+        assert len(self.queries) == 2
+
+    @gen_test
+    def test_stream(self):
+        values = []
+        streamed = yield self.engine.stream(
+            'Which countries have a population over 1000000000?', values.append,
+            page_size=10)
+        assert streamed == 25
+        assert values == self.names
+        assert len(self.queries) == 3
+
+    @gen_test
+    def test_stream_local(self):
+        self.engine.local = Backend()
+        self.engine.local.stream_entities = lambda **params: iter(['India'])
+        values = []
+        streamed = yield self.engine.stream(
+            'Which countries have a population over 1000000000?', values.append)
+        assert (streamed, values, self.queries) == (1, ['India'], [])
+
+    @gen_test
+    def test_stream_count(self):
+        with self.assertRaises(ValueError):
+            yield self.engine.wd.stream_entities('how many', 'country', [], list)
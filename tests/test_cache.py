@@ -0,0 +1,299 @@
+from nlquery.cache import LRUCache, DiskCache, TieredCache, RefreshingCache, CachedParser, MISSING
+from nlquery.wikidata import WikiData
+from nltk.tree import Tree
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('a') == 1
+        assert cache.get('b') is MISSING
+        assert cache.get('c') == 3
+
+    def test_expires(self):
+        cache = LRUCache(ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=-1)
+        assert cache.get('a') == 1
+        assert cache.get('b') is MISSING
+
+    def test_caches_none(self):
+        cache = LRUCache()
+        cache.set('a', None)
+        assert cache.get('a') is None
+        assert 'a' in cache
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        super(DiskCacheTest, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_survives_restart(self):
+        cache = DiskCache(self.path)
+        cache.set(('Obama', 'item', 'en'), 'Q76')
+        cache = DiskCache(self.path)
+        assert cache.get(('Obama', 'item', 'en')) == 'Q76'
+        assert cache.get(('Obama', 'property', 'en')) is MISSING
+
+    def test_bounded(self):
+        cache = DiskCache(self.path, maxsize=2)
+        cache.set('a', 1)
+        time.sleep(0.01)
+        cache.set('b', 2)
+        time.sleep(0.01)
+        cache.set('c', 3)
+        assert len(cache) == 2
+        assert cache.get('a') is MISSING
+
+    def test_len(self):
+        cache = DiskCache(self.path)
+        cache.set('a', 1)
+        cache.set('a', 2)
+        cache.set('b', 2)
+        cache.delete('b')
+        cache.delete('c')
+        assert len(cache) == 1
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_shared_by_processes(self):
+        # Workers are forked after the cache is opened, as by a server
+        cache = DiskCache(self.path, maxsize=150)
+
+        def work(worker):
+            for i in xrange(100):
+                cache.set((worker, i), i)
+                assert cache.get((worker, i)) == i
+
+        workers = [multiprocessing.Process(target=work, args=(worker,)) for worker in xrange(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert [worker.exitcode for worker in workers] == [0, 0, 0]
+        assert len(cache) == 150
+        assert len(DiskCache(self.path)) == 150
+
+    def test_tiered_promotes(self):
+        disk = DiskCache(self.path)
+        disk.set('a', 1)
+        cache = TieredCache(LRUCache(), disk)
+        assert cache.get('a') == 1
+        assert cache.memory.get('a') == 1
+
+    def test_tiered_promotes_with_ttl_left(self):
+        disk = DiskCache(self.path, ttl=3600)
+        disk.set('a', 1, ttl=60)
+        disk.set('b', 2)
+        cache = TieredCache(LRUCache(ttl=3600), disk)
+        assert cache.get('a') == 1
+        assert cache.get('b') == 2
+        value, expires = cache.memory._data['a']
+        assert value == 1 and 58 < expires - time.time() <= 60
+        assert 3598 < cache.memory._data['b'][1] - time.time() <= 3600
+
+
+class RefreshingCacheTest(unittest.TestCase):
+
+    def test_serves_stale_while_refreshing(self):
+        cache = RefreshingCache(LRUCache(), stale_ttl=60)
+        assert cache.get('a', lambda trace: 1, ttl=-1) == 1
+        assert cache.get('a', lambda trace: 2, ttl=60) == 1
+        for _ in xrange(100):
+            if cache.cache.get('a')[0] == 2:
+                break
+            time.sleep(0.01)
+        assert cache.get('a', lambda trace: 3, ttl=60) == 2
+
+    def test_refreshes_queued_keys_once(self):
+        cache = RefreshingCache(LRUCache(), stale_ttl=60, refreshers=1)
+        fetched = []
+
+        def fetch(trace):
+            fetched.append(trace)
+            time.sleep(0.05)
+            return 2
+        for key in 'abc':
+            cache.get(key, lambda trace: 1, ttl=-1)
+        threads = threading.active_count()
+        for _ in xrange(3):
+            for key in 'abc':
+                assert cache.get(key, fetch, ttl=60) == 1
+        assert threading.active_count() == threads + 1
+        for _ in xrange(100):
+            if all(cache.cache.get(key)[0] == 2 for key in 'abc'):
+                break
+            time.sleep(0.01)
+        assert len(fetched) == 3
+
+    def test_drops_keys_over_max_queued(self):
+        cache = RefreshingCache(LRUCache(), stale_ttl=60, refreshers=1,
+                                max_queued=1)
+        fetched = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch(trace):
+            started.set()
+            release.wait(1)
+            fetched.append(trace)
+            return 2
+        for key in 'abc':
+            cache.get(key, lambda trace: 1, ttl=-1)
+        cache.get('a', fetch, ttl=60)
+        started.wait(1)
+        cache.get('b', fetch, ttl=60)
+        cache.get('c', fetch, ttl=60)
+        release.set()
+        for _ in xrange(100):
+            if len(fetched) == 2 and not cache._refreshing:
+                break
+            time.sleep(0.01)
+        assert len(fetched) == 2
+        assert cache.cache.get('c')[0] == 1
+
+    def test_does_not_cache_none(self):
+        cache = RefreshingCache(LRUCache(), stale_ttl=60)
+        assert cache.get('a', lambda trace: None, ttl=60) is None
+        assert cache.get('a', lambda trace: 1, ttl=60) == 1
+
+
+class CachedParserTest(unittest.TestCase):
+
+    class Parser(object):
+        def __init__(self):
+            self.sents = []
+
+        def parse(self, sent):
+            self.sents.append(sent)
+            return Tree.fromstring(
+                '(SBARQ (WHNP (WP Who)) (SQ (VBZ is) (NP (NNP Obama))) (. ?))')
+
+    def test_parse_cached(self):
+        parser = self.Parser()
+        cached_parser = CachedParser(parser, LRUCache())
+        tree = cached_parser.parse('Who is Obama?')
+        assert cached_parser.parse('Who is Obama?') == tree
+        assert parser.sents == ['Who is Obama?']
+        assert cached_parser.cache.get('Who is Obama?') == \
+            '(SBARQ (WHNP (WP Who)) (SQ (VBZ is) (NP (NNP Obama))) (. ?))'
+
+
+class WikiDataIdCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        super(WikiDataIdCacheTest, self).setUp()
+        self.wd = WikiData()
+        self.calls = []
+        results = {
+            'Obama': {'search': [{'id': 'Q76'}]},
+            'Nobody': {'search': []},
+        }
+
+        def search_entities(lookups):
+            self.calls += lookups
+            return [results.get(name) for name, _type in lookups]
+        self.wd._search_entities = search_entities
+
+    def test_get_id_cached(self):
+        assert self.wd._get_id('Obama') == 'Q76'
+        assert self.wd._get_id('Obama') == 'Q76'
+        assert self.calls == [('Obama', 'item')]
+
+    def test_get_id_negative_cached(self):
+        assert self.wd._get_id('Nobody') is None
+        assert self.wd._get_id('Nobody') is None
+        assert self.calls == [('Nobody', 'item')]
+
+    def test_get_id_failure_not_cached(self):
+        assert self.wd._get_id('Offline') is None
+        assert self.wd._get_id('Offline') is None
+        assert len(self.calls) == 2
+
+    def test_get_ids_searches_misses_once(self):
+        self.wd._get_id('Obama')
+        ids = self.wd._get_ids([
+            ('Obama', 'item'), ('Nobody', 'item'), ('Nobody', 'item')])
+        assert ids == {('Obama', 'item'): 'Q76', ('Nobody', 'item'): None}
+        assert self.calls == [('Obama', 'item'), ('Nobody', 'item')]
+
+
+class WikiDataAnswerCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        super(WikiDataAnswerCacheTest, self).setUp()
+        self.wd = WikiData()
+        self.queries = []
+        self.result = {'results': {'bindings': [{'valLabel': {'value': 'Michelle Obama'}}]}}
+        ids = {
+            'Obama': 'Q76', 'Barack Obama': 'Q76', 'wife': 'P26', 'spouse': 'P26',
+            'country': 'Q6256', 'Asia': 'Q48', 'population': 'P1082',
+        }
+        self.wd._get_ids = lambda lookups: dict(
+            (lookup, ids.get(lookup[0])) for lookup in lookups)
+
+        def query_wdsparql(query):
+            self.queries.append(query)
+            return self.result
+        self.wd._query_wdsparql = query_wdsparql
+
+    def test_paraphrases(self):
+        ans = self.wd._get_property('Obama', 'wife')
+        ans2 = self.wd._get_property('Barack Obama', 'spouse')
+        assert len(self.queries) == 1
+        assert ans2.data == ans.data == ['Michelle Obama']
+        assert ans2.sparql_query == self.queries[0]
+        # Answers do not share data
+        ans2.data.append('Barack Obama')
+        assert self.wd._get_property('Obama', 'wife', 'P26').data == ['Michelle Obama']
+
+    def test_find_entity(self):
+        self.wd.find_entity('which', 'country', [(None, 'Asia', 'in'),
+                                                 ('population', '1000000', '>')])
+        self.wd.find_entity('who', 'country', [('population', '1000000', '>'),
+                                               (None, 'Asia', 'from')])
+        assert len(self.queries) == 1
+        self.wd.find_entity('which', 'country', [(None, 'Asia', 'in')], limit=10)
+        self.wd.find_entity('how many', 'country', [(None, 'Asia', 'in')])
+        assert len(self.queries) == 3
+
+    def test_failure_not_cached(self):
+        self.result = None
+        self.wd._get_property('Obama', 'wife')
+        self.wd._get_property('Obama', 'wife')
+        assert len(self.queries) == 2
+
+
+class WikiDataSparqlCacheTest(unittest.TestCase):
+
+    def test_canonical_sparql(self):
+        query = """
+        SELECT ?valLabel
+        WHERE {
+            ?val wdt:P31 wd:Q6256 . # instance of
+        }"""
+        assert WikiData._canonical_sparql(query) == \
+            'SELECT ?valLabel WHERE { ?val wdt:P31 wd:Q6256 . }'
+
+    def test_sparql_ttl(self):
+        wd = WikiData()
+        assert wd._sparql_ttl('SELECT (count(*) as ?count)') == 24 * 60 * 60
+        assert wd._sparql_ttl('SELECT ?valLabel') == WikiData.SPARQL_TTL
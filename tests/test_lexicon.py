@@ -0,0 +1,85 @@
+from nlquery.lexicon import PropertyLexicon, default_lexicon, inflections, CURATED_PATH
+from nlquery.local_store import build_lexicon
+from nlquery.wikidata import WikiData
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+DUMP_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'wikidata_dump.json')
+
+
+class LexiconTest(unittest.TestCase):
+
+    def test_bundled(self):
+        lexicon = default_lexicon()
+        assert lexicon.version
+        assert lexicon.get('wife') == 'P26'
+        assert lexicon.get('  Wives ') == 'P26'
+        assert lexicon.get('places of birth') == 'P19'
+        assert lexicon.get('population') == 'P1082'
+        assert lexicon.get('religion') == 'P140'
+        assert lexicon.get('flux capacitor') is None
+        assert lexicon.get(None) is None
+
+    def test_contexts(self):
+        lexicon = default_lexicon()
+        assert lexicon.get('born', 'where') == 'P19'
+        assert lexicon.get('born', 'when') == 'P569'
+        assert lexicon.get('born', 'who') is None
+        assert lexicon.get('height', 'how') == 'P2044,P2048'
+        assert lexicon.get('died', 'from') == 'P509'
+
+    def test_inflections(self):
+        assert inflections('wife') == ['wives']
+        assert inflections('place of birth') == ['places of birth']
+        assert inflections('country') == ['countries']
+        assert inflections('employees') == []
+        assert inflections('married to') == []
+        assert inflections('adjacent to') == []
+        assert inflections('part of') == []
+        assert inflections('sex or gender') == []
+
+    def test_build_lexicon(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'properties.json')
+            build_lexicon(DUMP_PATH, path, 'test')
+            lexicon = PropertyLexicon(path)
+            assert lexicon.version == 'test'
+            assert lexicon.get('husbands') == 'P26'
+            assert lexicon.get('continent') == 'P30'
+            assert lexicon.get('countries') == 'P17'
+            assert lexicon.get('obama') is None
+            assert lexicon.get('died', 'by') == 'P509'
+            assert lexicon.get('married') == 'P26'
+            assert lexicon.get('hometown') == 'P19'
+
+            build_lexicon(DUMP_PATH, path, 'test', curated_path=None)
+            lexicon = PropertyLexicon(path)
+            assert lexicon.get('husbands') == 'P26'
+            assert lexicon.get('married') is None
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_bundled_curated(self):
+        with open(CURATED_PATH) as f:
+            curated = json.load(f)['names']
+        lexicon = default_lexicon()
+        for name, prop_id in curated.iteritems():
+            assert lexicon.get(name) == prop_id
+
+    def test_wikidata_lookups(self):
+        wd = WikiData()
+        params = [('population', '1000', '>'), ('died', 'cancer', 'from')]
+        assert wd._find_entity_lookups('person', params) == \
+            [('person', 'item'), ('cancer', 'item')]
+        ids = {('person', 'item'): 'Q5', ('cancer', 'item'): 'Q12078'}
+        query = wd._find_entity_query('which', 'person', params, ids)
+        assert '?val wdt:P1082 ?value FILTER(?value > 1000)' in query
+        assert '?val wdt:P509 wd:Q12078' in query
+
+        query = wd._find_entity_query('which', 'person', [('height', '2', '>')],
+                                      {('person', 'item'): 'Q5'})
+        assert '?val wdt:P2044|wdt:P2048 ?value' in query
@@ -0,0 +1,161 @@
+from nlquery.local_store import build_store, TripleStore, LocalWikiData, ITEM, QUANTITY
+from nlquery.wikidata import WikiData
+from datetime import datetime
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+DUMP_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'wikidata_dump.json')
+
+
+class LocalStoreTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        build_store(DUMP_PATH, cls.dir, complete=True)
+        cls.store = TripleStore(cls.dir)
+        cls.wd = LocalWikiData(cls.store)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def test_store(self):
+        assert self.store.objects('Q76', 'P26') == [('Q13133', ITEM)]
+        assert self.store.objects('Q148', 'P1082') == [('1409517397', QUANTITY)]
+        assert sorted(self.store.subjects('P30', 'Q46')) == ['Q183', 'Q40']
+        assert self.store.objects('Q76', 'P999') == []
+
+    def test_search(self):
+        assert self.store.search(' Barack  OBAMA ') == ['Q76']
+        assert self.store.search('obama', 'property') == []
+        assert self.store.search('nobody') == []
+        assert self.store.search('') == []
+        # Exact matches first
+        assert self.store.search('continent') == ['Q5107']
+        assert self.store.search('continent', 'property') == ['P30']
+        # Labels before aliases, then by sitelinks
+        assert self.store.search('pe') == ['Q148', 'Q5']
+        assert self.store.search('a', limit=2) == ['Q40', 'Q48']
+        assert self.store.search('obam', exact=True) == []
+        assert self.store.search('continent', exact=True) == ['Q5107']
+
+    def test_search_result(self):
+        assert self.store.search_result('obama') == {'search': [{
+            'id': 'Q76',
+            'label': 'Barack Obama',
+            'description': '44th President of the United States',
+        }]}
+        assert self.store.search_result('nobody') is None
+        # Prefix matches are left to wbsearchentities
+        assert self.store.search_result('obam') is None
+
+    def test_wikidata_search_index(self):
+        wd = WikiData(search_index=self.store)
+        calls = []
+
+        def get_many(requests):
+            calls.extend(params['search'] for _, params in requests)
+            return [{'search': [{'id': 'Q1'}]} for _ in requests]
+
+        wd.get_many = get_many
+        ids = wd._get_ids([('obama', 'item'), ('wife', 'property'), ('nobody', 'item'),
+                           ('barack', 'item')])
+        assert ids == {
+            ('obama', 'item'): 'Q76',
+            ('wife', 'property'): 'P26',
+            ('nobody', 'item'): 'Q1',
+            ('barack', 'item'): 'Q1',
+        }
+        assert sorted(calls) == ['barack', 'nobody']
+        assert wd._get_desc('obama').data == '44th President of the United States'
+
+    def test_build_store_removes_database(self):
+        store_dir = os.path.join(self.dir, 'built')
+        build_store(DUMP_PATH, store_dir)
+        assert sorted(os.listdir(store_dir)) == [
+            'meta.json', 'names.bin', 'pos.bin', 'spo.bin', 'strings.bin', 'strings.idx']
+
+    def test_offline_adapter(self):
+        assert not hasattr(self.wd, 'session')
+        assert not hasattr(self.wd, 'sparql_cache')
+
+    def test_filter_properties(self):
+        store_dir = os.path.join(self.dir, 'filtered')
+        build_store(DUMP_PATH, store_dir, properties=['P31'])
+        store = TripleStore(store_dir)
+        assert store.objects('Q76', 'P31') == [('Q5', ITEM)]
+        assert store.objects('Q76', 'P26') == []
+
+    def test_gzip_dump(self):
+        dump_path = os.path.join(self.dir, 'dump.json.gz')
+        with open(DUMP_PATH) as f, gzip.open(dump_path, 'wb') as gz:
+            gz.write(f.read())
+        store_dir = os.path.join(self.dir, 'gz')
+        build_store(dump_path, store_dir)
+        assert TripleStore(store_dir).objects('Q76', 'P26') == [('Q13133', ITEM)]
+
+    def test_get_property(self):
+        assert self.wd.get_property('who', 'obama', 'wife').data == ['Michelle Obama']
+        assert self.wd.get_property('where', 'obama', 'born').data == ['Honolulu']
+        assert self.wd.get_property('when', 'obama', 'born').data == [datetime(1961, 8, 4)]
+        assert self.wd.get_property('what', 'yao ming', 'height').data == ['2.29']
+        assert self.wd.get_property('what', 'china', 'population').data == [1409517397.0]
+        assert isinstance(self.wd.get_property('how', 'obama', 'age').data, int)
+        assert self.wd.get_property('who', 'obama', None).data == \
+            '44th President of the United States'
+        assert sorted(self.wd.get_property('what', 'obama', 'nickname').data) == \
+            ['Barack Hussein Obama II', 'Barack Obama', 'Obama']
+
+    def test_get_property_missing(self):
+        assert self.wd.get_property('who', 'nobody', 'wife') is None
+        assert self.wd.get_property('who', 'yao ming', 'wife') is None
+        assert self.wd.get_property('who', 'human', None).data == \
+            'common name of Homo sapiens'
+
+    def test_get_properties(self):
+        answers = self.wd.get_properties([('Q76', 'P26'), ('Q41421', 'P2044,P2048')])
+        assert [ans.data for ans in answers] == [['Michelle Obama'], ['2.29']]
+
+    def test_find_entity(self):
+        assert self.wd.find_entity('how many', 'countries', [(None, 'asia', 'in')]) is None
+        assert self.wd.find_entity('how many', 'country', [(None, 'asia', 'in')]).data == '3'
+        assert self.wd.find_entity(
+            'which', 'country', [('population', '1,000,000,000', '>')]).data == \
+            ["People's Republic of China", 'India']
+        assert self.wd.find_entity(
+            'which', 'country', [('continent', 'europe', 'in')]).data == \
+            ['Germany', 'Austria']
+        # Nothing matching is left to the next backend
+        assert self.wd.find_entity('which', 'continent', [(None, 'asia', 'in')]) is None
+        assert self.wd.find_entity(
+            'how many', 'country', [('population', '1,000,000,000,000', '>')]) is None
+
+    def test_find_entity_partial_store(self):
+        store_dir = os.path.join(self.dir, 'partial')
+        build_store(DUMP_PATH, store_dir)
+        wd = LocalWikiData(store_dir)
+        assert not wd.store.complete
+        assert wd.find_entity('how many', 'country', [(None, 'asia', 'in')]) is None
+        assert wd.get_property('who', 'obama', 'wife').data == ['Michelle Obama']
+
+    def test_find_entity_limit(self):
+        params = [(None, 'asia', 'in')]
+        assert self.wd.find_entity('which', 'country', params, limit=2).data == \
+            ["People's Republic of China", 'Japan']
+        assert list(self.wd.stream_entities('which', 'country', params, limit=1)) == \
+            ["People's Republic of China"]
+        assert self.wd.stream_entities('which', 'planet', params) is None
+
+    def test_find_entity_position(self):
+        props = [(None, 'united states', 'of')]
+        ans = self.wd.find_entity('who', 'president', props)
+        assert sorted(ans.data) == ['Barack Obama', 'Bill Clinton', 'Donald Trump']
+        assert props == [(None, 'united states', 'of')]
+
+    def test_find_entity_needs_qualifiers(self):
+        props = [(None, '1995', 'in')]
+        assert self.wd.find_entity('who', 'president of united states', props) is None
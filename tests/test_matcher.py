@@ -0,0 +1,63 @@
+from lango.matcher import match_rules_context
+from nlquery.matcher import compile_rules, match_rules, order_by_hits
+from nlquery.rules import SUBJ_RULES, SUBJECT_PROP_RULES, PROP_RULES, FIND_ENTITY_RULES
+from nltk.tree import Tree
+from collections import OrderedDict
+import os
+import unittest
+
+TREES_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'trees.tsv')
+
+
+def load_trees():
+    with open(TREES_PATH) as f:
+        return [Tree.fromstring(line.split('\t')[1]) for line in f if line.strip()]
+
+
+class MatcherTest(unittest.TestCase):
+
+    def test_same_context_as_lango(self):
+        for rules in [SUBJ_RULES, SUBJECT_PROP_RULES, PROP_RULES, FIND_ENTITY_RULES]:
+            compiled = compile_rules(rules)
+            for tree in load_trees():
+                for subtree in tree.subtrees():
+                    assert compiled.match_context(subtree) == \
+                        match_rules_context(subtree, rules)
+
+    def test_match_rules(self):
+        tree = Tree.fromstring(
+            '(SBARQ (WHNP (WP Who)) (SQ (VBD did) (NP (NNP Obama)) (VP (VB marry))) (. ?))')
+
+        def fun(qtype, subject, prop=None):
+            return qtype, subject, prop
+
+        assert match_rules(tree, compile_rules(SUBJECT_PROP_RULES), fun) == \
+            ('who', 'obama', 'marry')
+        assert match_rules(tree, compile_rules(FIND_ENTITY_RULES), fun) is None
+
+    def test_hits(self):
+        rules = compile_rules(OrderedDict([
+            ('( NP ( NNP ) )', {}),
+            ('( NP:subject-o )', {}),
+        ]))
+        rules.match_context(Tree.fromstring('(NP (NNP Obama))'))
+        rules.match_context(Tree.fromstring('(NP (DT the) (NN wife))'))
+        rules.match_context(Tree.fromstring('(NP (NN wife))'))
+        assert [rule['hits'] for rule in rules.stats()] == [1, 2]
+
+    def test_order_by_hits(self):
+        hits = {'a': 1, 'b': 5, 'c': 3}
+        overlaps = set([('c', 'a')])
+        disjoint = lambda item, other: (item, other) not in overlaps
+        assert order_by_hits(['a', 'b', 'c'], hits.get, disjoint) == ['b', 'a', 'c']
+
+    def test_adaptive_same_context(self):
+        trees = [subtree for tree in load_trees() for subtree in tree.subtrees()]
+        for rules in [SUBJ_RULES, SUBJECT_PROP_RULES, PROP_RULES, FIND_ENTITY_RULES]:
+            compiled = compile_rules(rules)
+            compiled.set_adaptive()
+            for tree in trees:
+                compiled.match_context(tree)
+            compiled._candidates = {}
+            for tree in trees:
+                assert compiled.match_context(tree) == match_rules_context(tree, rules)
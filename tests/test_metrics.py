@@ -0,0 +1,99 @@
+from nlquery.api_adapter import RestAdapter
+from nlquery.cache import DiskCache
+from nlquery.metrics import Metrics, Histogram, WorkerMetrics
+from nlquery.tracing import Trace
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_histogram(self):
+        hist = Histogram('latency_seconds', 'Latency', ['stage'], buckets=(0.1, 1))
+        hist.observe(0.05, stage='parse')
+        hist.observe(0.5, stage='parse')
+        hist.observe(5, stage='parse')
+        assert hist.render().split('\n') == [
+            '# HELP latency_seconds Latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{stage="parse",le="0.1"} 1',
+            'latency_seconds_bucket{stage="parse",le="1"} 2',
+            'latency_seconds_bucket{stage="parse",le="+Inf"} 3',
+            'latency_seconds_sum{stage="parse"} 5.55',
+            'latency_seconds_count{stage="parse"} 3',
+        ]
+
+    def test_observe_trace(self):
+        metrics = Metrics()
+        trace = Trace()
+        with metrics.measure(trace), trace.activate():
+            assert metrics.queries_in_flight.get() == 1
+            with trace.span('resolve'):
+                with trace.span('search'):
+                    pass
+            trace.count('id_cache.hits', 3)
+            trace.count('id_cache.misses')
+            trace.count('http.requests')
+            trace.count('http.coalesced', 2)
+
+        assert metrics.queries_in_flight.get() == 0
+        assert metrics.queries.get() == 1
+        assert metrics.stage_seconds.count(stage='resolve') == 1
+        assert metrics.backend_seconds.count(backend='wbsearchentities') == 1
+        text = metrics.render()
+        assert 'nlquery_cache_requests_total{cache="id_cache",result="hit"} 3\n' in text
+        assert 'nlquery_cache_hit_ratio{cache="id_cache"} 0.75\n' in text
+        assert 'nlquery_http_requests_total 1\n' in text
+        assert 'nlquery_http_coalesced_total 2\n' in text
+
+    def test_query_errors(self):
+        metrics = Metrics()
+        with self.assertRaises(ValueError):
+            with metrics.measure(Trace()):
+                raise ValueError()
+        assert metrics.query_errors.get(error='ValueError') == 1
+        assert metrics.queries_in_flight.get() == 0
+
+    def test_http_errors(self):
+        adapter = RestAdapter(retries=0)
+        trace = Trace()
+        with trace.activate():
+            assert adapter.get('http://127.0.0.1:1/') is None
+        assert trace.counts == {'http.requests': 1, 'http.errors': 1}
+
+
+class WorkerMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_render(self):
+        cache = DiskCache(os.path.join(self.dir, 'metrics.db'))
+        metrics = [Metrics(buckets=(1,)), Metrics(buckets=(1,))]
+        workers = [WorkerMetrics(m, cache, worker, 3) for worker, m in enumerate(metrics)]
+        metrics[0].queries.inc(2)
+        metrics[0].query_seconds.observe(0.5)
+        metrics[1].queries.inc()
+        workers[1].publish()
+
+        lines = workers[0].render().split('\n')
+        start = lines.index('# HELP nlquery_queries_total Queries answered')
+        assert lines[start:start + 4] == [
+            '# HELP nlquery_queries_total Queries answered',
+            '# TYPE nlquery_queries_total counter',
+            'nlquery_queries_total{worker="0"} 2',
+            'nlquery_queries_total{worker="1"} 1',
+        ]
+        assert 'nlquery_query_seconds_bucket{worker="0",le="1"} 1' in lines
+        assert lines.count('# TYPE nlquery_query_seconds histogram') == 1
+
+        # Served by any worker, with the last published metrics of the others
+        metrics[0].queries.inc()
+        assert 'nlquery_queries_total{worker="0"} 2' in workers[1].render()
+        workers[0].publish()
+        assert 'nlquery_queries_total{worker="0"} 3' in workers[1].render()
@@ -0,0 +1,66 @@
+from nlquery.nlquery import NLQueryEngine
+from nltk.tree import Tree
+import unittest
+
+
+class FakeParser(object):
+
+    def __init__(self):
+        self.parsed = []
+
+    def parse(self, sent):
+        self.parsed.append(sent)
+        if sent.startswith('Fail'):
+            raise ValueError('Cannot parse')
+        return Tree('ROOT', [])
+
+
+class QueryManyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = NLQueryEngine()
+        self.engine.parser = FakeParser()
+
+    def test_order(self):
+        sents = ['Who is Obama?', 'What is the capital of France?', 'Who is Trump?']
+        answers = self.engine.query_many(sents, format_='raw', concurrency=2)
+        assert [ans['query'] for ans in answers] == sents
+
+    def test_dedup(self):
+        answers = self.engine.query_many(
+            ['Who is Obama', 'Who  is Obama?', 'Who is Trump?'], format_='raw')
+        assert sorted(self.engine.parser.parsed) == ['Who is Obama?', 'Who is Trump?']
+        assert answers[0] is answers[1]
+
+    def test_failing_query(self):
+        answers = self.engine.query_many(
+            ['Who is Obama?', 'Fail now?', '', '  ', 'Who is Trump?'], format_='raw')
+        assert [ans['query'] for ans in answers] == \
+            ['Who is Obama?', 'Fail now?', '', '', 'Who is Trump?']
+        assert answers[1]['tree'] is None
+        assert '' not in self.engine.parser.parsed
+
+    def test_stream(self):
+        results = self.engine.query_many(
+            ['Who is Obama?', 'Fail now?', 'Who is Obama'], stream=True)
+        assert sorted(index for index, _ in results) == [0, 1, 2]
+
+
+class AdaptiveRulesTest(unittest.TestCase):
+
+    def test_engines_independent(self):
+        adaptive = NLQueryEngine(adaptive=True)
+        engine = NLQueryEngine()
+        tree = Tree.fromstring('(SBARQ (WHNP (WP Who)) (SQ (VBZ is) '
+                               '(NP (NNP Obama))) (. ?))')
+        for _ in xrange(3):
+            adaptive.subject_prop_rules.match_context(tree)
+
+        assert adaptive.subject_prop_rules.adaptive
+        assert not engine.subject_prop_rules.adaptive
+        assert not engine.find_entity_rules.adaptive
+
+        def hits(stats):
+            return sum(rule['hits'] for rule in stats)
+        assert hits(adaptive.rule_stats()['rules']['subject_prop']) == 3
+        assert hits(engine.rule_stats()['rules']['subject_prop']) == 0
@@ -0,0 +1,91 @@
+from nlquery.ratelimit import TokenBucket, EndpointLimiter, parse_retry_after
+import email.utils
+import gevent
+import time
+import unittest
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_take(self):
+        bucket = TokenBucket(10, burst=2)
+        assert bucket.take() == 0
+        assert bucket.take() == 0
+        self.assertAlmostEqual(bucket.take(), 0.1, places=2)
+        self.assertAlmostEqual(bucket.take(), 0.2, places=2)
+
+
+class EndpointLimiterTest(unittest.TestCase):
+
+    def test_aimd(self):
+        limiter = EndpointLimiter(limit=4, min_limit=1, max_limit=5)
+        sent = limiter.acquire()
+        limiter.release(sent)
+        assert limiter.limit == 4.25
+
+        first, second = limiter.acquire(), limiter.acquire()
+        limiter.release(first, throttled=True)
+        assert limiter.limit == 2.125
+        # Sent before the decrease
+        limiter.release(second, throttled=True)
+        assert limiter.limit == 2.125
+        assert limiter.throttled == 2
+
+        for _ in xrange(3):
+            limiter.release(limiter.acquire(), throttled=True)
+        assert limiter.limit == 1
+
+        limiter.release(limiter.acquire(), failed=True)
+        assert limiter.limit == 1
+        assert limiter.in_flight == 0
+
+    def test_limit(self):
+        limiter = EndpointLimiter(limit=1)
+        sent = limiter.acquire()
+        waiter = gevent.spawn(limiter.acquire)
+        gevent.sleep(0.05)
+        assert not waiter.ready()
+        limiter.release(sent)
+        waiter.join(1)
+        assert waiter.successful()
+        assert limiter.in_flight == 1
+
+    def test_try_acquire(self):
+        limiter = EndpointLimiter(limit=1)
+        sent, wait = limiter.try_acquire()
+        assert sent is not None and wait == 0
+        assert limiter.try_acquire()[0] is None
+        limiter.release(sent, throttled=True, retry_after=0.5)
+        sent, wait = limiter.try_acquire()
+        assert sent is None
+        assert 0.4 < wait <= 0.5
+
+    def test_pace(self):
+        limiter = EndpointLimiter(rate=10, burst=1)
+        assert limiter.pace() == 0
+        self.assertAlmostEqual(limiter.pace(), 0.1, places=2)
+        assert EndpointLimiter().pace() == 0
+
+    def test_retry_after(self):
+        limiter = EndpointLimiter()
+        limiter.release(limiter.acquire(), throttled=True, retry_after=0.05)
+        start = time.time()
+        limiter.acquire()
+        assert time.time() - start >= 0.04
+
+    def test_rate(self):
+        limiter = EndpointLimiter(rate=20, burst=1)
+        start = time.time()
+        for _ in xrange(3):
+            limiter.release(limiter.acquire())
+        assert time.time() - start >= 0.09
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+
+    def test_parse_retry_after(self):
+        assert parse_retry_after('5') == 5.0
+        assert parse_retry_after(None) is None
+        assert parse_retry_after('soon') is None
+        date = email.utils.formatdate(time.time() + 30, usegmt=True)
+        assert 28 < parse_retry_after(date) <= 30
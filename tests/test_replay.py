@@ -0,0 +1,36 @@
+from nlquery.nlquery import NLQueryEngine
+import logging
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+from corpus import CORPUS
+from standins import Recording, CoreNLPStandIn, WikidataStandIn, serve, point_engine, \
+    RECORDING_PATH
+
+
+class ReplayTest(unittest.TestCase):
+    """Smoke test of the committed recording of bench_replay.py"""
+
+    def test_replay_corpus(self):
+        recording = Recording.load(RECORDING_PATH)
+        corenlp = CoreNLPStandIn(recording)
+        wikidata = WikidataStandIn(recording)
+        corenlp_server = serve(corenlp)
+        wikidata_server = serve(wikidata)
+        try:
+            engine = NLQueryEngine('127.0.0.1', corenlp_server.server_port)
+            point_engine(engine, wikidata_server)
+            for logger in [engine.logger, engine.wd.logger]:
+                logger.setLevel(logging.WARNING)
+            answers = [engine.query(sent, format_='raw') for sent in CORPUS]
+        finally:
+            corenlp_server.stop()
+            wikidata_server.stop()
+
+        assert corenlp.misses + wikidata.misses == 0
+        assert [ans['query'] for ans in answers] == CORPUS
+        assert all(ans['plain'] for ans in answers)
+        assert answers[4]['plain'] == 'Michelle Obama'
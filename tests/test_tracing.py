@@ -0,0 +1,93 @@
+from nlquery.answer import Answer
+from nlquery.cache import MISSING
+from nlquery.tracing import Trace, NULL_TRACE, current_trace
+from nlquery.wikidata import WikiData
+import gevent
+import json
+import threading
+import unittest
+
+
+class TracingTest(unittest.TestCase):
+
+    def test_disabled(self):
+        assert current_trace() is NULL_TRACE
+        with current_trace().span('parse'):
+            current_trace().count('http.requests')
+        assert 'trace' not in Answer().to_dict()
+
+    def test_spans(self):
+        trace = Trace()
+        with trace.activate():
+            assert current_trace() is trace
+            with trace.span('match'):
+                with trace.span('match'):
+                    pass
+                with trace.span('find_entity_params'):
+                    trace.count('id_cache.hits', 2)
+        assert current_trace() is NULL_TRACE
+
+        d = trace.to_dict()
+        assert [(span['name'], span['depth']) for span in d['spans']] == \
+            [('match', 0), ('match', 1), ('find_entity_params', 1)]
+        assert d['stages']['match'] == d['spans'][0]['duration']
+        assert d['counts'] == {'id_cache.hits': 2}
+        assert d['total'] >= d['stages']['match']
+
+    def test_greenlets(self):
+        traces = [Trace(), Trace()]
+
+        def run(trace):
+            with trace.activate():
+                gevent.sleep(0)
+                current_trace().count('http.requests')
+
+        gevent.joinall([gevent.spawn(run, trace) for trace in traces])
+        assert [trace.counts for trace in traces] == [{'http.requests': 1}] * 2
+
+    def test_wikidata(self):
+        wd = WikiData()
+        wd.get_many = lambda calls: [{'search': [{'id': 'Q76'}]} for _ in calls]
+        wd.get = lambda url, params: {'results': {'bindings': [
+            {'valLabel': {'value': 'Michelle Obama'}}]}}
+
+        trace = Trace()
+        with trace.activate():
+            ans = wd._get_property('obama', 'wife', 'P26')
+            ans = wd._get_property('obama', 'wife', 'P26')
+            ans.trace = trace
+            d = json.loads(ans.to_json())
+
+        assert d['plain'] == 'Michelle Obama'
+        assert [span['name'] for span in d['trace']['spans']] == \
+            ['resolve', 'search', 'sparql', 'wdqs', 'resolve', 'decode']
+        assert d['trace']['counts'] == {
+            'id_cache.hits': 1,
+            'id_cache.misses': 1,
+            'answer_cache.hits': 1,
+            'answer_cache.misses': 1,
+            'sparql_cache.misses': 1,
+        }
+
+    def test_stale_refresh(self):
+        wd = WikiData()
+        refreshed = threading.Event()
+
+        def get(url, params):
+            if wd.sparql_cache.cache.get(key) is not MISSING:
+                current_trace().count('http.requests')
+                refreshed.set()
+            return {'results': {'bindings': []}}
+
+        wd.get = get
+        query = 'SELECT ?valLabel WHERE { wd:Q76 wdt:P26 ?val . }'
+        key = wd._canonical_sparql(query)
+        wd.sparql_cache.put(key, {'results': {'bindings': []}}, ttl=-1)
+
+        trace = Trace()
+        with trace.activate():
+            wd._query_wdsparql(query)
+        assert refreshed.wait(1)
+        # The background refresh is not traced in the query served stale
+        assert [span[0] for span in trace.spans] == ['sparql']
+        assert trace.counts == {'sparql_cache.hits': 1}
@@ -0,0 +1,239 @@
+from nlquery.utils import dget, dgetter
+from nlquery.wikidata import WikiData, WikiDataAnswer, UNDECODED, parse_time
+from datetime import datetime
+import itertools
+import re
+import unittest
+
+ENTITY = 'http://www.wikidata.org/entity/'
+PROP = 'http://www.wikidata.org/prop/'
+
+
+def binding(subject_id, pid, value):
+    return {
+        'subject': {'value': ENTITY + subject_id},
+        'p': {'value': PROP + pid},
+        'valLabel': {'value': value},
+    }
+
+
+class BatchedPropertiesTest(unittest.TestCase):
+
+    def setUp(self):
+        super(BatchedPropertiesTest, self).setUp()
+        self.wd = WikiData()
+        self.queries = []
+        self.results = {
+            ('Q76', 'P26'): [binding('Q76', 'P26', 'Michelle Obama')],
+            ('Q41421', 'P2044'): [],
+            ('Q41421', 'P2048'): [binding('Q41421', 'P2048', '2.29')],
+            ('Q148', 'P36'): [binding('Q148', 'P36', 'Beijing')],
+        }
+        self.failing = set()
+        self.wd.get_many = self.get_many
+
+    def get_many(self, calls):
+        results = []
+        for url, params in calls:
+            query = params['query']
+            self.queries.append(query)
+            if any('wd:%s' % subject_id in query for subject_id in self.failing):
+                results.append(None)
+                continue
+            bindings = [b for (subject_id, pid), bs in self.results.iteritems()
+                        if 'wd:%s p:%s ' % (subject_id, pid) in query for b in bs]
+            results.append({'results': {'bindings': bindings}})
+        return results
+
+    def test_get_properties(self):
+        pairs = [('Q76', 'P26'), ('Q41421', 'P2044,P2048'), ('Q148', 'P36'), ('Q76', 'P26')]
+        answers = self.wd.get_properties(pairs)
+        assert [ans.data for ans in answers] == \
+            [['Michelle Obama'], ['2.29'], ['Beijing'], ['Michelle Obama']]
+        assert len(self.queries) == 1
+        assert 'VALUES (?subject ?p ?ps ?psv)' in self.queries[0]
+        assert '(wd:Q41421 p:P2048 ps:P2048 psv:P2048)' in self.queries[0]
+        assert answers[0].sparql_query == self.queries[0]
+
+    def test_batch_size(self):
+        pairs = [('Q76', 'P26'), ('Q41421', 'P2048'), ('Q148', 'P36')]
+        answers = self.wd.get_properties(pairs, batch_size=2)
+        assert [ans.data for ans in answers] == [['Michelle Obama'], ['2.29'], ['Beijing']]
+        assert len(self.queries) == 2
+
+    def test_batches_unique_in_order(self):
+        pairs = [('Q%d' % (i % 3), 'P26') for i in xrange(1000)]
+        assert self.wd._property_batches(pairs, batch_size=2) == \
+            [[('Q0', 'P26'), ('Q1', 'P26')], [('Q2', 'P26')]]
+
+    def test_failed_batch(self):
+        self.failing.add('Q148')
+        pairs = [('Q76', 'P26'), ('Q148', 'P36'), ('Q5', 'P26')]
+        answers = self.wd.get_properties(pairs, batch_size=1)
+        assert answers[0].data == ['Michelle Obama']
+        assert answers[1] is None
+        assert answers[2].data is None
+
+
+class EndpointLimitsTest(unittest.TestCase):
+
+    def test_endpoint_limits(self):
+        wd = WikiData(limits={'rate': 20, 'max_limit': 50})
+        sparql = wd.limiter(wd.WDSPARQL_URL + '?format=json')
+        assert (sparql.limit, sparql.max_limit, sparql.bucket.rate) == (5, 5, 20)
+        search = wd.limiter(wd.WIKIDATA_URL)
+        assert (search.limit, search.max_limit) == (10, 50)
+        assert wd.limiter(wd.WDSPARQL_URL) is sparql
+
+
+class AgeAnswerTest(unittest.TestCase):
+
+    def test_age(self):
+        wd = WikiData()
+        ans = wd._age_answer(WikiDataAnswer(sparql_query='', data=[datetime(1961, 8, 4)]))
+        assert ans.data >= 55
+
+    def test_no_date_of_birth(self):
+        wd = WikiData()
+        assert wd._age_answer(WikiDataAnswer(sparql_query='', bindings=[])) is None
+        assert wd._age_answer(WikiDataAnswer(sparql_query='', data=[])) is None
+        assert wd._age_answer(None) is None
+
+    def test_bce_date_of_birth(self):
+        wd = WikiData()
+        ans = WikiDataAnswer(sparql_query='', bindings=[{
+            'valLabel': {'value': '-0500-01-01T00:00:00Z'},
+            'type': {'value': WikiDataAnswer.TIME_VALUE},
+        }])
+        assert wd._age_answer(ans) is None
+
+
+class AnswerCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        super(AnswerCacheTest, self).setUp()
+        self.wd = WikiData()
+        self.wd._get_ids = lambda lookups: dict((lookup, 'Q76') for lookup in lookups)
+        self.queries = []
+
+        def get(url, params):
+            self.queries.append(params['query'])
+            return {'results': {'bindings': [{
+                'valLabel': {'value': '1961-08-04T00:00:00Z'},
+                'type': {'value': WikiDataAnswer.TIME_VALUE},
+            }]}}
+        self.wd.get = get
+
+    def test_lazy_on_miss(self):
+        ans = self.wd._get_property('obama', 'date of birth', 'P569')
+        assert ans._data is UNDECODED
+        cached = self.wd._get_property('obama', 'date of birth', 'P569')
+        assert cached._data is UNDECODED
+        assert cached.data == ans.data == [datetime(1961, 8, 4)]
+        assert len(self.queries) == 1
+
+    def test_caller_owns_answer(self):
+        ans = self.wd.get_property('how', 'obama', 'age')
+        assert ans.data >= 55
+        ans = self.wd._get_property('obama', 'date of birth', 'P569')
+        ans.data.append(None)
+        assert self.wd._get_property('obama', 'date of birth', 'P569').data == \
+            [datetime(1961, 8, 4)]
+        assert len(self.queries) == 1
+
+
+class StreamEntitiesTest(unittest.TestCase):
+
+    def setUp(self):
+        super(StreamEntitiesTest, self).setUp()
+        self.wd = WikiData()
+        self.wd._get_ids = lambda lookups: dict((lookup, 'Q5') for lookup in lookups)
+        self.wd.get = self.get
+        self.names = ['Person %02d' % i for i in xrange(25)]
+        self.queries = []
+
+    def get(self, url, params={}):
+        query = params['query']
+        self.queries.append(query)
+        limit = int(re.search(r'LIMIT (\d+)', query).group(1))
+        offset = int(re.search(r'OFFSET (\d+)', query).group(1))
+        bindings = [{'valLabel': {'value': name}}
+                    for name in self.names[offset:offset + limit]]
+        return {'results': {'bindings': bindings}}
+
+    def test_stream(self):
+        values = self.wd.stream_entities('who', 'human', [], page_size=10)
+        assert self.queries == []
+        assert list(values) == self.names
+        assert len(self.queries) == 3
+        assert 'ORDER BY ?val' in self.queries[0]
+
+    def test_stream_lazily(self):
+        values = self.wd.stream_entities('who', 'human', [], page_size=10)
+        assert list(itertools.islice(values, 5)) == self.names[:5]
+        assert len(self.queries) == 1
+
+    def test_stream_limit(self):
+        values = self.wd.stream_entities('which', 'human', [], page_size=10, limit=12)
+        assert list(values) == self.names[:12]
+        assert ['LIMIT 10' in self.queries[0], 'LIMIT 2' in self.queries[1]] == [True, True]
+
+    def test_stream_count(self):
+        self.assertRaises(ValueError, self.wd.stream_entities, 'how many', 'human', [])
+
+    def test_find_entity_limit(self):
+        query = self.wd._find_entity_query(
+            'who', 'human', [], {('human', 'item'): 'Q5'}, limit=5)
+        assert query.endswith('LIMIT 5')
+        query = self.wd._find_entity_query(
+            'how many', 'human', [], {('human', 'item'): 'Q5'}, limit=5)
+        assert 'LIMIT' not in query
+
+    def test_find_entity_unknown_property(self):
+        ids = {('country', 'item'): 'Q6256', ('blorp', 'property'): None,
+               ('france', 'item'): 'Q142'}
+        assert self.wd._find_entity_query(
+            'how many', 'country', [('blorp', '1000', '>')], ids) is None
+        assert self.wd._find_entity_query(
+            'which', 'country', [('blorp', 'france', 'by')], ids) is None
+
+
+class DecoderTest(unittest.TestCase):
+
+    def test_parse_time(self):
+        assert parse_time('1961-08-04T00:00:00Z') == datetime(1961, 8, 4)
+        assert parse_time('+1961-00-00T00:00:00Z') == datetime(1961, 1, 1)
+        assert parse_time('2001-05-06T07:08:09.5Z') == datetime(2001, 5, 6, 7, 8, 9, 500000)
+        assert parse_time('-0050-01-01T00:00:00Z') == '-0050-01-01T00:00:00Z'
+        assert parse_time('0000-01-01T00:00:00Z') == '0000-01-01T00:00:00Z'
+        assert parse_time('12345-01-01T00:00:00Z') == '12345-01-01T00:00:00Z'
+        assert parse_time('1961-08-04') == datetime(1961, 8, 4)
+        assert parse_time('sometime') == 'sometime'
+
+    def test_get_data(self):
+        bindings = [
+            {'valLabel': {'value': 'Michelle Obama'}},
+            {'valLabel': {'value': '1961-08-04T00:00:00Z'},
+             'type': {'value': WikiDataAnswer.TIME_VALUE}},
+            {'valLabel': {'value': '1409517397'},
+             'type': {'value': WikiDataAnswer.QUANTITY_VALUE}},
+            {'valLabel': {'value': '2.29'},
+             'type': {'value': WikiDataAnswer.QUANTITY_VALUE}},
+            {},
+        ]
+        assert WikiDataAnswer.get_data(bindings) == \
+            ['Michelle Obama', datetime(1961, 8, 4), 1409517397.0, '2.29', None]
+        assert WikiDataAnswer.get_value(bindings[1]) == datetime(1961, 8, 4)
+
+    def test_lazy_data(self):
+        ans = WikiDataAnswer(None, bindings=[{'valLabel': {'value': 'Honolulu'}}])
+        assert ans._data is UNDECODED
+        assert ans.data == ['Honolulu']
+        ans.data = 54
+        assert ans.data == 54
+        assert WikiDataAnswer(None, data='3').data == '3'
+
+    def test_dgetter(self):
+        d = {'a': [{'b': 1}], 'c': {'d': ''}}
+        for key in ['a.0.b', 'c.d', 'a.b', 'c.d.e', 'x', 'a.1.b']:
+            assert dgetter(key, 'default')(d) == dget(d, key, 'default')